@@ -5,13 +5,14 @@ import numpy as np
 import argparse
 from easydict import EasyDict as edict
 from tl.utils.utils import str2bool
+from tl.utils.shards import write_shards
 
 import moabb
 from moabb.datasets import BNCI2014001, BNCI2014002, BNCI2015001
 from moabb.paradigms import MotorImagery, P300
 
 
-def dataset_to_file(dataset_name, data_save, data_path='./data/'):
+def dataset_to_file(dataset_name, data_save, data_path='./data/', shard=False):
     moabb.set_log_level("ERROR")
     if dataset_name == 'BNCI2014001':
         dataset = BNCI2014001()
@@ -37,7 +38,11 @@ def dataset_to_file(dataset_name, data_save, data_path='./data/'):
             os.makedirs(data_path)
         if not os.path.exists(data_path + dataset_name + '/'):
             os.makedirs(data_path + dataset_name + '/')
-        np.save(data_path + dataset_name + '/X', X)
+        if shard:
+            # one file per subject/session, memory-mapped by the loaders
+            write_shards(X, labels, meta['subject'].to_numpy(), meta['session'].to_numpy(), data_path + dataset_name + '/')
+        else:
+            np.save(data_path + dataset_name + '/X', X)
         np.save(data_path + dataset_name + '/labels', labels)
         meta.to_csv(data_path + dataset_name + '/meta.csv')
         print('done!')
@@ -57,19 +62,22 @@ if __name__ == '__main__':
     parser.add_argument('--dataset_name', type=str, default='BNCI2014001', help='the data set name, now support BNCI2014001, BNCI2014002, BNCI2015001 from moabb')
     parser.add_argument('--data_save', type=str2bool, default=True, help='whether save the data to file')
     parser.add_argument('--data_path', type=str, default='./data/', help='the path to save the data')
+    parser.add_argument('--shard', type=str2bool, default=False, help='whether save the data as per-subject/session shards instead of a single X.npy')
     args = parser.parse_args()
 
     dataset_name = args.dataset_name
     data_save = args.data_save
     data_path = args.data_path
+    shard = args.shard
 
     print('dataset_name: {}, type: {}'.format(dataset_name, type(dataset_name)))
     print('data_save: {}, type: {}'.format(data_save, type(data_save)))
     print('data_path: {}, type: {}'.format(data_path, type(data_path)))
+    print('shard: {}, type: {}'.format(shard, type(shard)))
 
     # load the dataset
     if dataset_name in ['BNCI2014001', 'BNCI2014002', 'BNCI2015001']:
-        info = dataset_to_file(dataset_name, data_save=data_save, data_path=data_path)
+        info = dataset_to_file(dataset_name, data_save=data_save, data_path=data_path, shard=shard)
 
     '''
     BNCI2014001
@@ -17,6 +17,7 @@ import sys
 import os
 
 from utils.alg_utils import EA
+from tl.utils.shards import load_trials
 from utils.data_utils import traintest_split_cross_subject
 
 
@@ -43,11 +44,9 @@ def data_process(dataset):
     mne.set_log_level('warning')
 
     if dataset == 'BNCI2014001-4':
-        X = np.load('./data/' + 'BNCI2014001' + '/X.npy')
-        y = np.load('./data/' + 'BNCI2014001' + '/labels.npy')
+        X, y = load_trials('./data/' + 'BNCI2014001' + '/')
     else:
-        X = np.load('./data/' + dataset + '/X.npy')
-        y = np.load('./data/' + dataset + '/labels.npy')
+        X, y = load_trials('./data/' + dataset + '/')
     print(X.shape, y.shape)
 
     num_subjects, paradigm, sample_rate = None, None, None
@@ -134,11 +133,10 @@ def data_alignment(X, num_subjects):
     '''
     # subject-wise EA
     print('before EA:', X.shape)
-    out = []
-    for i in range(num_subjects):
-        tmp_x = EA(X[X.shape[0] // num_subjects * i:X.shape[0] // num_subjects * (i + 1), :, :])
-        out.append(tmp_x)
-    X = np.concatenate(out, axis=0)
+    # subjects hold equal numbers of trials, align all of them in one batched pass
+    trial_num = X.shape[0] // num_subjects
+    X = X[:trial_num * num_subjects].reshape(num_subjects, trial_num, X.shape[1], X.shape[2])
+    X = EA(X).reshape(num_subjects * trial_num, X.shape[2], X.shape[3])
     print('after EA:', X.shape)
     return X
 
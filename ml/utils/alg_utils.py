@@ -6,27 +6,50 @@ import numpy as np
 import torch
 
 import torch.nn.functional as F
-from scipy.linalg import fractional_matrix_power
 
 
-def EA(x):
+def inverse_sqrtm(R):
+    """
+    Parameters
+    ----------
+    R : numpy array
+        symmetric positive definite matrices of shape (..., num_channels, num_channels)
+
+    Returns
+    ----------
+    sqrtRefEA : numpy array
+        R^(-1/2) of shape (..., num_channels, num_channels), computed via symmetric eigendecomposition
+    """
+    w, v = np.linalg.eigh(R)
+    return np.matmul(v / np.sqrt(w)[..., None, :], np.swapaxes(v, -1, -2))
+
+
+def EA(x, dtype=np.float64, out=None):
     """
     Parameters
     ----------
     x : numpy array
         data of shape (num_samples, num_channels, num_time_samples)
+        or (num_subjects, num_samples, num_channels, num_time_samples), aligning each subject separately
+    dtype : numpy dtype
+        computation and output type, np.float32 halves the memory traffic for large arrays
+    out : numpy array
+        optional preallocated output of the same shape as x and type dtype
 
     Returns
     ----------
     XEA : numpy array
-        data of shape (num_samples, num_channels, num_time_samples)
+        data of the same shape as x
     """
-    cov = np.zeros((x.shape[0], x.shape[1], x.shape[1]))
-    for i in range(x.shape[0]):
-        cov[i] = np.cov(x[i])
-    refEA = np.mean(cov, 0)
-    sqrtRefEA = fractional_matrix_power(refEA, -0.5)
-    XEA = np.zeros(x.shape)
-    for i in range(x.shape[0]):
-        XEA[i] = np.dot(sqrtRefEA, x[i])
+    x = np.asarray(x, dtype=dtype)
+    num_time_samples = x.shape[-1]
+    # covariance matrices of all trials in one batched matmul, normalized as np.cov, of the centered trials so that
+    # large channel offsets do not cancel out the precision of float32
+    xc = x - np.mean(x, axis=-1, keepdims=True)
+    cov = np.matmul(xc, np.swapaxes(xc, -1, -2))
+    del xc
+    cov /= num_time_samples - 1
+    refEA = np.mean(cov, axis=-3)
+    sqrtRefEA = inverse_sqrtm(refEA.astype(np.float64)).astype(dtype)
+    XEA = np.matmul(sqrtRefEA[..., None, :, :], x, out=out)
     return XEA
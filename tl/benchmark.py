@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : benchmark.py
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from tl.utils.utils import str2bool
+from utils.network import backbone_net
+from utils.utils import fuse_for_inference
+from utils.export import EXPORT_MODES, export_predictor, check_predictor
+from utils.quantize import QuantizedPredictor
+from utils.onnx_export import OnnxPredictor, export_onnx, ort
+from utils.resample import get_dataset_params
+
+# Per-trial prediction latency and model size of the source model for each dataset shape: eager, with BatchNorm folded
+# into the convolutions of EEGNet (EEGNet_fused), exported by tracing, scripting or compiling, INT8 quantized, and run
+# by onnxruntime, after checking that every float variant gives the same outputs as the eager model, and how often the
+# INT8 one agrees. Cold start is the time from the weights, or the ONNX file, to the first prediction. With --resample,
+# the shapes are those of trials resampled to 128 Hz, see utils/resample.py.
+
+
+def dataset_args(data_name, resample=False):
+    # N: number of subjects, chn: number of channels
+    if data_name == 'BNCI2014001': paradigm, N, chn, class_num, time_sample_num, sample_rate, trial_num, feature_deep_dim = 'MI', 9, 22, 2, 1001, 250, 144, 248
+    if data_name == 'BNCI2014002': paradigm, N, chn, class_num, time_sample_num, sample_rate, trial_num, feature_deep_dim = 'MI', 14, 15, 2, 2561, 512, 100, 640
+    if data_name == 'BNCI2015001': paradigm, N, chn, class_num, time_sample_num, sample_rate, trial_num, feature_deep_dim = 'MI', 12, 13, 2, 2561, 512, 200, 640
+    if data_name == 'BNCI2014001-4': paradigm, N, chn, class_num, time_sample_num, sample_rate, trial_num, feature_deep_dim = 'MI', 9, 22, 4, 1001, 250, 288, 248
+    time_sample_num, sample_rate, feature_deep_dim = get_dataset_params(data_name, time_sample_num, sample_rate, resample)
+    return argparse.Namespace(paradigm=paradigm, N=N, chn=chn, class_num=class_num, time_sample_num=time_sample_num,
+                              sample_rate=sample_rate, trial_num=trial_num, feature_deep_dim=feature_deep_dim)
+
+
+def source_model(args, ckpt=None):
+    netF, netC = backbone_net(args, return_type='xy')
+    base_network = nn.Sequential(netF, netC)
+    if ckpt is not None:
+        base_network.load_state_dict(torch.load(ckpt, map_location='cpu'))
+    else:
+        # running statistics and affine parameters away from their initial values, so that folding is not trivial
+        for m in base_network.modules():
+            if isinstance(m, nn.BatchNorm2d):
+                m.running_mean.normal_()
+                m.running_var.uniform_(0.5, 2)
+                m.weight.data.normal_(1, 0.3)
+                m.bias.data.normal_()
+    return base_network.eval()
+
+
+def model_size(model):
+    # size of the serialized state dict, in KB
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1024
+
+
+def time_trials(predictor, x, warmup):
+    """
+    Parameters
+    ----------
+    predictor : callable
+        model to time
+    x : torch tensor
+        trials of shape (num_trials, 1, num_channels, num_time_samples), predicted one by one
+    warmup : int
+        number of untimed predictions first
+
+    Returns
+    ----------
+    latency : numpy array
+        time of every prediction, in ms
+    """
+    latency = []
+    with torch.no_grad():
+        for i in range(warmup):
+            predictor(x[i % len(x)][None])
+        for i in range(len(x)):
+            if x.is_cuda:
+                torch.cuda.synchronize()
+            start_time = time.perf_counter()
+            predictor(x[i][None])
+            if x.is_cuda:
+                torch.cuda.synchronize()
+            latency.append(time.perf_counter() - start_time)
+    return np.array(latency) * 1000
+
+
+if __name__ == '__main__':
+
+    # parse args
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset_name', type=str, default='all', help='the data set name setting the input shape, all for every supported one')
+    parser.add_argument('--ckpt', type=str, default=None, help='source model checkpoint, random BatchNorm statistics if not given')
+    parser.add_argument('--temporal_conv', type=str, default='conv2d', choices=['conv2d', 'conv1d', 'fft', 'auto'], help='implementation of the temporal convolution of EEGNet')
+    parser.add_argument('--modes', type=str, default=','.join(EXPORT_MODES), help='comma-separated export modes to benchmark')
+    parser.add_argument('--n_trials', type=int, default=500, help='number of timed single-trial predictions')
+    parser.add_argument('--warmup', type=int, default=50, help='number of untimed predictions first')
+    parser.add_argument('--tol', type=float, default=1e-4, help='maximum absolute difference allowed with the eager outputs')
+    parser.add_argument('--quant_backend', type=str, default='x86', help='quantized engine of the INT8 model, none to skip it')
+    parser.add_argument('--onnx', type=str2bool, default=True, help='whether benchmark onnxruntime prediction, which needs onnxruntime')
+    parser.add_argument('--resample', type=str2bool, default=False, help='whether benchmark the input shapes of trials resampled to 128 Hz for the 512 Hz datasets')
+    parser.add_argument('--gpu', type=str2bool, default=False, help='whether run on GPU')
+    args = parser.parse_args()
+
+    data_name_list = ['BNCI2014001', 'BNCI2014002', 'BNCI2015001', 'BNCI2014001-4']
+    if args.dataset_name != 'all':
+        data_name_list = [args.dataset_name]
+    device = torch.device('cuda' if args.gpu else 'cpu')
+
+    for data_name in data_name_list:
+        torch.manual_seed(42)
+        data_args = dataset_args(data_name, args.resample)
+        data_args.temporal_conv = args.temporal_conv
+        model = source_model(data_args, args.ckpt).to(device)
+        fused = fuse_for_inference(model)
+        x = torch.randn(args.n_trials, 1, data_args.chn, data_args.time_sample_num, device=device)
+        print('#' * 20, data_name, tuple(x.shape[1:]), '#' * 20)
+
+        for name, variant in [('', model), ('fused ', fused)]:
+            for mode in args.modes.split(','):
+                predictor, used = export_predictor(variant, data_args.chn, data_args.time_sample_num, mode, device, args.tol)
+                if used != mode:
+                    continue
+                diff = max(check_predictor(model, predictor, x[i][None]) for i in range(8))
+                assert diff <= args.tol, name + mode + ' predictor differs from the eager model by ' + str(diff)
+                latency = time_trials(predictor, x, args.warmup)
+                print('{:<16} p50 {:.3f} ms, p99 {:.3f} ms, {:.1f} KB, max abs difference {:.2e}'.format(
+                    name + mode, np.percentile(latency, 50), np.percentile(latency, 99), model_size(variant), diff))
+
+        if args.quant_backend != 'none':
+            # calibrated on half of these trials, labelled by the float model so that the accuracy is its agreement
+            calib = x[:256].cpu()
+            with torch.no_grad():
+                labels = torch.cat([model(calib[i:i + 64].to(device))[1].argmax(dim=1).cpu() for i in range(0, len(calib), 64)])
+            quantized = QuantizedPredictor(model, (calib, labels), backend=args.quant_backend)
+            latency = time_trials(quantized, x, args.warmup)
+            print('{:<16} p50 {:.3f} ms, p99 {:.3f} ms, {:.1f} KB, agreement with float {:.2f}%'.format(
+                'int8 ' + args.quant_backend, np.percentile(latency, 50), np.percentile(latency, 99),
+                model_size(quantized.qmodel), quantized.acc_quant))
+
+        if args.onnx and ort is not None:
+            for name, dynamic_batch in [('onnx', False), ('onnx dynamic', True)]:
+                predictor = OnnxPredictor(model, data_args.chn, data_args.time_sample_num, dynamic_batch=dynamic_batch)
+                diff = max(check_predictor(model, predictor, x[i][None]) for i in range(8))
+                assert diff <= args.tol, name + ' predictor differs from the eager model by ' + str(diff)
+                latency = time_trials(predictor, x, args.warmup)
+                buffer = io.BytesIO()
+                export_onnx(model, buffer, data_args.chn, data_args.time_sample_num, dynamic_batch)
+                print('{:<16} p50 {:.3f} ms, p99 {:.3f} ms, {:.1f} KB, max abs difference {:.2e}'.format(
+                    name, np.percentile(latency, 50), np.percentile(latency, 99), buffer.tell() / 1024, diff))
+
+            state_dict = model.state_dict()
+            cold_start = {}
+            with torch.no_grad():
+                start_time = time.perf_counter()
+                netF, netC = backbone_net(data_args, return_type='xy')
+                base_network = nn.Sequential(netF, netC).to(device)
+                base_network.load_state_dict(state_dict)
+                base_network.eval()(x[:1])
+                cold_start['eager'] = time.perf_counter() - start_time
+
+                start_time = time.perf_counter()
+                OnnxPredictor(model, data_args.chn, data_args.time_sample_num, dynamic_batch=False)(x[:1])
+                cold_start['onnx export'] = time.perf_counter() - start_time
+
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    path = os.path.join(tmp_dir, data_name + '.onnx')
+                    export_onnx(model, path, data_args.chn, data_args.time_sample_num, dynamic_batch=False)
+                    start_time = time.perf_counter()
+                    session = ort.InferenceSession(path, providers=predictor.providers)
+                    session.run(None, {'x': x[:1].cpu().numpy()})
+                    cold_start['onnx file'] = time.perf_counter() - start_time
+            print('cold start:', ', '.join('{} {:.1f} ms'.format(k, v * 1000) for k, v in cold_start.items()))
+
+        start_time = time.perf_counter()
+        for _ in range(100):
+            fused[0].refresh(model[0])
+        print('refresh of the fused model after an update: {:.3f} ms'.format((time.perf_counter() - start_time) * 10))
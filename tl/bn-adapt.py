@@ -6,16 +6,18 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 import pandas as pd
-import csv
 
 from tl.utils.utils import str2bool
 from utils.network import backbone_net
-from utils.LogRecord import LogRecord
+from utils.runner import run_seeds
 from utils.dataloader import read_mi_combine_tar
-from utils.utils import fix_random_seed, cal_acc_comb, data_loader, cal_auc_comb, cal_score_online
+from utils.checkpoint import load_source, save_model
+from utils.pred_store import PredictionStore
+from utils.utils import cal_acc_comb, data_loader, cal_auc_comb, cal_score_online
 from utils.alg_utils import EA, EA_online
-from scipy.linalg import fractional_matrix_power
+from utils.tta_engine import AdaptStrategy, OnlineTTAEngine
 from utils.loss import Entropy
+from utils.resample import get_dataset_params, resample_suffix
 from sklearn.metrics import roc_auc_score, accuracy_score
 
 import gc
@@ -30,134 +32,32 @@ import time
 # @File    : bn-adapt.py
 # from github https://github.com/sylyoung/DeepTransferEEG/tree/main
 
-def BN_adapt(loader, model, args, balanced=True):
-
-    if balanced == False and args.data_name == 'BNCI2014001-4':
-        print('ERROR, imbalanced multi-class not implemented')
-        sys.exit(0)
-
-    y_true = []
-    y_pred = []
-
-    # initialize test reference matrix for Incremental EA
-    if args.align:
-        R = 0
+class BNAdaptStrategy(AdaptStrategy):
+    # forward passes over the sliding batch, updating the BN statistics only
+    # no parameter is trained, so every trial only goes through the temporal convolution once
+    cache_prefix = True
 
-    iter_test = iter(loader)
+    def adapt(self, batch_test, i):
+        model = self.model
+        for step in range(self.args.steps):
 
-    # loop through test data stream one by one
-    for i in range(len(loader)):
-        #################### Phase 1: target label prediction ####################
-        model.eval()
-        data = next(iter_test)
-        inputs = data[0]
-        labels = data[1]
-        inputs = inputs.reshape(1, 1, inputs.shape[-2], inputs.shape[-1]).cpu()
+            model[0].block1[2].train()
+            model[0].block1[4].train()
+            model[0].block2[3].train()
 
-        # accumulate test data
-        if i == 0:
-            data_cum = inputs.float().cpu()
-        else:
-            data_cum = torch.cat((data_cum, inputs.float().cpu()), 0)
+            # forward pass for model BN update
+            _, outputs = self.batch_model(batch_test)
 
-        # Incremental EA
-        if args.align:
-            start_time = time.time()
-
-            if i == 0:
-                sample_test = data_cum.reshape(args.chn, args.time_sample_num)
-            else:
-                sample_test = data_cum[i].reshape(args.chn, args.time_sample_num)
-            # update reference matrix
-            R = EA_online(sample_test, R, i)
-
-            sqrtRefEA = fractional_matrix_power(R, -0.5)
-            # transform current test sample
-            sample_test = np.dot(sqrtRefEA, sample_test)
-
-            EA_time = time.time()
-            if args.calc_time:
-                print('sample ', str(i), ', pre-inference IEA finished time in ms:', np.round((EA_time - start_time) * 1000, 3))
-            sample_test = sample_test.reshape(1, 1, args.chn, args.time_sample_num)
-        else:
-            sample_test = data_cum[i].numpy()
-            sample_test = sample_test.reshape(1, 1, sample_test.shape[1], sample_test.shape[2])
+            model[0].block1[2].eval()
+            model[0].block1[4].eval()
+            model[0].block2[3].eval()
 
-        if args.data_env != 'local':
-            sample_test = torch.from_numpy(sample_test).to(torch.float32).cuda()
-        else:
-            sample_test = torch.from_numpy(sample_test).to(torch.float32)
-
-        _, outputs = model(sample_test)
-
-        softmax_out = nn.Softmax(dim=1)(outputs)
-
-        outputs = outputs.float().cpu()
-        labels = labels.float().cpu()
-        _, predict = torch.max(outputs, 1)
-
-        y_pred.append(softmax_out.detach().cpu().numpy())
-        y_true.append(labels.item())
-
-        #################### Phase 2: target model update ####################
-        model.train()
-        # sliding batch
-        if (i + 1) >= args.test_batch and (i + 1) % args.stride == 0:
-            if args.align:
-                batch_test = np.copy(data_cum[i - args.test_batch + 1:i + 1])
-                # transform test batch
-                batch_test = np.dot(sqrtRefEA, batch_test)
-                batch_test = np.transpose(batch_test, (1, 2, 0, 3))
-            else:
-                batch_test = data_cum[i - args.test_batch + 1:i + 1].numpy()
-                batch_test = batch_test.reshape(args.test_batch, 1, batch_test.shape[2], batch_test.shape[3])
-
-            if args.data_env != 'local':
-                batch_test = torch.from_numpy(batch_test).to(torch.float32).cuda()
-            else:
-                batch_test = torch.from_numpy(batch_test).to(torch.float32)
-
-            start_time = time.time()
-            for step in range(args.steps):
-
-                model[0].block1[2].train()
-                model[0].block1[4].train()
-                model[0].block2[3].train()
-
-                # forward pass for model BN update
-                _, outputs = model(batch_test)
-
-                model[0].block1[2].eval()
-                model[0].block1[4].eval()
-                model[0].block2[3].eval()
-
-            TTA_time = time.time()
-            if args.calc_time:
-                print('sample ', str(i), ', post-inference model update finished in ms:', np.round((TTA_time - start_time) * 1000, 3))
-
-        model.eval()
-
-    if balanced:
-        _, predict = torch.max(torch.from_numpy(np.array(y_pred)).to(torch.float32).reshape(-1, args.class_num), 1)
-        pred = torch.squeeze(predict).float()
-        score = accuracy_score(y_true, pred)
-        if args.data_name == 'BNCI2014001-4':
-            y_pred = np.array(y_pred).reshape(-1, )  # multiclass
-        else:
-            y_pred = np.array(y_pred).reshape(-1, args.class_num)[:, 1]  # binary
-    else:
-        predict = torch.from_numpy(np.array(y_pred)).to(torch.float32).reshape(-1, args.class_num)
-        y_pred = np.array(predict).reshape(-1, args.class_num)[:, 1]  # binary
-        score = roc_auc_score(y_true, y_pred)
 
-    return score * 100, y_pred
+def BN_adapt(loader, model, args, balanced=True):
+    return OnlineTTAEngine(BNAdaptStrategy(model, args, balanced), args, balanced).run(loader)
 
 
 def train_target(args):
-    if not args.align:
-        extra_string = '_noEA'
-    else:
-        extra_string = ''
     X_src, y_src, X_tar, y_tar = read_mi_combine_tar(args)
     print('X_src, y_src, X_tar, y_tar:', X_src.shape, y_src.shape, X_tar.shape, y_tar.shape)
     dset_loaders = data_loader(X_src, y_src, X_tar, y_tar, args)
@@ -169,12 +69,7 @@ def train_target(args):
 
     if args.max_epoch == 0:
         if args.align:
-            if args.data_env != 'local':
-                base_network.load_state_dict(torch.load('./runs/' + str(args.data_name) + '/' + str(args.backbone) +
-                    '_S' + str(args.idt) + '_seed' + str(args.SEED) + extra_string + '.ckpt'))
-            else:
-                base_network.load_state_dict(torch.load('./runs/' + str(args.data_name) + '/' + str(args.backbone) +
-                    '_S' + str(args.idt) + '_seed' + str(args.SEED) + extra_string + '.ckpt', map_location=torch.device('cpu')))
+            load_source(base_network, args)
     else:
         criterion = nn.CrossEntropyLoss()
         optimizer_f = optim.Adam(netF.parameters(), lr=args.lr)
@@ -223,9 +118,7 @@ def train_target(args):
                 base_network.train()
 
         print('saving model...')
-        torch.save(base_network.state_dict(),
-                   './runs/' + str(args.data_name) + '/' + str(args.backbone) + '_S' + str(
-                       args.idt) + '_seed' + str(args.SEED) + extra_string + '.ckpt')
+        save_model(base_network, args)
 
 
     base_network.eval()
@@ -255,13 +148,10 @@ def train_target(args):
     else:
         print('Test AUC = {:.2f}%'.format(acc_t_te))
 
-    torch.save(base_network.state_dict(), './runs/' + str(args.data_name) + '/' + str(args.backbone) + '_S' + str(args.idt) + '_seed' + str(
-        args.SEED) + extra_string + '_adapted' + '.ckpt')
+    save_model(base_network, args, adapted=True)
 
     # save the predictions for ensemble
-    with open('./logs/' + str(args.data_name) + '_' + str(args.method) + '_seed_' + str(args.SEED) +"_pred.csv", 'a') as f:
-        writer = csv.writer(f)
-        writer.writerow(y_pred)
+    PredictionStore().save(args.data_name, args.method + resample_suffix(args), args.SEED, args.idt, y_pred)
 
     gc.collect()
     if args.data_env != 'local':
@@ -279,6 +169,7 @@ if __name__ == '__main__':
     parser.add_argument('--data_path', type=str, default='./data/', help='the path to save the data')
     parser.add_argument('--log_path', type=str, default='./logs/', help='the path to save the logs')
     parser.add_argument('--gpu_idx', type=int, default=0, help='index of GPU')
+    parser.add_argument('--n_jobs', type=int, default=1, help='number of (seed, subject) tasks to run in parallel, 1 runs them serially')
     args = parser.parse_args()
 
     data_name = args.dataset_name
@@ -286,12 +177,14 @@ if __name__ == '__main__':
     data_path = args.data_path
     log_path = args.log_path
     gpu_idx = args.gpu_idx
+    n_jobs = args.n_jobs
 
     print('dataset_name: {}, type: {}'.format(data_name, type(data_name)))
     print('data_save: {}, type: {}'.format(data_save, type(data_save)))
     print('data_path: {}, type: {}'.format(data_path, type(data_path)))
     print('log_path: {}, type: {}'.format(log_path, type(log_path)))
     print('gpu_idx: {}, type: {}'.format(gpu_idx, type(gpu_idx)))
+    print('n_jobs: {}, type: {}'.format(n_jobs, type(n_jobs)))
 
     data_name_list = ['BNCI2014001', 'BNCI2014002', 'BNCI2015001', 'BNCI2014001-4']
 
@@ -336,10 +229,16 @@ if __name__ == '__main__':
         # whether to record running time
         calc_time = False
 
+        # whether feed the backbone trials resampled to RESAMPLE_RATES, 128 Hz for the 512 Hz datasets, shrinking
+        # time_sample_num and feature_deep_dim, see utils/resample.py
+        resample = False
+        time_sample_num, sample_rate, feature_deep_dim = get_dataset_params(data_name, time_sample_num, sample_rate, resample)
+
         args = argparse.Namespace(feature_deep_dim=feature_deep_dim, align=align, lr=lr, max_epoch=max_epoch,
                                   trial_num=trial_num, time_sample_num=time_sample_num, sample_rate=sample_rate,
                                   N=N, chn=chn, class_num=class_num, stride=stride, steps=steps, calc_time=calc_time,
                                   paradigm=paradigm, test_batch=test_batch, data_name=data_name, balanced=balanced)
+        args.resample = resample
 
         args.method = 'BN-adapt'
         args.backbone = 'EEGNet'
@@ -347,6 +246,13 @@ if __name__ == '__main__':
         # train batch size
         args.batch_size = 32
 
+        # number of (seed, subject) tasks to run in parallel, 1 runs them serially
+        args.n_jobs = n_jobs
+
+        # whether skip the model updates not triggered by prediction entropy, marginal shift or R drift, see AdaptScheduler
+        args.gate = False
+        args.gate_entropy, args.gate_shift, args.gate_drift, args.gate_max_skip = 0.4, 0.1, 0.005, 3
+
         # GPU device id
         try:
             device_id = gpu_idx
@@ -354,48 +260,13 @@ if __name__ == '__main__':
             args.data_env = 'gpu' if torch.cuda.device_count() != 0 else 'local'
         except:
             args.data_env = 'local'
-        total_acc = []
+
+        args.data = data_name
+        args.local_dir = data_path + str(data_name) + '/'
+        args.result_dir = log_path
 
         # update multiple models, independently, from the source models
-        for s in [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11]:
-            args.SEED = s
-
-            fix_random_seed(args.SEED)
-            torch.backends.cudnn.deterministic = True
-
-            args.data = data_name
-            print(args.data)
-            print(args.method)
-            print(args.SEED)
-            print(args)
-
-            args.local_dir = data_path + str(data_name) + '/'
-            args.result_dir = log_path
-            my_log = LogRecord(args)
-            my_log.log_init()
-            my_log.record('=' * 50 + '\n' + os.path.basename(__file__) + '\n' + '=' * 50)
-
-            sub_acc_all = np.zeros(N)
-            for idt in range(N):
-                args.idt = idt
-                source_str = 'Except_S' + str(idt)
-                target_str = 'S' + str(idt)
-                args.task_str = source_str + '_2_' + target_str
-                info_str = '\n========================== Transfer to ' + target_str + ' =========================='
-                print(info_str)
-                my_log.record(info_str)
-                args.log = my_log
-
-                sub_acc_all[idt] = train_target(args)
-            print('Sub acc: ', np.round(sub_acc_all, 3))
-            print('Avg acc: ', np.round(np.mean(sub_acc_all), 3))
-            total_acc.append(sub_acc_all)
-
-            acc_sub_str = str(np.round(sub_acc_all, 3).tolist())
-            acc_mean_str = str(np.round(np.mean(sub_acc_all), 3).tolist())
-            args.log.record("\n==========================================")
-            args.log.record(acc_sub_str)
-            args.log.record(acc_mean_str)
+        total_acc = run_seeds(train_target, args, [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11], os.path.basename(__file__))
 
         args.log.record('\n' + '#' * 20 + 'final results' + '#' * 20)
 
@@ -422,4 +293,4 @@ if __name__ == '__main__':
         dct = dct.append(result_dct, ignore_index=True)
 
     # save results to csv
-    dct.to_csv(log_path + str(args.method) + ".csv")
\ No newline at end of file
+    dct.to_csv(log_path + str(args.method) + resample_suffix(args) + ".csv")
\ No newline at end of file
@@ -9,10 +9,11 @@ import pandas as pd
 
 from tl.utils.utils import str2bool
 from utils.network import backbone_net
-from utils.LogRecord import LogRecord
+from utils.runner import run_seeds
 from utils.dataloader import read_mi_combine_tar
-from utils.utils import lr_scheduler_full, fix_random_seed, cal_acc_comb, data_loader
+from utils.utils import lr_scheduler_full, cal_acc_comb, data_loader
 from utils.loss import MultipleKernelMaximumMeanDiscrepancy, GaussianKernel
+from utils.resample import get_dataset_params, resample_suffix
 
 import gc
 import sys
@@ -106,6 +107,7 @@ if __name__ == '__main__':
     parser.add_argument('--data_path', type=str, default='./data/', help='the path to save the data')
     parser.add_argument('--log_path', type=str, default='./logs/', help='the path to save the logs')
     parser.add_argument('--gpu_idx', type=int, default=0, help='index of GPU')
+    parser.add_argument('--n_jobs', type=int, default=1, help='number of (seed, subject) tasks to run in parallel, 1 runs them serially')
     args = parser.parse_args()
 
     data_name = args.dataset_name
@@ -113,12 +115,14 @@ if __name__ == '__main__':
     data_path = args.data_path
     log_path = args.log_path
     gpu_idx = args.gpu_idx
+    n_jobs = args.n_jobs
 
     print('dataset_name: {}, type: {}'.format(data_name, type(data_name)))
     print('data_save: {}, type: {}'.format(data_save, type(data_save)))
     print('data_path: {}, type: {}'.format(data_path, type(data_path)))
     print('log_path: {}, type: {}'.format(log_path, type(log_path)))
     print('gpu_idx: {}, type: {}'.format(gpu_idx, type(gpu_idx)))
+    print('n_jobs: {}, type: {}'.format(n_jobs, type(n_jobs)))
 
     data_name_list = ['BNCI2014001', 'BNCI2014002', 'BNCI2015001']
 
@@ -132,9 +136,15 @@ if __name__ == '__main__':
         if data_name == 'BNCI2014002': paradigm, N, chn, class_num, time_sample_num, sample_rate, trial_num, feature_deep_dim = 'MI', 14, 15, 2, 2561, 512, 100, 640
         if data_name == 'BNCI2015001': paradigm, N, chn, class_num, time_sample_num, sample_rate, trial_num, feature_deep_dim = 'MI', 12, 13, 2, 2561, 512, 200, 640
 
+        # whether feed the backbone trials resampled to RESAMPLE_RATES, 128 Hz for the 512 Hz datasets, shrinking
+        # time_sample_num and feature_deep_dim, see utils/resample.py
+        resample = False
+        time_sample_num, sample_rate, feature_deep_dim = get_dataset_params(data_name, time_sample_num, sample_rate, resample)
+
         args = argparse.Namespace(feature_deep_dim=feature_deep_dim, trial_num=trial_num,
                                   time_sample_num=time_sample_num, sample_rate=sample_rate,
                                   N=N, chn=chn, class_num=class_num, paradigm=paradigm, data_name=data_name)
+        args.resample = resample
 
         # Set the method and model
         args.method = 'DAN'
@@ -154,6 +164,9 @@ if __name__ == '__main__':
         # training epochs
         args.max_epoch = 100
 
+        # number of (seed, subject) tasks to run in parallel, 1 runs them serially
+        args.n_jobs = n_jobs
+
         # GPU device id
         try:
             device_id = gpu_idx
@@ -162,47 +175,11 @@ if __name__ == '__main__':
         except:
             args.data_env = 'local'
 
-        total_acc = []
-
-        for s in [3407, 42, 126, 168, 210]:
-            args.SEED = s
-
-            fix_random_seed(args.SEED)
-            torch.backends.cudnn.deterministic = True
-
-            args.data = data_name
-            print(args.data)
-            print(args.method)
-            print(args.SEED)
-            print(args)
-
-            args.local_dir = data_path + str(data_name) + '/'
-            args.result_dir = log_path
-            my_log = LogRecord(args)
-            my_log.log_init()
-            my_log.record('=' * 50 + '\n' + os.path.basename(__file__) + '\n' + '=' * 50)
-
-            sub_acc_all = np.zeros(N)
-            for idt in range(N):
-                args.idt = idt
-                source_str = 'Except_S' + str(idt)
-                target_str = 'S' + str(idt)
-                args.task_str = source_str + '_2_' + target_str
-                info_str = '\n========================== Transfer to ' + target_str + ' =========================='
-                print(info_str)
-                my_log.record(info_str)
-                args.log = my_log
-
-                sub_acc_all[idt] = train_target(args)
-            print('Sub acc: ', np.round(sub_acc_all, 3))
-            print('Avg acc: ', np.round(np.mean(sub_acc_all), 3))
-            total_acc.append(sub_acc_all)
-
-            acc_sub_str = str(np.round(sub_acc_all, 3).tolist())
-            acc_mean_str = str(np.round(np.mean(sub_acc_all), 3).tolist())
-            args.log.record("\n==========================================")
-            args.log.record(acc_sub_str)
-            args.log.record(acc_mean_str)
+        args.data = data_name
+        args.local_dir = data_path + str(data_name) + '/'
+        args.result_dir = log_path
+
+        total_acc = run_seeds(train_target, args, [3407, 42, 126, 168, 210], os.path.basename(__file__))
 
         args.log.record('\n' + '#' * 20 + 'final results' + '#' * 20)
 
@@ -229,4 +206,4 @@ if __name__ == '__main__':
         dct = dct.append(result_dct, ignore_index=True)
 
     # save results to csv
-    dct.to_csv(log_path + str(args.method) + ".csv")
\ No newline at end of file
+    dct.to_csv(log_path + str(args.method) + resample_suffix(args) + ".csv")
\ No newline at end of file
@@ -1,6 +1,144 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
+import copy
 import sys
+import time
+from typing import Optional
+
+# implementation picked by temporal_conv(impl='auto'), for each (input shape, kernel length, device, dtype, backward)
+_auto_impl = {}
+# time in ms per run of each candidate for the same keys, or the error of a failing candidate
+_auto_timing = {}
+
+
+def temporal_conv(x: torch.Tensor, weight: torch.Tensor, bias: Optional[torch.Tensor] = None,
+                  impl: str = 'conv2d') -> torch.Tensor:
+    """(1, kernel length) convolution without padding, each output channel reading a single input channel.
+
+    Parameters
+    ----------
+    x : torch tensor
+        input of shape (batch, in_channels, height, time), in_channels being 1 or out_channels (depthwise)
+    weight : torch tensor
+        filters of shape (out_channels, 1, 1, kernel_length), as in nn.Conv2d
+    bias : torch tensor
+        bias of shape (out_channels,), or None
+    impl : str
+        conv2d: F.conv2d as nn.Conv2d,
+        conv1d: F.conv1d over the rows of x, put in the batch dimension,
+        fft: product of the real FFTs of x and of the flipped filters, in O(time * log(time)) whatever the kernel length,
+        auto: the fastest of the three on this input, timed on first use
+
+    Returns
+    ----------
+    output : torch tensor
+        of shape (batch, out_channels, height, time - kernel_length + 1)
+    """
+    if impl == 'auto':
+        impl = pick_temporal_conv(x, weight, bias)
+    groups = x.size(1)
+    if impl == 'conv2d':
+        return F.conv2d(x, weight, bias, groups=groups)
+    if impl == 'conv1d':
+        batch, height = x.size(0), x.size(2)
+        output = F.conv1d(x.transpose(1, 2).reshape(batch * height, groups, -1), weight[:, :, 0, :], bias, groups=groups)
+        return output.reshape(batch, height, weight.size(0), -1).transpose(1, 2)
+    if impl == 'fft':
+        # nn.Conv2d is a cross-correlation, hence the flip. A circular convolution of length time only wraps around
+        # on the first kernel_length - 1 outputs, which are the ones dropped
+        length, kernel_length = x.size(-1), weight.size(-1)
+        spectrum = torch.fft.rfft(x, n=length) * torch.fft.rfft(weight[:, 0].flip(-1), n=length)
+        output = torch.fft.irfft(spectrum, n=length)[..., kernel_length - 1:]
+        if bias is not None:
+            output = output + bias.reshape(-1, 1, 1)
+        return output
+    raise ValueError('unknown temporal convolution implementation ' + str(impl))
+
+
+@torch.jit.ignore
+def pick_temporal_conv(x: torch.Tensor, weight: torch.Tensor, bias: Optional[torch.Tensor] = None) -> str:
+    """Fastest temporal_conv implementation for this input, timed once and then reused for inputs of the same kind.
+
+    The timing includes the backward pass if gradients are needed for the filters. Candidates failing on this input are
+    skipped. Inside torch.func transforms, conv2d is used. Nothing is printed, the choices of the process are given by
+    describe_auto_impl.
+
+    Returns
+    ----------
+    impl : str
+        conv2d, conv1d or fft
+    """
+    backward = torch.is_grad_enabled() and weight.requires_grad
+    key = (tuple(x.shape), weight.size(-1), x.device.type, x.dtype, backward)
+    if key not in _auto_impl:
+        repeats = 3
+        x = x.detach()
+        try:
+            w = weight.detach().requires_grad_(backward)
+        except RuntimeError:
+            # inside a torch.func transform, such as the vmap of TTIMEStackedStrategy, nothing can be timed
+            return 'conv2d'
+        b = None if bias is None else bias.detach().requires_grad_(backward)
+        timing = {}
+        skipped = {}
+        for impl in ['conv2d', 'conv1d', 'fft']:
+            try:
+                for i in range(repeats + 1):
+                    # the first run is warm-up
+                    if i == 1:
+                        if x.is_cuda:
+                            torch.cuda.synchronize()
+                        start_time = time.perf_counter()
+                    with torch.set_grad_enabled(backward):
+                        output = temporal_conv(x, w, b, impl)
+                        if backward:
+                            output.sum().backward()
+                if x.is_cuda:
+                    torch.cuda.synchronize()
+            except Exception as e:
+                # conv2d is the reference, the others are only candidates, e.g. without cuFFT or out of memory
+                if impl == 'conv2d':
+                    raise
+                skipped[impl] = repr(e)
+                continue
+            timing[impl] = time.perf_counter() - start_time
+        _auto_impl[key] = min(timing, key=timing.get)
+        _auto_timing[key] = {impl: round(t / repeats * 1000, 3) for impl, t in timing.items()}
+        _auto_timing[key].update(skipped)
+    return _auto_impl[key]
+
+
+def describe_auto_impl() -> str:
+    """
+    Returns
+    ----------
+    description : str
+        temporal_conv implementation picked by impl='auto' in this process for each kind of input so far, with the
+        timings in ms, to be recorded in the experiment log since the choice depends on the machine
+    """
+    return '; '.join('input {} {} ({}): {} {}'.format(key[0], 'backward' if key[4] else 'forward', key[2], impl,
+                                                      _auto_timing[key]) for key, impl in _auto_impl.items())
+
+
+class TemporalConv(nn.Conv2d):
+    """Temporal convolution of EEGNet, a nn.Conv2d with a (1, kernLenght) kernel run by temporal_conv.
+
+    Parameters and state dict are those of nn.Conv2d, so checkpoints are shared across implementations.
+    """
+    def __init__(self, in_channels, out_channels, kernel_size, bias=False, impl='conv2d'):
+        super(TemporalConv, self).__init__(in_channels=in_channels, out_channels=out_channels,
+                                           kernel_size=kernel_size, stride=1, bias=bias)
+        if impl not in ['conv2d', 'conv1d', 'fft', 'auto']:
+            raise ValueError('unknown temporal convolution implementation ' + str(impl))
+        self.impl = impl
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return temporal_conv(x, self.weight, self.bias, self.impl)
+
+    def extra_repr(self) -> str:
+        return super(TemporalConv, self).extra_repr() + ', impl=' + self.impl
+
 
 class EEGNet(nn.Module):
 
@@ -13,7 +151,8 @@ class EEGNet(nn.Module):
                  D: int,
                  F2: int,
                  dropoutRate:  float,
-                 norm_rate: float):
+                 norm_rate: float,
+                 temporal_impl: str = 'conv2d'):
         super(EEGNet, self).__init__()
 
         self.n_classes = n_classes
@@ -25,16 +164,17 @@ class EEGNet(nn.Module):
         self.F2 = F2
         self.dropoutRate = dropoutRate
         self.norm_rate = norm_rate
+        self.temporal_impl = temporal_impl
 
         self.block1 = nn.Sequential(
             nn.ZeroPad2d((self.kernLenght // 2 - 1,
                           self.kernLenght - self.kernLenght // 2, 0,
                           0)),  # left, right, up, bottom
-            nn.Conv2d(in_channels=1,
-                      out_channels=self.F1,
-                      kernel_size=(1, self.kernLenght),
-                      stride=1,
-                      bias=False),
+            TemporalConv(in_channels=1,
+                         out_channels=self.F1,
+                         kernel_size=(1, self.kernLenght),
+                         bias=False,
+                         impl=self.temporal_impl),
             nn.BatchNorm2d(num_features=self.F1),
             # DepthwiseConv2d
             nn.Conv2d(in_channels=self.F1,
@@ -78,6 +218,10 @@ class EEGNet(nn.Module):
         output = self.classifier_block(output)
         return output
 
+    def fuse_for_inference(self) -> 'EEGNet_fused':
+        # inference-only copy with BatchNorm folded into the convolutions, see EEGNet_fused
+        return EEGNet_fused(self)
+
 
 class EEGNet_feature(nn.Module):
 
@@ -90,7 +234,8 @@ class EEGNet_feature(nn.Module):
                  D: int,
                  F2: int,
                  dropoutRate:  float,
-                 norm_rate: float):
+                 norm_rate: float,
+                 temporal_impl: str = 'conv2d'):
         super(EEGNet_feature, self).__init__()
 
         self.n_classes = n_classes
@@ -102,16 +247,17 @@ class EEGNet_feature(nn.Module):
         self.F2 = F2
         self.dropoutRate = dropoutRate
         self.norm_rate = norm_rate
+        self.temporal_impl = temporal_impl
 
         self.block1 = nn.Sequential(
             nn.ZeroPad2d((self.kernLenght // 2 - 1,
                           self.kernLenght - self.kernLenght // 2, 0,
                           0)),  # left, right, up, bottom
-            nn.Conv2d(in_channels=1,
-                      out_channels=self.F1,
-                      kernel_size=(1, self.kernLenght),
-                      stride=1,
-                      bias=False),
+            TemporalConv(in_channels=1,
+                         out_channels=self.F1,
+                         kernel_size=(1, self.kernLenght),
+                         bias=False,
+                         impl=self.temporal_impl),
             nn.BatchNorm2d(num_features=self.F1),
             # DepthwiseConv2d
             nn.Conv2d(in_channels=self.F1,
@@ -150,3 +296,115 @@ class EEGNet_feature(nn.Module):
         output = output.reshape(output.size(0), -1)
         return output
 
+    def forward_prefix(self, x: torch.Tensor) -> torch.Tensor:
+        # zero padding and temporal convolution, both linear and applied to every EEG channel alike
+        return self.block1[1](self.block1[0](x))
+
+    def forward_suffix(self, h: torch.Tensor) -> torch.Tensor:
+        # rest of the network, forward(x) == forward_suffix(forward_prefix(x))
+        output = self.block1[2:](h)
+        output = self.block2(output)
+        output = output.reshape(output.size(0), -1)
+        return output
+
+    def fuse_for_inference(self) -> 'EEGNet_fused':
+        # inference-only copy with BatchNorm folded into the convolutions, see EEGNet_fused
+        return EEGNet_fused(self)
+
+
+
+def bn_affine(bn: nn.BatchNorm2d):
+    # (scale, shift) of a BatchNorm2d in eval mode, in float64
+    if bn.running_mean is None:
+        raise ValueError('BatchNorm2d without running statistics cannot be folded')
+    scale = torch.rsqrt(bn.running_var.double() + bn.eps)
+    shift = -bn.running_mean.double() * scale
+    if bn.affine:
+        scale = scale * bn.weight.double()
+        shift = shift * bn.weight.double() + bn.bias.double()
+    return scale, shift
+
+
+class EEGNet_fused(nn.Module):
+    """Inference-only EEGNet or EEGNet_feature, with every BatchNorm2d folded into a convolution.
+
+    In eval mode BatchNorm2d is a per-channel affine map and Dropout is the identity. The temporal and the depthwise
+    spatial convolutions of block1 are both linear, with the first BatchNorm2d in between, so they are applied in the
+    other order: the spatial convolution mixes the Chans EEG channels into F1 * D maps, and a depthwise temporal
+    convolution, carrying both BatchNorm2d of block1, runs on these maps instead of on every EEG channel, about
+    Chans / D times fewer multiply-adds for the largest layer of the network. The third BatchNorm2d is folded into the
+    pointwise convolution. The ZeroPad2d layers are asymmetric, and become F.pad on the mixed maps.
+
+    The folded weights are a snapshot of the source model, which stays the un-fused model to adapt. After an update,
+    refresh() folds its current weights again.
+    """
+    def __init__(self, source):
+        """
+        Parameters
+        ----------
+        source : EEGNet or EEGNet_feature
+            model to fold, its classifier_block is copied if any
+        """
+        super(EEGNet_fused, self).__init__()
+        F1D = source.F1 * source.D
+        self.F1 = source.F1
+        self.D = source.D
+        self.Chans = source.Chans
+        self.kernLenght = source.kernLenght
+        self.pad1 = [self.kernLenght // 2 - 1, self.kernLenght - self.kernLenght // 2]
+        self.pad2 = [7, 8]
+        self.temporal_impl = getattr(source, 'temporal_impl', 'conv2d')
+        weight = source.block1[1].weight
+        factory = {'dtype': weight.dtype, 'device': weight.device}
+        # spatial mixing of block1, as a (F1 * D, Chans) matrix
+        self.register_buffer('spatial_weight', torch.empty((F1D, self.Chans), **factory))
+        self.register_buffer('temporal_weight', torch.empty((F1D, 1, 1, self.kernLenght), **factory))
+        self.register_buffer('temporal_bias', torch.empty(F1D, **factory))
+        self.register_buffer('depthwise_weight', torch.empty_like(source.block2[1].weight))
+        self.register_buffer('pointwise_weight', torch.empty_like(source.block2[2].weight))
+        self.register_buffer('pointwise_bias', torch.empty(source.F2, **factory))
+        self.classifier_block = None
+        if hasattr(source, 'classifier_block'):
+            self.classifier_block = copy.deepcopy(source.classifier_block).requires_grad_(False)
+        self.refresh(source)
+        self.eval()
+
+    @torch.no_grad()
+    def refresh(self, source):
+        """Fold the current weights and running statistics of the source model.
+
+        Parameters
+        ----------
+        source : EEGNet or EEGNet_feature
+            model this one was built from
+        """
+        scale1, shift1 = bn_affine(source.block1[2])
+        scale2, shift2 = bn_affine(source.block1[4])
+        scale3, shift3 = bn_affine(source.block2[3])
+        # temporal filter feeding each of the F1 * D maps
+        group = torch.arange(self.F1 * self.D, device=scale1.device) // self.D
+        temporal = source.block1[1].weight.double()[:, 0, 0, :]
+        spatial = source.block1[3].weight.double()[:, 0, :, 0]
+
+        self.spatial_weight.copy_(spatial)
+        self.temporal_weight.copy_((temporal[group] * (scale1[group] * scale2)[:, None]).reshape(self.temporal_weight.shape))
+        # shift of the first BatchNorm2d, summed over the channels by the spatial convolution
+        self.temporal_bias.copy_(scale2 * shift1[group] * spatial.sum(dim=1) + shift2)
+        self.depthwise_weight.copy_(source.block2[1].weight)
+        self.pointwise_weight.copy_(source.block2[2].weight.double() * scale3.reshape(-1, 1, 1, 1))
+        self.pointwise_bias.copy_(shift3)
+        if self.classifier_block is not None:
+            self.classifier_block.load_state_dict(source.classifier_block.state_dict())
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        # (batch, 1, Chans, Samples) -> (batch, F1 * D, 1, Samples)
+        output = torch.matmul(self.spatial_weight, x).transpose(1, 2)
+        output = temporal_conv(F.pad(output, self.pad1), self.temporal_weight, self.temporal_bias, self.temporal_impl)
+        output = F.avg_pool2d(F.elu(output), (1, 4))
+        output = F.conv2d(F.pad(output, self.pad2), self.depthwise_weight, groups=output.size(1))
+        output = F.conv2d(output, self.pointwise_weight, self.pointwise_bias)
+        output = F.avg_pool2d(F.elu(output), (1, 8))
+        output = output.reshape(output.size(0), -1)
+        if self.classifier_block is not None:
+            output = self.classifier_block(output)
+        return output
@@ -2,7 +2,6 @@
 # @Time    : 2023/01/11
 # @Author  : Siyang Li
 # @File    : shot.py
-import csv
 
 import numpy as np
 import argparse
@@ -15,10 +14,13 @@ from scipy.spatial.distance import cdist
 import torch.nn.functional as F
 from utils.network import backbone_net
 from utils.loss import Entropy
-from utils.LogRecord import LogRecord
+from utils.runner import run_seeds
 from utils.dataloader import read_mi_combine_tar
+from utils.checkpoint import load_source
+from utils.pred_store import PredictionStore
 from utils.utils import lr_scheduler_full, fix_random_seed, cal_acc_comb, data_loader
 from utils.utils import lr_scheduler, fix_random_seed, op_copy, cal_acc, cal_bca, cal_auc
+from utils.resample import get_dataset_params, resample_suffix
 
 import gc
 import torch
@@ -106,20 +108,9 @@ def train_target(args):
     # TODO load pretrained model
     args.max_epoch = 0
 
-    if not args.align:
-        extra_string = '_noEA'
-    else:
-        extra_string = ''
     if args.max_epoch == 0:
         if args.align:
-            if args.data_env != 'local':
-                base_network.load_state_dict(torch.load('./runs/' + str(args.data_name) + '/' + str(args.backbone) +
-                                                        '_S' + str(args.idt) + '_seed' + str(
-                    args.SEED) + extra_string + '.ckpt'))
-            else:
-                base_network.load_state_dict(torch.load('./runs/' + str(args.data_name) + '/' + str(args.backbone) +
-                                                        '_S' + str(args.idt) + '_seed' + str(
-                    args.SEED) + extra_string + '.ckpt', map_location=torch.device('cpu')))
+            load_source(base_network, args)
 
     else:
         max_iter = args.max_epoch * len(dset_loaders["source"])
@@ -277,9 +268,7 @@ def train_target(args):
 
     print('Test Acc = {:.2f}%'.format(acc_t_te))
 
-    with open('./logs/' + str(args.method) + "_pred.csv", 'a') as f:
-        writer = csv.writer(f)
-        writer.writerow(y_pred.numpy())
+    PredictionStore().save(args.data_name, args.method + resample_suffix(args), args.SEED, args.idt, y_pred.numpy())
 
     gc.collect()
     torch.cuda.empty_cache()
@@ -301,11 +290,17 @@ if __name__ == '__main__':
         if data_name == 'BNCI2014002': paradigm, N, chn, class_num, time_sample_num, sample_rate, trial_num, feature_deep_dim = 'MI', 14, 15, 2, 2561, 512, 100, 640
         if data_name == 'BNCI2015001': paradigm, N, chn, class_num, time_sample_num, sample_rate, trial_num, feature_deep_dim = 'MI', 12, 13, 2, 2561, 512, 200, 640
 
+        # whether feed the backbone trials resampled to RESAMPLE_RATES, 128 Hz for the 512 Hz datasets, shrinking
+        # time_sample_num and feature_deep_dim, see utils/resample.py
+        resample = False
+        time_sample_num, sample_rate, feature_deep_dim = get_dataset_params(data_name, time_sample_num, sample_rate, resample)
+
         args = argparse.Namespace(feature_deep_dim=feature_deep_dim, lr=0.001, lr_decay1=0.1, lr_decay2=1.0,
                                   ent=True, gent=True, cls_par=0, ent_par=1.0, epsilon=1e-05, layer='wn', interval=5,
                                   trial_num=trial_num, time_sample_num=time_sample_num, sample_rate=sample_rate,
                                   N=N, chn=chn, class_num=class_num, smooth=0, threshold=0, distance='cosine',
                                   cov_type='oas', paradigm=paradigm, data_name=data_name)
+        args.resample = resample
 
         args.method = 'SHOT'
         #args.method = 'SHOT-IM'
@@ -323,6 +318,9 @@ if __name__ == '__main__':
         # 0 means use pretrained models from dnn.py for SFUDA
         args.max_epoch = 0
 
+        # number of (seed, subject) tasks to run in parallel, 1 runs them serially
+        args.n_jobs = 1
+
         # GPU device id
         try:
             device_id = str(sys.argv[1])
@@ -331,47 +329,11 @@ if __name__ == '__main__':
         except:
             args.data_env = 'local'
 
-        total_acc = []
-
-        for s in [1, 2, 3, 4, 5]:
-            args.SEED = s
-
-            fix_random_seed(args.SEED)
-            torch.backends.cudnn.deterministic = True
-
-            args.data = data_name
-            print(args.data)
-            print(args.method)
-            print(args.SEED)
-            print(args)
-
-            args.local_dir = './data/' + str(data_name) + '/'
-            args.result_dir = './logs/'
-            my_log = LogRecord(args)
-            my_log.log_init()
-            my_log.record('=' * 50 + '\n' + os.path.basename(__file__) + '\n' + '=' * 50)
-
-            sub_acc_all = np.zeros(N)
-            for idt in range(N):
-                args.idt = idt
-                source_str = 'Except_S' + str(idt + 1)
-                target_str = 'S' + str(idt + 1)
-                args.task_str = source_str + '_2_' + target_str
-                info_str = '\n========================== Transfer to ' + target_str + ' =========================='
-                print(info_str)
-                my_log.record(info_str)
-                args.log = my_log
-
-                sub_acc_all[idt] = train_target(args)
-            print('Sub acc: ', np.round(sub_acc_all, 3))
-            print('Avg acc: ', np.round(np.mean(sub_acc_all), 3))
-            total_acc.append(sub_acc_all)
-
-            acc_sub_str = str(np.round(sub_acc_all, 3).tolist())
-            acc_mean_str = str(np.round(np.mean(sub_acc_all), 3).tolist())
-            args.log.record("\n==========================================")
-            args.log.record(acc_sub_str)
-            args.log.record(acc_mean_str)
+        args.data = data_name
+        args.local_dir = './data/' + str(data_name) + '/'
+        args.result_dir = './logs/'
+
+        total_acc = run_seeds(train_target, args, [1, 2, 3, 4, 5], os.path.basename(__file__), subject_offset=1)
 
         args.log.record('\n' + '#' * 20 + 'final results' + '#' * 20)
 
@@ -398,4 +360,4 @@ if __name__ == '__main__':
         dct = dct.append(result_dct, ignore_index=True)
 
     # save results to csv
-    dct.to_csv('./logs/' + str(args.method) + ".csv")
\ No newline at end of file
+    dct.to_csv('./logs/' + str(args.method) + resample_suffix(args) + ".csv")
\ No newline at end of file
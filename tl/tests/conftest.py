@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : conftest.py
+import argparse
+import os
+import sys
+
+import pytest
+import torch
+import torch.nn as nn
+
+# modules are imported as in the drivers, run from tl/, and as tl.utils from the repository root
+TL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in [os.path.dirname(TL_DIR), TL_DIR]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from utils.network import backbone_net
+
+# (channels, time samples, sample rate) of BNCI2014001, and of a 512 Hz dataset resampled to 128 Hz
+SHAPES = [(22, 1001, 250), (13, 512, 128)]
+
+
+def randomize_bn(model):
+    # running statistics and affine parameters away from their initial values, so that folding them is tested
+    for m in model.modules():
+        if isinstance(m, nn.BatchNorm2d):
+            m.running_mean.uniform_(-1, 1)
+            m.running_var.uniform_(0.5, 2)
+            m.weight.data.uniform_(0.5, 1.5)
+            m.bias.data.uniform_(-0.5, 0.5)
+    return model
+
+
+@pytest.fixture
+def make_model():
+    def make(chn, time_sample_num, sample_rate, temporal_conv='conv2d', seed=0):
+        """
+        Returns
+        ----------
+        model : torch.nn.Module
+            nn.Sequential(EEGNet_feature, FC_xy) in eval mode, with random weights and BatchNorm statistics
+        """
+        torch.manual_seed(seed)
+        args = argparse.Namespace(class_num=2, chn=chn, time_sample_num=time_sample_num, sample_rate=sample_rate,
+                                  temporal_conv=temporal_conv)
+        netF, _ = backbone_net(argparse.Namespace(feature_deep_dim=1, **vars(args)), return_type='xy')
+        with torch.no_grad():
+            args.feature_deep_dim = netF.eval()(torch.zeros(1, 1, chn, time_sample_num)).size(1)
+        netF, netC = backbone_net(args, return_type='xy')
+        model = nn.Sequential(netF, netC)
+        with torch.no_grad():
+            randomize_bn(model)
+        return model.eval()
+    return make
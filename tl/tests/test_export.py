@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : test_export.py
+import pytest
+import torch
+import torch.nn as nn
+
+from conftest import SHAPES
+from utils.export import export_predictor, check_predictor
+
+
+@pytest.mark.parametrize('mode', ['trace', 'script'])
+@pytest.mark.parametrize('fuse', [False, True])
+def test_export_matches_eager(make_model, mode, fuse):
+    chn, time_sample_num, sample_rate = SHAPES[0]
+    model = make_model(chn, time_sample_num, sample_rate)
+    variant = nn.Sequential(model[0].fuse_for_inference(), model[1]).eval() if fuse else model
+    predictor, used = export_predictor(variant, chn, time_sample_num, mode)
+    assert used == mode
+    x = torch.randn(1, 1, chn, time_sample_num)
+    assert check_predictor(model, predictor, x) < 1e-4
+
+
+@pytest.mark.parametrize('mode', ['trace', 'script'])
+def test_export_follows_updates(make_model, mode):
+    chn, time_sample_num, sample_rate = SHAPES[0]
+    model = make_model(chn, time_sample_num, sample_rate)
+    predictor, used = export_predictor(model, chn, time_sample_num, mode)
+    assert used == mode
+
+    # an in-place update of the weights and of the running statistics, as by an optimizer step at test time
+    x = torch.randn(8, 1, chn, time_sample_num)
+    model.train()
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    model(x)[1].sum().backward()
+    optimizer.step()
+    model.eval()
+    assert check_predictor(model, predictor, x[:1]) < 1e-4
+
+
+def test_export_falls_back_to_eager(make_model):
+    chn, time_sample_num, sample_rate = SHAPES[0]
+    model = make_model(chn, time_sample_num, sample_rate)
+    # any output difference is above a negative tolerance
+    predictor, used = export_predictor(model, chn, time_sample_num, 'trace', tol=-1)
+    assert used == 'eager' and predictor is model
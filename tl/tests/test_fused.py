@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : test_fused.py
+import pytest
+import torch
+import torch.nn as nn
+
+from conftest import SHAPES, randomize_bn
+from models.EEGNet import EEGNet
+
+
+def max_diff(a, b):
+    return max((x - y).abs().max().item() for x, y in zip(a, b))
+
+
+@pytest.mark.parametrize('chn, time_sample_num, sample_rate', SHAPES)
+def test_fused_matches_eager(make_model, chn, time_sample_num, sample_rate):
+    model = make_model(chn, time_sample_num, sample_rate)
+    fused = nn.Sequential(model[0].fuse_for_inference(), model[1]).eval()
+    x = torch.randn(8, 1, chn, time_sample_num)
+    with torch.no_grad():
+        assert max_diff(model(x), fused(x)) < 1e-4
+
+
+def test_fused_eegnet_matches_eager():
+    torch.manual_seed(0)
+    model = EEGNet(n_classes=4, Chans=22, Samples=1001, kernLenght=125, F1=4, D=2, F2=8, dropoutRate=0.25,
+                   norm_rate=0.5)
+    with torch.no_grad():
+        randomize_bn(model)
+    model.eval()
+    fused = model.fuse_for_inference()
+    x = torch.randn(8, 1, 22, 1001)
+    with torch.no_grad():
+        assert (model(x) - fused(x)).abs().max().item() < 1e-4
+
+
+def test_refresh_follows_updates(make_model):
+    model = make_model(*SHAPES[0])
+    fused = nn.Sequential(model[0].fuse_for_inference(), model[1]).eval()
+    x = torch.randn(8, 1, SHAPES[0][0], SHAPES[0][1])
+
+    # a training step, which also moves the BatchNorm running statistics
+    model.train()
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    model(x)[1].sum().backward()
+    optimizer.step()
+    model.eval()
+    with torch.no_grad():
+        assert max_diff(model(x), fused(x)) > 1e-3
+        fused[0].refresh(model[0])
+        assert max_diff(model(x), fused(x)) < 1e-4
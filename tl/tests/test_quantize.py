@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : test_quantize.py
+import pytest
+import torch
+import torch.nn as nn
+
+from conftest import SHAPES
+from utils.quantize import EEGNet_quant, QuantizedPredictor
+
+
+@pytest.mark.parametrize('chn, time_sample_num, sample_rate', SHAPES + [(22, 1000, 250)])
+def test_quant_model_matches_fused(make_model, chn, time_sample_num, sample_rate):
+    # before quantization, the symmetric paddings and crops must give the outputs of the fused model
+    model = make_model(chn, time_sample_num, sample_rate)
+    fused = nn.Sequential(model[0].fuse_for_inference(), model[1]).eval()
+    qmodel = EEGNet_quant(fused[0], model[1].fc).eval()
+    x = torch.randn(8, 1, chn, time_sample_num)
+    with torch.no_grad():
+        for a, b in zip(fused(x), qmodel(x)):
+            assert a.shape == b.shape
+            assert (a - b).abs().max().item() < 1e-4
+
+
+@pytest.mark.skipif(len(torch.backends.quantized.supported_engines) < 2, reason='no quantized engine')
+def test_quantized_predictor(make_model):
+    chn, time_sample_num, sample_rate = SHAPES[0]
+    model = make_model(chn, time_sample_num, sample_rate)
+    backend = [e for e in torch.backends.quantized.supported_engines if e != 'none'][0]
+    x = torch.randn(128, 1, chn, time_sample_num)
+    with torch.no_grad():
+        # labelled by the float model, so that the accuracy is the agreement with it
+        y = model(x)[1].argmax(dim=1)
+        predictor = QuantizedPredictor(model, (x, y), backend=backend)
+        features, outputs = predictor(x[:1])
+        assert outputs.shape == model(x[:1])[1].shape
+    assert predictor.acc_float == 100
+    assert predictor.acc_quant >= 80
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : test_temporal_conv.py
+import pytest
+import torch
+import torch.nn as nn
+
+from conftest import SHAPES
+from models.EEGNet import temporal_conv, pick_temporal_conv, describe_auto_impl
+
+
+@pytest.mark.parametrize('impl', ['conv1d', 'fft'])
+@pytest.mark.parametrize('in_channels, kernel_length', [(1, 125), (8, 64), (8, 1)])
+@pytest.mark.parametrize('bias', [False, True])
+def test_temporal_conv_matches_conv2d(impl, in_channels, kernel_length, bias):
+    torch.manual_seed(0)
+    x = torch.randn(4, in_channels, 13, 300)
+    weight = torch.randn(8, 1, 1, kernel_length, requires_grad=True)
+    b = torch.randn(8, requires_grad=True) if bias else None
+
+    reference = temporal_conv(x, weight, b, 'conv2d')
+    output = temporal_conv(x, weight, b, impl)
+    assert output.shape == reference.shape
+    assert (output - reference).abs().max().item() < 1e-4
+
+    # gradients of the filters, as adapted at test time
+    grad = torch.randn_like(reference)
+    expected = torch.autograd.grad(reference, [weight] + ([b] if bias else []), grad)
+    actual = torch.autograd.grad(output, [weight] + ([b] if bias else []), grad)
+    for e, a in zip(expected, actual):
+        assert (e - a).abs().max().item() < 1e-3
+
+
+@pytest.mark.parametrize('impl', ['conv1d', 'fft', 'auto'])
+@pytest.mark.parametrize('chn, time_sample_num, sample_rate', SHAPES)
+def test_model_matches_conv2d(make_model, impl, chn, time_sample_num, sample_rate):
+    model = make_model(chn, time_sample_num, sample_rate)
+    other = make_model(chn, time_sample_num, sample_rate, temporal_conv=impl, seed=1)
+    # checkpoints are shared across implementations
+    other.load_state_dict(model.state_dict())
+    x = torch.randn(8, 1, chn, time_sample_num)
+    with torch.no_grad():
+        for a, b in zip(model(x), other(x)):
+            assert (a - b).abs().max().item() < 1e-4
+        fused = nn.Sequential(other[0].fuse_for_inference(), other[1]).eval()
+        for a, b in zip(model(x), fused(x)):
+            assert (a - b).abs().max().item() < 1e-4
+
+
+def test_pick_temporal_conv():
+    x = torch.randn(2, 1, 5, 200)
+    weight = torch.randn(4, 1, 1, 32)
+    with torch.no_grad():
+        impl = pick_temporal_conv(x, weight)
+    assert impl in ['conv2d', 'conv1d', 'fft']
+    # the choice is kept, and reported for the experiment log
+    with torch.no_grad():
+        assert pick_temporal_conv(x, weight) == impl
+    assert 'input (2, 1, 5, 200) forward (cpu): ' + impl in describe_auto_impl()
@@ -5,17 +5,23 @@ import os
 import torch
 import torch.nn as nn
 import torch.optim as optim
+from torch.func import stack_module_state, functional_call, vmap
 import pandas as pd
-import csv
+import copy
 
 from tl.utils.utils import str2bool
 from utils.network import backbone_net
-from utils.LogRecord import LogRecord
+from utils.runner import run_seeds, run_stacked
 from utils.dataloader import read_mi_combine_tar
-from utils.utils import fix_random_seed, cal_acc_comb, data_loader, cal_auc_comb, cal_score_online
+from utils.checkpoint import checkpoints, load_source, save_model
+from utils.pred_store import PredictionStore
+from utils.utils import cal_acc_comb, data_loader, cal_auc_comb, cal_score_online
 from utils.alg_utils import EA, EA_online
-from scipy.linalg import fractional_matrix_power
+from utils.tta_engine import AdaptStrategy, OnlineTTAEngine, configure_adapt_params
+from utils.onnx_export import export_onnx
 from utils.loss import Entropy
+from utils.ensemble import StreamingSML
+from utils.resample import get_dataset_params, resample_suffix
 from sklearn.metrics import roc_auc_score, accuracy_score
 
 import gc
@@ -29,185 +35,205 @@ import time
 # @File    : ttime.py
 # from github https://github.com/sylyoung/DeepTransferEEG/tree/main
 
-def TTIME(loader, model, args, balanced=True):
+class TTIMEStrategy(AdaptStrategy):
     # "T-TIME: Test-Time Information Maximization Ensemble for Plug-and-Play BCIs"
     # IEEE Transactions on Biomedical Engineering
     # Note that the ensemble experiment is separately implemented in ttime_ensemble.py, using recorded test prediction.
-
-    if balanced == False and args.data_name == 'BNCI2014001-4':
-        print('ERROR, imbalanced multi-class not implemented')
-        sys.exit(0)
-
-    y_true = []
-    y_pred = []
-
-    optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
-
-    # initialize test reference matrix for Incremental EA
-    if args.align:
-        R = 0
-
-    if not balanced:
-        zk_arrs = np.zeros(2)
-        c = 4
-
-    iter_test = iter(loader)
-
-    # loop through test data stream one by one
-    for i in range(len(loader)):
-        #################### Phase 1: target label prediction ####################
-        model.eval()
-        data = next(iter_test)
-        inputs = data[0]
-        labels = data[1]
-        inputs = inputs.reshape(1, 1, inputs.shape[-2], inputs.shape[-1]).cpu()
-
-        # accumulate test data
-        if i == 0:
-            data_cum = inputs.float().cpu()
-        else:
-            data_cum = torch.cat((data_cum, inputs.float().cpu()), 0)
-
-        # Incremental EA
-        if args.align:
-            start_time = time.time()
-
-            if i == 0:
-                sample_test = data_cum.reshape(args.chn, args.time_sample_num)
+    def __init__(self, model, args, balanced=True):
+        super(TTIMEStrategy, self).__init__(model, args, balanced)
+        self.optimizer = torch.optim.Adam(self.trainable_params(), lr=args.lr)
+        if not balanced:
+            self.zk_arrs = np.zeros(2)
+            self.c = 4
+
+    def adapt(self, batch_test, i):
+        args = self.args
+        for step in range(args.steps):
+
+            _, outputs = self.batch_model(batch_test)
+            outputs = outputs.float().cpu()
+
+            args.epsilon = 1e-5
+            softmax_out = nn.Softmax(dim=1)(outputs / args.t)
+            # Conditional Entropy Minimization loss
+            CEM_loss = torch.mean(Entropy(softmax_out))
+            msoftmax = softmax_out.mean(dim=0)
+
+            if self.balanced:
+                # Marginal Distribution Regularization loss
+                MDR_loss = torch.sum(msoftmax * torch.log(msoftmax + args.epsilon))
+                loss = CEM_loss + MDR_loss
             else:
-                sample_test = data_cum[i].reshape(args.chn, args.time_sample_num)
-            # update reference matrix
-            R = EA_online(sample_test, R, i)
-
-            sqrtRefEA = fractional_matrix_power(R, -0.5)
-            # transform current test sample
-            sample_test = np.dot(sqrtRefEA, sample_test)
-
-            EA_time = time.time()
-            if args.calc_time:
-                print('sample ', str(i), ', pre-inference IEA finished time in ms:', np.round((EA_time - start_time) * 1000, 3))
-            sample_test = sample_test.reshape(1, 1, args.chn, args.time_sample_num)
-        else:
-            sample_test = data_cum[i].numpy()
-            sample_test = sample_test.reshape(1, 1, sample_test.shape[1], sample_test.shape[2])
-
-        if args.data_env != 'local':
-            sample_test = torch.from_numpy(sample_test).to(torch.float32).cuda()
+                # Adaptive Marginal Distribution Regularization
+                qk = torch.zeros((args.class_num, )).to(torch.float32)
+                for k in range(args.class_num):
+                    qk[k] = msoftmax[k] / (self.c + self.zk_arrs[k])
+                sum_qk = torch.sum(qk)
+                normed_qk = qk / sum_qk
+                AMDR_loss = torch.sum(normed_qk * torch.log(normed_qk + args.epsilon))
+                loss = CEM_loss + AMDR_loss
+
+            self.optimizer.zero_grad()
+            loss.backward()
+            self.optimizer.step()
+
+        if not self.balanced:
+            self.count_pseudo_labels(softmax_out, i)
+
+    def skip(self, batch_test, i):
+        # gated out update, the confident predictions of the forward pass of adapt() are still counted for AMDR, leaving
+        # the BatchNorm running statistics untouched
+        if not self.balanced:
+            buffers = [b.clone() for b in self.model.buffers()]
+            self.model.train()
+            with torch.no_grad():
+                _, outputs = self.batch_model(batch_test)
+                for b, saved in zip(self.model.buffers(), buffers):
+                    b.copy_(saved)
+            self.model.eval()
+            self.count_pseudo_labels(nn.Softmax(dim=1)(outputs.float().cpu() / self.args.t), i)
+
+    def count_pseudo_labels(self, softmax_out, i):
+        # numbers of confident pseudo labels per class, the whole first test batch, then the current test sample
+        args = self.args
+        zk_arrs = self.zk_arrs
+        if i + 1 == args.test_batch:
+            args.pred_thresh = 0.7
+            pl = torch.max(softmax_out, 1)[1]
+            for l in range(args.test_batch):
+                if pl[l] == 0:
+                    if softmax_out[l][0] > args.pred_thresh:
+                        zk_arrs[0] += 1
+                elif pl[l] == 1:
+                    if softmax_out[l][1] > args.pred_thresh:
+                        zk_arrs[1] += 1
+                else:
+                    print('ERROR in pseudo labeling!')
+                    sys.exit(0)
         else:
-            sample_test = torch.from_numpy(sample_test).to(torch.float32)
-
-        _, outputs = model(sample_test)
-
-        softmax_out = nn.Softmax(dim=1)(outputs)
-
-        outputs = outputs.float().cpu()
-        labels = labels.float().cpu()
-        _, predict = torch.max(outputs, 1)
-
-        y_pred.append(softmax_out.detach().cpu().numpy())
-        y_true.append(labels.item())
-
-        #################### Phase 2: target model update ####################
-        model.train()
-        # sliding batch
-        if (i + 1) >= args.test_batch and (i + 1) % args.stride == 0:
-            if args.align:
-                batch_test = np.copy(data_cum[i - args.test_batch + 1:i + 1])
-                # transform test batch
-                batch_test = np.dot(sqrtRefEA, batch_test)
-                batch_test = np.transpose(batch_test, (1, 2, 0, 3))
-            else:
-                batch_test = data_cum[i - args.test_batch + 1:i + 1].numpy()
-                batch_test = batch_test.reshape(args.test_batch, 1, batch_test.shape[2], batch_test.shape[3])
-
-            if args.data_env != 'local':
-                batch_test = torch.from_numpy(batch_test).to(torch.float32).cuda()
+            # update confident prediction ids for current test sample
+            pl = torch.max(softmax_out, 1)[1]
+            if pl[-1] == 0:
+                if softmax_out[-1][0] > args.pred_thresh:
+                    zk_arrs[0] += 1
+            elif pl[-1] == 1:
+                if softmax_out[-1][1] > args.pred_thresh:
+                    zk_arrs[1] += 1
             else:
-                batch_test = torch.from_numpy(batch_test).to(torch.float32)
+                print('ERROR in pseudo labeling!')
 
-            start_time = time.time()
-            for step in range(args.steps):
-
-                _, outputs = model(batch_test)
-                outputs = outputs.float().cpu()
-
-                args.epsilon = 1e-5
-                softmax_out = nn.Softmax(dim=1)(outputs / args.t)
-                # Conditional Entropy Minimization loss
-                CEM_loss = torch.mean(Entropy(softmax_out))
-                msoftmax = softmax_out.mean(dim=0)
-
-                if balanced:
-                    # Marginal Distribution Regularization loss
-                    MDR_loss = torch.sum(msoftmax * torch.log(msoftmax + args.epsilon))
-                    loss = CEM_loss + MDR_loss
-                else:
-                    # Adaptive Marginal Distribution Regularization
-                    qk = torch.zeros((args.class_num, )).to(torch.float32)
-                    for k in range(args.class_num):
-                        qk[k] = msoftmax[k] / (c + zk_arrs[k])
-                    sum_qk = torch.sum(qk)
-                    normed_qk = qk / sum_qk
-                    AMDR_loss = torch.sum(normed_qk * torch.log(normed_qk + args.epsilon))
-                    loss = CEM_loss + AMDR_loss
-
-                optimizer.zero_grad()
-                loss.backward()
-                optimizer.step()
-
-            TTA_time = time.time()
-            if args.calc_time:
-                print('sample ', str(i), ', post-inference model update finished in ms:', np.round((TTA_time - start_time) * 1000, 3))
-
-            if not balanced:
-                if i + 1 == args.test_batch:
-                    args.pred_thresh = 0.7
-                    pl = torch.max(softmax_out, 1)[1]
-                    for l in range(args.test_batch):
-                        if pl[l] == 0:
-                            if softmax_out[l][0] > args.pred_thresh:
-                                zk_arrs[0] += 1
-                        elif pl[l] == 1:
-                            if softmax_out[l][1] > args.pred_thresh:
-                                zk_arrs[1] += 1
-                        else:
-                            print('ERROR in pseudo labeling!')
-                            sys.exit(0)
-                else:
-                    # update confident prediction ids for current test sample
-                    pl = torch.max(softmax_out, 1)[1]
-                    if pl[-1] == 0:
-                        if softmax_out[-1][0] > args.pred_thresh:
-                            zk_arrs[0] += 1
-                    elif pl[-1] == 1:
-                        if softmax_out[-1][1] > args.pred_thresh:
-                            zk_arrs[1] += 1
-                    else:
-                        print('ERROR in pseudo labeling!')
-
-        model.eval()
-
-    if balanced:
-        _, predict = torch.max(torch.from_numpy(np.array(y_pred)).to(torch.float32).reshape(-1, args.class_num), 1)
-        pred = torch.squeeze(predict).float()
-        score = accuracy_score(y_true, pred)
-        if args.data_name == 'BNCI2014001-4':
-            y_pred = np.array(y_pred).reshape(-1, )  # multiclass
-        else:
-            y_pred = np.array(y_pred).reshape(-1, args.class_num)[:, 1]  # binary
-    else:
-        predict = torch.from_numpy(np.array(y_pred)).to(torch.float32).reshape(-1, args.class_num)
-        y_pred = np.array(predict).reshape(-1, args.class_num)[:, 1]  # binary
-        score = roc_auc_score(y_true, y_pred)
 
-    return score * 100, y_pred
+def TTIME(loader, model, args, balanced=True):
+    return OnlineTTAEngine(TTIMEStrategy(model, args, balanced), args, balanced).run(loader)
+
+
+class TTIMEStackedStrategy(AdaptStrategy):
+    # T-TIME for the source models of all seeds of a subject at once, sharing a single pass over the test stream.
+    # Parameters and buffers of the models are stacked along a leading model dimension, so that prediction and the
+    # CEM+MDR update of every model run as one vmapped forward/backward per trial.
+    # Adam is elementwise and each model's loss only reaches its own slice of the stacked parameters, so a single
+    # optimizer on the summed losses updates every model exactly as its own optimizer would.
+    # the stacked weights are not modules, whatever the subset the batches are not taken from a PrefixCache
+    cache_prefix = False
+
+    def __init__(self, models, args, balanced=True):
+        self.num_models = len(models)
+        # frozen parameters of the subset in args.adapt_params are stacked without requires_grad
+        for model in models:
+            configure_adapt_params(model, getattr(args, 'adapt_params', 'all'))
+        self.stacked_params, self.stacked_buffers = stack_module_state(models)
+        # stateless copy of the architecture, the weights are provided by the stacked tensors
+        base_model = copy.deepcopy(models[0]).to('meta')
+        super(TTIMEStackedStrategy, self).__init__(base_model, args, balanced)
+
+        def fmodel(params, buffers, x):
+            return functional_call(base_model, (params, buffers), (x,))
+
+        # one forward for all models, with independent dropout masks per model
+        self.vmodel = vmap(fmodel, in_dims=(0, 0, None), randomness='different')
+
+        self.optimizer = torch.optim.Adam([p for p in self.stacked_params.values() if p.requires_grad], lr=args.lr)
+
+        if not balanced:
+            self.zk_arrs = torch.zeros((self.num_models, 2))
+            self.c = 4
+
+    def predict(self, sample, stream, i):
+        with torch.no_grad():
+            _, outputs = self.vmodel(self.stacked_params, self.stacked_buffers, sample)
+        # (num_models, 1, num_classes)
+        return outputs
+
+    def adapt(self, batch_test, i):
+        args = self.args
+        num_models = self.num_models
+        for step in range(args.steps):
+
+            # (num_models, test_batch, num_classes)
+            _, outputs = self.vmodel(self.stacked_params, self.stacked_buffers, batch_test)
+            outputs = outputs.float().cpu()
+
+            args.epsilon = 1e-5
+            softmax_out = nn.Softmax(dim=2)(outputs / args.t)
+            # Conditional Entropy Minimization loss, per model
+            CEM_loss = torch.mean(Entropy(softmax_out.reshape(-1, args.class_num)).reshape(num_models, -1), dim=1)
+            msoftmax = softmax_out.mean(dim=1)
+
+            if self.balanced:
+                # Marginal Distribution Regularization loss
+                MDR_loss = torch.sum(msoftmax * torch.log(msoftmax + args.epsilon), dim=1)
+                loss = CEM_loss + MDR_loss
+            else:
+                # Adaptive Marginal Distribution Regularization
+                qk = msoftmax / (self.c + self.zk_arrs)
+                normed_qk = qk / torch.sum(qk, dim=1, keepdim=True)
+                AMDR_loss = torch.sum(normed_qk * torch.log(normed_qk + args.epsilon), dim=1)
+                loss = CEM_loss + AMDR_loss
+
+            self.optimizer.zero_grad()
+            torch.sum(loss).backward()
+            self.optimizer.step()
+
+        if not self.balanced:
+            self.count_pseudo_labels(softmax_out.detach(), i)
+
+    def skip(self, batch_test, i):
+        # gated out update, the confident predictions of the forward pass of adapt() are still counted for AMDR, leaving
+        # the BatchNorm running statistics untouched
+        if not self.balanced:
+            buffers = {name: b.clone() for name, b in self.stacked_buffers.items()}
+            self.model.train()
+            with torch.no_grad():
+                _, outputs = self.vmodel(self.stacked_params, self.stacked_buffers, batch_test)
+                for name, b in self.stacked_buffers.items():
+                    b.copy_(buffers[name])
+            self.model.eval()
+            self.count_pseudo_labels(nn.Softmax(dim=2)(outputs.float().cpu() / self.args.t), i)
+
+    def count_pseudo_labels(self, softmax_out, i):
+        # numbers of confident pseudo labels per model and class, the whole first test batch, then the current test sample
+        args = self.args
+        args.pred_thresh = 0.7
+        conf, pl = torch.max(softmax_out, 2)
+        if i + 1 != args.test_batch:
+            # update confident prediction ids for current test sample
+            conf, pl = conf[:, -1:], pl[:, -1:]
+        for k in range(2):
+            self.zk_arrs[:, k] += torch.sum((pl == k) & (conf > args.pred_thresh), dim=1)
+
+
+def TTIME_stacked(loader, models, args, balanced=True):
+    strategy = TTIMEStackedStrategy(models, args, balanced)
+    scores, y_preds = OnlineTTAEngine(strategy, args, balanced).run(loader)
+
+    # write the adapted weights back to the models
+    for m, model in enumerate(models):
+        model.load_state_dict({name: tensor[m] for name, tensor in list(strategy.stacked_params.items()) + list(strategy.stacked_buffers.items())})
+
+    return scores, y_preds
 
 
 def train_target(args):
-    if not args.align:
-        extra_string = '_noEA'
-    else:
-        extra_string = ''
     X_src, y_src, X_tar, y_tar = read_mi_combine_tar(args)
     print('X_src, y_src, X_tar, y_tar:', X_src.shape, y_src.shape, X_tar.shape, y_tar.shape)
     dset_loaders = data_loader(X_src, y_src, X_tar, y_tar, args)
@@ -219,12 +245,7 @@ def train_target(args):
 
     if args.max_epoch == 0:
         if args.align:
-            if args.data_env != 'local':
-                base_network.load_state_dict(torch.load('./runs/' + str(args.data_name) + '/' + str(args.backbone) +
-                    '_S' + str(args.idt) + '_seed' + str(args.SEED) + extra_string + '.ckpt'))
-            else:
-                base_network.load_state_dict(torch.load('./runs/' + str(args.data_name) + '/' + str(args.backbone) +
-                    '_S' + str(args.idt) + '_seed' + str(args.SEED) + extra_string + '.ckpt', map_location=torch.device('cpu')))
+            load_source(base_network, args)
     else:
         criterion = nn.CrossEntropyLoss()
         optimizer_f = optim.Adam(netF.parameters(), lr=args.lr)
@@ -273,13 +294,17 @@ def train_target(args):
                 base_network.train()
 
         print('saving model...')
-        torch.save(base_network.state_dict(),
-                   './runs/' + str(args.data_name) + '/' + str(args.backbone) + '_S' + str(
-                       args.idt) + '_seed' + str(args.SEED) + extra_string + '.ckpt')
+        save_model(base_network, args)
 
 
     base_network.eval()
 
+    if args.onnx:
+        # source model for deployment, predicting batches of trials
+        path = checkpoints.path(args.data_name, args.backbone, args.idt, args.SEED, args.align,
+                                suffix=resample_suffix(args))
+        export_onnx(base_network, path[:-len('.ckpt')] + '.onnx', args.chn, args.time_sample_num)
+
     score = cal_score_online(dset_loaders["Target-Online"], base_network, args=args)
     if args.balanced:
         log_str = 'Task: {}, Online IEA Acc = {:.2f}%'.format(args.task_str, score)
@@ -290,6 +315,10 @@ def train_target(args):
 
     print('executing TTA...')
 
+    if getattr(args, 'quantize', False):
+        # source trials calibrating the INT8 predictor
+        args.calib_loader = dset_loaders["source"]
+
     if args.balanced:
         acc_t_te, y_pred = TTIME(dset_loaders["Target-Online"], base_network, args=args, balanced=True)
         log_str = 'Task: {}, TTA Acc = {:.2f}%'.format(args.task_str, acc_t_te)
@@ -305,13 +334,10 @@ def train_target(args):
     else:
         print('Test AUC = {:.2f}%'.format(acc_t_te))
 
-    torch.save(base_network.state_dict(), './runs/' + str(args.data_name) + '/' + str(args.backbone) + '_S' + str(args.idt) + '_seed' + str(
-        args.SEED) + extra_string + '_adapted' + '.ckpt')
+    save_model(base_network, args, adapted=True)
 
     # save the predictions for ensemble
-    with open('./logs/' + str(args.data_name) + '_' + str(args.method) + '_seed_' + str(args.SEED) +"_pred.csv", 'a') as f:
-        writer = csv.writer(f)
-        writer.writerow(y_pred)
+    PredictionStore().save(args.data_name, args.method + resample_suffix(args), args.SEED, args.idt, y_pred)
 
     gc.collect()
     if args.data_env != 'local':
@@ -320,6 +346,62 @@ def train_target(args):
     return acc_t_te
 
 
+def train_target_stacked(args, seeds):
+    # adapt the source models of all seeds for target subject args.idt in a single pass, see TTIME_stacked
+    X_src, y_src, X_tar, y_tar = read_mi_combine_tar(args)
+    print('X_src, y_src, X_tar, y_tar:', X_src.shape, y_src.shape, X_tar.shape, y_tar.shape)
+    dset_loaders = data_loader(X_src, y_src, X_tar, y_tar, args)
+
+    assert args.max_epoch == 0, 'stacked adaptation requires the pretrained source models, run dnn.py first'
+
+    models = []
+    for s in seeds:
+        netF, netC = backbone_net(args, return_type='xy')
+        if args.data_env != 'local':
+            netF, netC = netF.cuda(), netC.cuda()
+        base_network = nn.Sequential(netF, netC)
+        load_source(base_network, args, seed=s)
+        models.append(base_network)
+
+    print('executing TTA...')
+
+    if args.balanced:
+        scores, y_preds = TTIME_stacked(dset_loaders["Target-Online"], models, args=args, balanced=True)
+    else:
+        scores, y_preds = TTIME_stacked(dset_loaders["Target-Online-Imbalanced"], models, args=args, balanced=False)
+
+    for s, acc_t_te, y_pred, base_network in zip(seeds, scores, y_preds, models):
+        if args.balanced:
+            log_str = 'Task: {}, Seed: {}, TTA Acc = {:.2f}%'.format(args.task_str, s, acc_t_te)
+        else:
+            log_str = 'Task: {}, Seed: {}, TTA AUC = {:.2f}%'.format(args.task_str, s, acc_t_te)
+        args.log.record(log_str)
+        print(log_str)
+
+        save_model(base_network, args, seed=s, adapted=True)
+
+        # save the predictions for ensemble
+        PredictionStore().save(args.data_name, args.method + resample_suffix(args), s, args.idt, y_pred)
+
+    if args.balanced:
+        # online SML soft ensemble of the adapted models, each trial weighted by the predictions up to it
+        sml = StreamingSML(len(seeds), None if args.class_num == 2 else args.class_num)
+        # (num_test_samples, num_models, num_classes)
+        preds = np.stack(y_preds, axis=1)
+        if args.class_num == 2:
+            preds = preds[:, :, 1]
+        y_ens = [sml.update(pred) for pred in preds]
+        log_str = 'Task: {}, SML Ensemble TTA Acc = {:.2f}%'.format(args.task_str, accuracy_score(y_tar, y_ens) * 100)
+        args.log.record(log_str)
+        print(log_str)
+
+    gc.collect()
+    if args.data_env != 'local':
+        torch.cuda.empty_cache()
+
+    return scores
+
+
 if __name__ == '__main__':
 
     # parse args
@@ -329,6 +411,25 @@ if __name__ == '__main__':
     parser.add_argument('--data_path', type=str, default='./data/', help='the path to save the data')
     parser.add_argument('--log_path', type=str, default='./logs/', help='the path to save the logs')
     parser.add_argument('--gpu_idx', type=int, default=0, help='index of GPU')
+    parser.add_argument('--n_jobs', type=int, default=1, help='number of (seed, subject) tasks to run in parallel, 1 runs them serially')
+    parser.add_argument('--adapt_params', type=str, default='all', choices=['all', 'bn', 'classifier', 'last-block'], help='parameters adapted at test time, all others are frozen')
+    parser.add_argument('--stacked', type=str2bool, default=False, help='whether adapt the models of all seeds at once, with stacked parameters')
+    parser.add_argument('--temporal_conv', type=str, default='conv2d', choices=['conv2d', 'conv1d', 'fft', 'auto'], help='implementation of the temporal convolution of EEGNet, auto times them on first use')
+    parser.add_argument('--fuse_inference', type=str2bool, default=False, help='whether predict with BatchNorm folded into the convolutions of EEGNet, adapting the un-fused model')
+    parser.add_argument('--export', type=str, default='eager', choices=['eager', 'trace', 'script', 'compile'], help='export of the single-trial predictor, falling back to eager mode on failure')
+    parser.add_argument('--quantize', type=str2bool, default=False, help='whether predict with an INT8 copy of the model, calibrated on source trials and re-quantized from the adapted float model')
+    parser.add_argument('--quant_every', type=int, default=8, help='number of model updates between re-quantizations')
+    parser.add_argument('--quant_backend', type=str, default='x86', help='quantized engine, one of torch.backends.quantized.supported_engines')
+    parser.add_argument('--onnx', type=str2bool, default=False, help='whether predict through an ONNX export of the model run by onnxruntime, exported again from the adapted model')
+    parser.add_argument('--onnx_every', type=int, default=1, help='number of model updates between ONNX exports')
+    parser.add_argument('--async_adapt', type=str2bool, default=False, help='whether adapt the model on a background thread, predicting with the latest published weights')
+    parser.add_argument('--max_staleness', type=int, default=1, help='maximum number of model updates a prediction may miss in async_adapt mode')
+    parser.add_argument('--gate', type=str2bool, default=False, help='whether skip the model updates not triggered by prediction entropy, marginal shift or R drift')
+    parser.add_argument('--gate_entropy', type=float, default=0.4, help='update if the mean normalized entropy of the test batch predictions exceeds it')
+    parser.add_argument('--gate_shift', type=float, default=0.1, help='update if the L1 shift of the mean test batch prediction since the last update exceeds it')
+    parser.add_argument('--gate_drift', type=float, default=0.005, help='update if the relative change of the IEA reference matrix since the last update exceeds it')
+    parser.add_argument('--gate_max_skip', type=int, default=3, help='maximum number of consecutive skipped updates')
+    parser.add_argument('--resample', type=str2bool, default=False, help='whether feed the backbone trials resampled to 128 Hz for the 512 Hz datasets, with their own source models')
     args = parser.parse_args()
 
     data_name = args.dataset_name
@@ -336,12 +437,39 @@ if __name__ == '__main__':
     data_path = args.data_path
     log_path = args.log_path
     gpu_idx = args.gpu_idx
+    n_jobs = args.n_jobs
+    adapt_params = args.adapt_params
+    stacked = args.stacked
+    temporal_conv = args.temporal_conv
+    fuse_inference = args.fuse_inference
+    export = args.export
+    quantize = args.quantize
+    quant_args = {k: getattr(args, k) for k in ['quant_every', 'quant_backend']}
+    onnx = args.onnx
+    onnx_every = args.onnx_every
+    async_adapt = args.async_adapt
+    max_staleness = args.max_staleness
+    gate = args.gate
+    gate_args = {k: getattr(args, k) for k in ['gate_entropy', 'gate_shift', 'gate_drift', 'gate_max_skip']}
+    resample = args.resample
 
     print('dataset_name: {}, type: {}'.format(data_name, type(data_name)))
     print('data_save: {}, type: {}'.format(data_save, type(data_save)))
     print('data_path: {}, type: {}'.format(data_path, type(data_path)))
     print('log_path: {}, type: {}'.format(log_path, type(log_path)))
     print('gpu_idx: {}, type: {}'.format(gpu_idx, type(gpu_idx)))
+    print('n_jobs: {}, type: {}'.format(n_jobs, type(n_jobs)))
+    print('adapt_params: {}, type: {}'.format(adapt_params, type(adapt_params)))
+    print('stacked: {}, type: {}'.format(stacked, type(stacked)))
+    print('temporal_conv: {}, type: {}'.format(temporal_conv, type(temporal_conv)))
+    print('fuse_inference: {}, type: {}'.format(fuse_inference, type(fuse_inference)))
+    print('export: {}, type: {}'.format(export, type(export)))
+    print('quantize: {}, type: {}'.format(quantize, type(quantize)), quant_args)
+    print('onnx: {}, type: {}'.format(onnx, type(onnx)), 'onnx_every:', onnx_every)
+    print('async_adapt: {}, type: {}'.format(async_adapt, type(async_adapt)))
+    print('max_staleness: {}, type: {}'.format(max_staleness, type(max_staleness)))
+    print('gate: {}, type: {}'.format(gate, type(gate)), gate_args)
+    print('resample: {}, type: {}'.format(resample, type(resample)))
 
     data_name_list = ['BNCI2014001', 'BNCI2014002', 'BNCI2015001', 'BNCI2014001-4']
 
@@ -389,10 +517,14 @@ if __name__ == '__main__':
         # whether to record running time
         calc_time = False
 
+        # input shape of the backbone, shrunk if the trials are resampled, see utils/resample.py
+        time_sample_num, sample_rate, feature_deep_dim = get_dataset_params(data_name, time_sample_num, sample_rate, resample)
+
         args = argparse.Namespace(feature_deep_dim=feature_deep_dim, align=align, lr=lr, t=t, max_epoch=max_epoch,
                                   trial_num=trial_num, time_sample_num=time_sample_num, sample_rate=sample_rate,
                                   N=N, chn=chn, class_num=class_num, stride=stride, steps=steps, calc_time=calc_time,
                                   paradigm=paradigm, test_batch=test_batch, data_name=data_name, balanced=balanced)
+        args.resample = resample
 
         args.method = 'T-TIME'
         args.backbone = 'EEGNet'
@@ -400,6 +532,40 @@ if __name__ == '__main__':
         # train batch size
         args.batch_size = 32
 
+        # number of (seed, subject) tasks to run in parallel, 1 runs them serially
+        args.n_jobs = n_jobs
+
+        # parameters adapted at test time, one of all, bn, classifier or last-block
+        args.adapt_params = adapt_params
+
+        # implementation of the temporal convolution of EEGNet, checkpoints are shared by all of them
+        args.temporal_conv = temporal_conv
+
+        # whether predict with an inference-only copy of EEGNet, BatchNorm folded into its convolutions
+        args.fuse_inference = fuse_inference
+
+        # export of the model predicting each test trial, one of eager, trace, script or compile
+        args.export = export
+
+        # whether predict with an INT8 copy of the model, re-quantized every quant_every updates
+        args.quantize = quantize
+        args.quant_calib = 256
+        for k, v in quant_args.items():
+            setattr(args, k, v)
+
+        # whether predict with onnxruntime, exporting the model again every onnx_every updates
+        args.onnx = onnx
+        args.onnx_every = onnx_every
+
+        # whether adapt in the background, so that prediction latency is a single forward pass
+        args.async_adapt = async_adapt
+        args.max_staleness = max_staleness
+
+        # whether gate the model updates, logging the update compute saved
+        args.gate = gate
+        for k, v in gate_args.items():
+            setattr(args, k, v)
+
         # GPU device id
         try:
             device_id = gpu_idx
@@ -407,48 +573,18 @@ if __name__ == '__main__':
             args.data_env = 'gpu' if torch.cuda.device_count() != 0 else 'local'
         except:
             args.data_env = 'local'
-        total_acc = []
+
+        args.data = data_name
+        args.local_dir = data_path + str(data_name) + '/'
+        args.result_dir = log_path
 
         # update multiple models, independently, from the source models
-        for s in [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11]:
-            args.SEED = s
-
-            fix_random_seed(args.SEED)
-            torch.backends.cudnn.deterministic = True
-
-            args.data = data_name
-            print(args.data)
-            print(args.method)
-            print(args.SEED)
-            print(args)
-
-            args.local_dir = data_path + str(data_name) + '/'
-            args.result_dir = log_path
-            my_log = LogRecord(args)
-            my_log.log_init()
-            my_log.record('=' * 50 + '\n' + os.path.basename(__file__) + '\n' + '=' * 50)
-
-            sub_acc_all = np.zeros(N)
-            for idt in range(N):
-                args.idt = idt
-                source_str = 'Except_S' + str(idt)
-                target_str = 'S' + str(idt)
-                args.task_str = source_str + '_2_' + target_str
-                info_str = '\n========================== Transfer to ' + target_str + ' =========================='
-                print(info_str)
-                my_log.record(info_str)
-                args.log = my_log
-
-                sub_acc_all[idt] = train_target(args)
-            print('Sub acc: ', np.round(sub_acc_all, 3))
-            print('Avg acc: ', np.round(np.mean(sub_acc_all), 3))
-            total_acc.append(sub_acc_all)
-
-            acc_sub_str = str(np.round(sub_acc_all, 3).tolist())
-            acc_mean_str = str(np.round(np.mean(sub_acc_all), 3).tolist())
-            args.log.record("\n==========================================")
-            args.log.record(acc_sub_str)
-            args.log.record(acc_mean_str)
+        seeds = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
+        if stacked:
+            # single pass over each test stream, adapting the models of all seeds together
+            total_acc = run_stacked(train_target_stacked, args, seeds, os.path.basename(__file__))
+        else:
+            total_acc = run_seeds(train_target, args, seeds, os.path.basename(__file__))
 
         args.log.record('\n' + '#' * 20 + 'final results' + '#' * 20)
 
@@ -475,4 +611,4 @@ if __name__ == '__main__':
         dct = dct.append(result_dct, ignore_index=True)
 
     # save results to csv
-    dct.to_csv(log_path + str(args.method) + ".csv")
\ No newline at end of file
+    dct.to_csv(log_path + str(args.method) + resample_suffix(args) + ".csv")
\ No newline at end of file
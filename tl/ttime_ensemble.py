@@ -1,13 +1,14 @@
 # -*- coding: utf-8 -*-
 import numpy as np
 import random
-import pandas as pd
 import torch as tr
 import torch.utils.data
 
 from tl.utils.utils import str2bool
 from sklearn.metrics import accuracy_score
 from utils.dataloader import data_process
+from utils.ensemble import SML_online
+from utils.pred_store import PredictionStore
 
 # This is the implementation of ensemble learning of T-TIME from paper
 # Li S, Wang Z, Luo H, et al. T-TIME: Test-time information maximization ensemble for plug-and-play BCIs[J]. IEEE Transactions on Biomedical Engineering, 2023.
@@ -121,21 +122,73 @@ def voting_ensemble_binary(preds):
 
 
 def voting_ensemble_multiclass(preds, n_classes):
-    # preds of numpy array shape (n_classifier, n_samples)
-    n_classifier, n_samples = preds.shape
-    votes_mat = np.zeros((n_classes, n_samples))
-    for i in range(n_classifier):
-        for j in range(n_samples):
-            class_id = preds[i, j]
-            votes_mat[class_id, j] += 1
-    votes_pred = []
-    for i in range(n_samples):
-        pred = np.random.choice(np.flatnonzero(votes_mat[:, i] == votes_mat[:, i].max()))
-        votes_pred.append(pred)
-    votes_pred = np.array(votes_pred)
+    # preds of numpy array shape (n_classifier, n_samples), or (n_classifier, ...) for any number of trailing axes
+    votes_mat = np.sum(np.eye(n_classes, dtype=np.int64)[preds], axis=0)
+    # vote counts are integers, so uniform noise below 1 only breaks ties, uniformly at random among the top classes
+    votes_mat = votes_mat + np.random.uniform(0, 1, size=votes_mat.shape)
+    votes_pred = np.argmax(votes_mat, axis=-1)
     return votes_pred
 
 
+def ensemble_scores(preds, y_true, ens_num, num_rotations=10):
+    """Accuracies of all ensemble methods, for every rotation of the models and every subject at once.
+
+    Rotation i ensembles models (i + 1, ..., i + ens_num) modulo the number of models. The SML ensembles are online,
+    the first ens_num test samples are predicted by averaging, then every sample by the SML weights estimated from
+    the test samples up to itself.
+
+    Parameters
+    ----------
+    preds : numpy array
+        data of shape (num_models, num_subjects, num_test_samples) of positive class probabilities for binary
+        classification, or (num_models, num_subjects, num_test_samples, num_classes)
+    y_true : numpy array
+        labels of shape (num_subjects, num_test_samples)
+    ens_num : int
+        number of models in each ensemble
+    num_rotations : int
+        number of rotations of the ensembled models
+
+    Returns
+    ----------
+    scores : dict
+        accuracies of shape (num_rotations, num_subjects), for 'avg', 'vote', 'sml_hard' and 'sml_soft' for binary
+        classification, or 'avg', 'vote' and 'sml_soft' for multiclass classification
+    """
+    preds = np.asarray(preds, dtype=np.float64)
+    binary = preds.ndim == 3
+    num_models = preds.shape[0]
+    ens_ids = (np.arange(num_rotations)[:, None] + np.arange(ens_num)[None, :] + 1) % num_models
+
+    # (num_subjects, num_rotations, num_test_samples, ens_num[, num_classes])
+    pred = np.moveaxis(preds[ens_ids], 2, 0)
+    pred = np.swapaxes(pred, 2, 3)
+    online = np.arange(pred.shape[2]) >= ens_num
+    average = np.average(pred, axis=3)
+
+    predictions = {}
+    if binary:
+        predictions['avg'] = convert_label(average, 0, 0.5)
+        votes = np.moveaxis(convert_label(pred, 0, 0.5), 3, 0)
+        predictions['vote'] = voting_ensemble_multiclass(votes, n_classes=2)
+        hard = convert_label(pred, 0, 0.5).astype(np.float64)
+        predictions['sml_hard'] = convert_label(np.where(online, SML_online(hard), average), 0, 0.5)
+        predictions['sml_soft'] = convert_label(np.where(online, SML_online(pred), average), 0, 0.5)
+    else:
+        predictions['avg'] = np.argmax(average, axis=-1)
+        votes = np.moveaxis(np.argmax(pred, axis=-1), 3, 0)
+        predictions['vote'] = voting_ensemble_multiclass(votes, n_classes=pred.shape[-1])
+        # one SML per class, (num_subjects, num_rotations, num_test_samples, num_classes)
+        sml_soft = np.moveaxis(SML_online(np.moveaxis(pred, -1, 2)), 2, -1)
+        predictions['sml_soft'] = np.argmax(np.where(online[:, None], sml_soft, average), axis=-1)
+
+    scores = {}
+    for name in predictions:
+        # (num_subjects, num_rotations) to (num_rotations, num_subjects)
+        scores[name] = np.mean(predictions[name] == y_true[:, None, :], axis=-1).T
+    return scores
+
+
 def fix_random_seed(SEED):
     tr.manual_seed(SEED)
     tr.cuda.manual_seed(SEED)
@@ -143,6 +196,30 @@ def fix_random_seed(SEED):
     random.seed(SEED)
 
 
+def print_scores(scores, names, total_mean):
+    for method_cnt, name in enumerate(names):
+
+        if name == 'avg':
+            print('###############Average Ensemble###############')
+        if name == 'vote':
+            print('###############Voting Ensemble################')
+        if name == 'sml_hard':
+            print('###############SMLhard Ensemble###################')
+        if name == 'sml_soft':
+            print('###############SMLsoft Ensemble###############')
+
+        score = scores[name]
+        subject_mean = np.round(np.average(score, axis=0) * 100, 2)
+        dataset_mean = np.round(np.average(np.average(score)) * 100, 2)
+        dataset_std = np.round(np.std(np.average(score, axis=1)) * 100, 2)
+
+        print(subject_mean)
+        print(dataset_mean)
+        print(dataset_std)
+
+        total_mean[method_cnt].append(dataset_mean)
+
+
 def binary_classification():
     method = 'T-TIME'
     data_name_list = ['BNCI2014001']
@@ -160,124 +237,17 @@ def binary_classification():
         if data_name == 'BNCI2015001': paradigm, N, chn, class_num, time_sample_num, sample_rate, trial_num, feature_deep_dim = 'MI', 12, 13, 2, 2561, 512, 200, 640
 
         seed_arr = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
-        preds = []
-        for SEED in seed_arr:
-            path = './logs/' + str(data_name) + '_'+ str(method) + '_seed_' + str(SEED) + "_pred.csv"
-            df = pd.read_csv(path, header=None)
-            preds.append(df.to_numpy())
-
-        preds = np.stack(preds)  # (num_models, num_subjects, num_test_samples)
+        preds = PredictionStore().load_all(data_name, method, seed_arr, range(num_subjects))
+        preds = preds[..., 1]  # (num_models, num_subjects, num_test_samples)
         print('test set preds shape:', preds.shape)
+        y_true = y[:num_subjects * trial_num].reshape(num_subjects, trial_num)
 
         for ens_num in range(3, 11):
 
             print('Ensembling of ' + str(ens_num) + ' models...')
 
-            acc_avg = []
-            acc_vote = []
-            acc_sml = []
-            acc_smlpred = []
-
-            for subj in range(num_subjects):
-
-                pred = preds[:, subj, :]  # (num_models, num_test_samples)
-                true = y[np.arange(trial_num).astype(int) + trial_num * subj]
-                test_trial_num = trial_num
-
-                # average
-                seed_acc = []
-                for i in range(10):
-                    ens_ids = np.arange(ens_num).astype(int) + i + 1
-                    for k in range(len(ens_ids)):
-                        if ens_ids[k] >= 11:
-                            ens_ids[k] -= 11
-                    ens_pred = np.average(pred[ens_ids, :], axis=0)
-                    ens_prediction = convert_label(ens_pred, 0, 0.5)
-                    ens_score = accuracy_score(true, ens_prediction)
-                    seed_acc.append(ens_score)
-                acc_avg.append(seed_acc)
-
-                # voting
-                seed_acc = []
-                for i in range(10):
-                    ens_ids = np.arange(ens_num).astype(int) + i + 1
-                    for k in range(len(ens_ids)):
-                        if ens_ids[k] >= 11:
-                            ens_ids[k] -= 11
-                    votes = []
-                    for id_ in ens_ids:
-                        vote_single = convert_label(pred[id_, :], 0, 0.5)
-                        votes.append(vote_single)
-                    votes = np.stack(votes)
-                    ens_prediction = voting_ensemble_multiclass(votes, n_classes=class_num)
-                    ens_score = accuracy_score(true, ens_prediction)
-                    seed_acc.append(ens_score)
-                acc_vote.append(seed_acc)
-
-                # SML hard
-                seed_acc = []
-                for i in range(10):
-                    ens_ids = np.arange(ens_num).astype(int) + i + 1
-                    for k in range(len(ens_ids)):
-                        if ens_ids[k] >= 11:
-                            ens_ids[k] -= 11
-                    ens_prediction = []
-                    for sample in range(test_trial_num):
-                        if sample < ens_num:
-                            ens_pred = np.average(pred[ens_ids, sample], axis=0)
-                            curr_pred = convert_label(ens_pred, 0, 0.5).item()
-                        else:
-                            curr_table = pred[ens_ids, :sample + 1]
-                            curr_pred = SML(curr_table)[-1]
-                        ens_prediction.append(curr_pred)
-                    ens_score = accuracy_score(true, ens_prediction)
-                    seed_acc.append(ens_score)
-                acc_sml.append(seed_acc)
-
-                # SML soft
-                seed_acc = []
-                for i in range(10):
-                    ens_ids = np.arange(ens_num).astype(int) + i + 1
-                    for k in range(len(ens_ids)):
-                        if ens_ids[k] >= 11:
-                            ens_ids[k] -= 11
-                    ens_prediction = []
-                    for sample in range(test_trial_num):
-                        if sample < ens_num:
-                            ens_pred = np.average(pred[ens_ids, sample], axis=0)
-                            curr_pred = convert_label(ens_pred, 0, 0.5).item()
-                        else:
-                            curr_table = pred[ens_ids, :sample + 1]
-                            curr_pred = SML_soft(curr_table)[-1]
-                        ens_prediction.append(curr_pred)
-                    ens_score = accuracy_score(true, ens_prediction)
-                    seed_acc.append(ens_score)
-                acc_smlpred.append(seed_acc)
-
-            method_cnt = 0
-            for score in [acc_avg, acc_vote, acc_sml, acc_smlpred]:
-
-                if method_cnt == 0:
-                    print('###############Average Ensemble###############')
-                if method_cnt == 1:
-                    print('###############Voting Ensemble################')
-                if method_cnt == 2:
-                    print('###############SMLhard Ensemble###################')
-                if method_cnt == 3:
-                    print('###############SMLsoft Ensemble###############')
-
-                score = np.array(score).transpose((1, 0))
-                subject_mean = np.round(np.average(score, axis=0) * 100, 2)
-                dataset_mean = np.round(np.average(np.average(score)) * 100, 2)
-                dataset_std = np.round(np.std(np.average(score, axis=1)) * 100, 2)
-
-                print(subject_mean)
-                print(dataset_mean)
-                print(dataset_std)
-
-                total_mean[method_cnt].append(dataset_mean)
-
-                method_cnt += 1
+            scores = ensemble_scores(preds, y_true, ens_num)
+            print_scores(scores, ['avg', 'vote', 'sml_hard', 'sml_soft'], total_mean)
 
         print(total_mean)
 
@@ -297,104 +267,19 @@ def multiclass_classification():
         if data_name == 'BNCI2014001': paradigm, N, chn, class_num, time_sample_num, sample_rate, trial_num, feature_deep_dim = 'MI', 9, 22, 2, 1001, 250, 144, 248
         if data_name == 'BNCI2014002': paradigm, N, chn, class_num, time_sample_num, sample_rate, trial_num, feature_deep_dim = 'MI', 14, 15, 2, 2561, 512, 100, 640
         if data_name == 'BNCI2015001': paradigm, N, chn, class_num, time_sample_num, sample_rate, trial_num, feature_deep_dim = 'MI', 12, 13, 2, 2561, 512, 200, 640
+        if data_name == 'BNCI2014001-4': paradigm, N, chn, class_num, time_sample_num, sample_rate, trial_num, feature_deep_dim = 'MI', 9, 22, 4, 1001, 250, 288, 248
 
         seed_arr = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
-        preds = []
-        for SEED in seed_arr:
-            path = './logs/' + str(data_name) + '_' + str(method) + '_seed_' + str(SEED) + "_pred.csv"
-            df = pd.read_csv(path, header=None)
-            preds.append(df.to_numpy())
-
-        preds = np.stack(preds)  # (num_models, num_subjects, num_test_samples)
-        preds = preds.reshape(len(seed_arr), N, trial_num, class_num)
+        preds = PredictionStore().load_all(data_name, method, seed_arr, range(num_subjects))  # (num_models, num_subjects, num_test_samples, num_classes)
         print('test set preds shape:', preds.shape)
+        y_true = y[:num_subjects * trial_num].reshape(num_subjects, trial_num)
 
         for ens_num in range(3, 11):
 
             print('Ensembling of ' + str(ens_num) + ' models...')
 
-            acc_avg = []
-            acc_vote = []
-            acc_smlpred = []
-
-            for subj in range(num_subjects):
-
-                pred = preds[:, subj, :, :]
-                true = y[np.arange(trial_num).astype(int) + trial_num * subj]
-                test_trial_num = trial_num
-
-                # average
-                seed_acc = []
-                for i in range(10):
-                    ens_ids = np.arange(ens_num).astype(int) + i + 1
-                    for k in range(len(ens_ids)):
-                        if ens_ids[k] >= 11:
-                            ens_ids[k] -= 11
-                    ens_pred = np.average(pred[ens_ids], axis=0)
-                    ens_pred = np.argmax(ens_pred, axis=-1)
-                    ens_score = accuracy_score(true, ens_pred)
-                    seed_acc.append(ens_score)
-                acc_avg.append(seed_acc)
-
-                # voting
-                seed_acc = []
-                for i in range(10):
-                    ens_ids = np.arange(ens_num).astype(int) + i + 1
-                    for k in range(len(ens_ids)):
-                        if ens_ids[k] >= 11:
-                            ens_ids[k] -= 11
-                    votes = []
-                    for id_ in ens_ids:
-                        vote_single = np.argmax(pred[id_, :, :], axis=-1)
-                        votes.append(vote_single)
-                    votes = np.stack(votes)
-                    ens_prediction = voting_ensemble_multiclass(votes, n_classes=class_num)
-                    ens_score = accuracy_score(true, ens_prediction)
-                    seed_acc.append(ens_score)
-                acc_vote.append(seed_acc)
-
-                # SML soft (TTA)
-                seed_acc = []
-                for i in range(10):
-                    ens_ids = np.arange(ens_num).astype(int) + i + 1
-                    for k in range(len(ens_ids)):
-                        if ens_ids[k] >= 11:
-                            ens_ids[k] -= 11
-                    ens_prediction = []
-                    for sample in range(test_trial_num):
-                        if sample < ens_num:
-                            ens_pred = np.average(pred[ens_ids, sample, :], axis=0)
-                            curr_pred = np.argmax(ens_pred, axis=-1)
-                        else:
-                            curr_table = pred[ens_ids, :sample + 1, :]
-                            curr_pred = SML_soft_multiclass(curr_table)[-1]
-                        ens_prediction.append(curr_pred)
-                    ens_score = accuracy_score(true, ens_prediction)
-                    seed_acc.append(ens_score)
-                acc_smlpred.append(seed_acc)
-
-            method_cnt = 0
-            for score in [acc_avg, acc_vote, acc_smlpred]:
-
-                if method_cnt == 0:
-                    print('###############Average Ensemble###############')
-                if method_cnt == 1:
-                    print('###############Voting Ensemble################')
-                if method_cnt == 2:
-                    print('###############SMLsoft Ensemble###############')
-
-                score = np.array(score).transpose((1, 0))
-                subject_mean = np.round(np.average(score, axis=0) * 100, 2)
-                dataset_mean = np.round(np.average(np.average(score)) * 100, 2)
-                dataset_std = np.round(np.std(np.average(score, axis=1)) * 100, 2)
-
-                print(subject_mean)
-                print(dataset_mean)
-                print(dataset_std)
-
-                total_mean[method_cnt].append(dataset_mean)
-
-                method_cnt += 1
+            scores = ensemble_scores(preds, y_true, ens_num)
+            print_scores(scores, ['avg', 'vote', 'sml_soft'], total_mean)
 
         print(total_mean)
 
@@ -403,6 +288,3 @@ if __name__ == '__main__':
     fix_random_seed(42)
     binary_classification()
     multiclass_classification()
-
-
-
@@ -36,7 +36,7 @@ class LogRecord:
         else:
             align_str = '_noalign_'
         file_name_head = 'log_' + self.method + align_str + self.data_name + '_'
-        self.args.out_file = open(osp.join(self.args.result_dir, file_name_head + time_str + '.txt'), 'w')
+        self.args.out_file = open(osp.join(self.args.result_dir, file_name_head + time_str + getattr(self.args, 'log_suffix', '') + '.txt'), 'w')
         self.args.out_file.write(self._print_args() + '\n')
         self.args.out_file.flush()
         return self.args
@@ -6,29 +6,51 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 
-from scipy.linalg import fractional_matrix_power
 
+def inverse_sqrtm(R):
+    """
+    Parameters
+    ----------
+    R : numpy array
+        symmetric positive definite matrices of shape (..., num_channels, num_channels)
+
+    Returns
+    ----------
+    sqrtRefEA : numpy array
+        R^(-1/2) of shape (..., num_channels, num_channels), computed via symmetric eigendecomposition
+    """
+    w, v = np.linalg.eigh(R)
+    return np.matmul(v / np.sqrt(w)[..., None, :], np.swapaxes(v, -1, -2))
 
-def EA(x):
+
+def EA(x, dtype=np.float64, out=None):
     """
     Parameters
     ----------
     x : numpy array
         data of shape (num_samples, num_channels, num_time_samples)
+        or (num_subjects, num_samples, num_channels, num_time_samples), aligning each subject separately
+    dtype : numpy dtype
+        computation and output type, np.float32 halves the memory traffic for large arrays
+    out : numpy array
+        optional preallocated output of the same shape as x and type dtype
 
     Returns
     ----------
     XEA : numpy array
-        data of shape (num_samples, num_channels, num_time_samples)
+        data of the same shape as x
     """
-    cov = np.zeros((x.shape[0], x.shape[1], x.shape[1]))
-    for i in range(x.shape[0]):
-        cov[i] = np.cov(x[i])
-    refEA = np.mean(cov, 0)
-    sqrtRefEA = fractional_matrix_power(refEA, -0.5)
-    XEA = np.zeros(x.shape)
-    for i in range(x.shape[0]):
-        XEA[i] = np.dot(sqrtRefEA, x[i])
+    x = np.asarray(x, dtype=dtype)
+    num_time_samples = x.shape[-1]
+    # covariance matrices of all trials in one batched matmul, normalized as np.cov, of the centered trials so that
+    # large channel offsets do not cancel out the precision of float32
+    xc = x - np.mean(x, axis=-1, keepdims=True)
+    cov = np.matmul(xc, np.swapaxes(xc, -1, -2))
+    del xc
+    cov /= num_time_samples - 1
+    refEA = np.mean(cov, axis=-3)
+    sqrtRefEA = inverse_sqrtm(refEA.astype(np.float64)).astype(dtype)
+    XEA = np.matmul(sqrtRefEA[..., None, :, :], x, out=out)
     return XEA
 
 
@@ -54,4 +76,104 @@ def EA_online(x, R, sample_num):
     return refEA
 
 
+def EA_online_batch(X):
+    """Incremental EA of a whole test stream at once, without any Python loop over the trials.
+
+    Trial i is aligned with the mean covariance of trials 0..i, exactly as by IncrementalAligner one trial at a time:
+    all covariances are computed together, prefix-summed, and every R_i^(-1/2) comes from one batched eigh.
+
+    Parameters
+    ----------
+    X : numpy array
+        data of shape (num_samples, num_channels, num_time_samples), in stream order
+
+    Returns
+    ----------
+    XEA : numpy array
+        data of shape (num_samples, num_channels, num_time_samples)
+    """
+    X = np.asarray(X, dtype=np.float64)
+    # per-trial covariances, with the normalization of np.cov
+    Xc = X - np.mean(X, axis=-1, keepdims=True)
+    covs = np.matmul(Xc, np.swapaxes(Xc, -1, -2)) / (X.shape[-1] - 1)
+    # running mean covariance of every prefix of the stream
+    R = np.cumsum(covs, axis=0) / np.arange(1, len(X) + 1)[:, None, None]
+    XEA = np.matmul(inverse_sqrtm(R), X)
+    return XEA
+
+
+class IncrementalAligner:
+    """Incremental EA, holding the running reference matrix R together with R^(-1/2).
+
+    R is updated with the same running mean as EA_online. R^(-1/2) is obtained from the symmetric eigendecomposition of
+    R (eigh), which for a (num_channels, num_channels) matrix is orders of magnitude cheaper than the Schur-based
+    fractional_matrix_power. With refresh > 1 the eigendecomposition is only redone every refresh trials, and the
+    previous R^(-1/2) keeps being used in between.
+    """
+    def __init__(self, refresh=1):
+        assert refresh > 0, "aligner requires refreshing every >= 1 trial(s)"
+        self.refresh = refresh
+        self.R = 0
+        self.sqrtRefEA = None
+        # number of trials used to calculate R
+        self.num_samples = 0
+
+    def update(self, x):
+        """
+        Parameters
+        ----------
+        x : numpy array
+            sample of shape (num_channels, num_time_samples)
+
+        Returns
+        ----------
+        sqrtRefEA : numpy array
+            current R^(-1/2) of shape (num_channels, num_channels)
+        """
+        return self.update_cov(np.cov(x))
+
+    def update_cov(self, cov):
+        """
+        Parameters
+        ----------
+        cov : numpy array
+            covariance matrix of the new sample, of shape (num_channels, num_channels)
+
+        Returns
+        ----------
+        sqrtRefEA : numpy array
+            current R^(-1/2) of shape (num_channels, num_channels)
+        """
+        self.R = (self.R * self.num_samples + cov) / (self.num_samples + 1)
+        self.num_samples += 1
+        if self.sqrtRefEA is None or self.num_samples % self.refresh == 0:
+            self.sqrtRefEA = inverse_sqrtm(self.R)
+        return self.sqrtRefEA
+
+    def transform(self, x):
+        """
+        Parameters
+        ----------
+        x : numpy array
+            sample of shape (num_channels, num_time_samples)
+
+        Returns
+        ----------
+        x_aligned : numpy array
+            sample of shape (num_channels, num_time_samples)
+        """
+        return np.dot(self.sqrtRefEA, x)
+
+    def transform_batch(self, X):
+        """
+        Parameters
+        ----------
+        X : numpy array
+            data of shape (..., num_channels, num_time_samples)
 
+        Returns
+        ----------
+        X_aligned : numpy array
+            data of shape (..., num_channels, num_time_samples)
+        """
+        return np.matmul(self.sqrtRefEA, X)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : batch_loader.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+import torch.utils.data as Data
+
+# background thread gathering the next batches of every prefetching loader of the process, see prefetch_executor
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def prefetch_executor():
+    """
+    Returns
+    ----------
+    executor : ThreadPoolExecutor
+        single-thread executor shared by all TensorBatchLoader with prefetch, created on first use and kept for the life
+        of the process, so that no thread is left behind by loaders or epochs dropped before their end
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+    return _executor
+
+
+class TensorBatchLoader:
+    """Drop-in replacement of Data.DataLoader(Data.TensorDataset(X, y), batch_size, shuffle, drop_last) for in-memory
+    tensors, gathering every batch with a single index_select from contiguous storage instead of indexing trial by trial
+    and collating.
+
+    Epochs draw from the global random state exactly as DataLoader does, a seed for the iterator when it is created and,
+    if shuffled, a seed for the permutation of RandomSampler at its first batch, so batches, and everything random after
+    them, are the same as with DataLoader. With prefetch, the next batch is gathered on the background thread of
+    prefetch_executor while the current one is used; with pin_memory, batches of CPU tensors are gathered into page-locked memory, for
+    non-blocking copies to GPU.
+    """
+    def __init__(self, X, y, batch_size=1, shuffle=False, drop_last=False, prefetch=False, pin_memory=False):
+        """
+        Parameters
+        ----------
+        X : torch tensor
+            trials of shape (num_trials, ...)
+        y : torch tensor
+            labels of shape (num_trials,)
+        batch_size : int
+            number of trials per batch
+        shuffle : bool
+            whether draw a new permutation of the trials every epoch
+        drop_last : bool
+            whether drop the last batch if it is incomplete
+        prefetch : bool
+            whether gather the next batch on a background thread
+        pin_memory : bool
+            whether gather batches of CPU tensors into pinned memory
+        """
+        # contiguous copies, so that batches are gathered from dense rows instead of strided memory
+        self.X = X.contiguous()
+        self.y = y.contiguous()
+        # for callers indexing the trials directly, see calibration_trials
+        self.dataset = Data.TensorDataset(self.X, self.y)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.pin_memory = pin_memory and not self.X.is_cuda and torch.cuda.is_available()
+        self.prefetch = prefetch
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.X) // self.batch_size
+        return (len(self.X) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        # base seed of the workers drawn by every DataLoader iterator, shuffled or not, unused here but drawn all the same
+        torch.empty((), dtype=torch.int64).random_()
+        return self._batches()
+
+    def _batches(self):
+        n = len(self.X)
+        if self.shuffle:
+            # as RandomSampler, at the first batch
+            generator = torch.Generator()
+            generator.manual_seed(int(torch.empty((), dtype=torch.int64).random_().item()))
+            order = torch.randperm(n, generator=generator)
+        else:
+            order = torch.arange(n)
+        order = order.to(self.X.device)
+        idx = [order[start:start + self.batch_size] for start in range(0, len(self) * self.batch_size, self.batch_size)]
+        if len(idx) == 0:
+            return
+
+        if not self.prefetch:
+            for i in idx:
+                yield self._gather(i)
+            return
+        executor = prefetch_executor()
+        future = executor.submit(self._gather, idx[0])
+        for i in range(len(idx)):
+            batch = future.result()
+            if i + 1 < len(idx):
+                future = executor.submit(self._gather, idx[i + 1])
+            yield batch
+
+    def _gather(self, i):
+        if not self.pin_memory:
+            return self.X.index_select(0, i), self.y.index_select(0, i)
+        X = torch.empty((len(i),) + self.X.shape[1:], dtype=self.X.dtype, pin_memory=True)
+        y = torch.empty((len(i),) + self.y.shape[1:], dtype=self.y.dtype, pin_memory=True)
+        torch.index_select(self.X, 0, i, out=X)
+        torch.index_select(self.y, 0, i, out=y)
+        return X, y
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : buffer.py
+import torch
+
+
+class TrialRingBuffer:
+    """Fixed-capacity buffer holding the most recent test trials of an online stream.
+
+    Online TTA only ever reads back the last ``args.test_batch`` trials, so the stream is kept in a preallocated
+    (capacity, 1, num_channels, num_time_samples) tensor that is overwritten cyclically. Appending a trial is a single
+    copy into the next slot, and memory stays bounded regardless of the session length.
+    """
+    def __init__(self, capacity, chn, time_sample_num, dtype=torch.float32, device='cpu'):
+        assert capacity > 0, "ring buffer requires a capacity of >= 1 trial(s)"
+        self.capacity = capacity
+        self.chn = chn
+        self.time_sample_num = time_sample_num
+        self.data = torch.zeros((capacity, 1, chn, time_sample_num), dtype=dtype, device=device)
+        # total number of trials appended so far
+        self.num_seen = 0
+
+    def __len__(self):
+        return min(self.num_seen, self.capacity)
+
+    def append(self, x):
+        """
+        Parameters
+        ----------
+        x : torch tensor
+            single trial, of any shape that can be reshaped to (num_channels, num_time_samples)
+        """
+        pos = self.num_seen % self.capacity
+        self.data[pos, 0].copy_(x.reshape(self.chn, self.time_sample_num))
+        self.num_seen += 1
+
+    def last(self):
+        """
+        Returns
+        ----------
+        trial : torch tensor
+            view of the latest trial, of shape (1, 1, num_channels, num_time_samples)
+        """
+        assert self.num_seen > 0, "ring buffer is empty"
+        pos = (self.num_seen - 1) % self.capacity
+        return self.data[pos:pos + 1]
+
+    def latest(self, n=None):
+        """
+        Parameters
+        ----------
+        n : int
+            number of most recent trials to return, defaults to all trials currently held
+
+        Returns
+        ----------
+        batch : torch tensor
+            trials in stream order, of shape (n, 1, num_channels, num_time_samples)
+            a view of the storage if the window does not wrap around, otherwise a single concatenation
+        """
+        segments = self.segments(n)
+        if len(segments) == 1:
+            return segments[0]
+        return torch.cat(segments)
+
+    def segments(self, n=None):
+        """
+        Parameters
+        ----------
+        n : int
+            number of most recent trials, defaults to all trials currently held
+
+        Returns
+        ----------
+        segments : list
+            one or two views of the storage, holding the n most recent trials in stream order once concatenated
+        """
+        if n is None:
+            n = len(self)
+        assert 0 < n <= len(self), "requested " + str(n) + " trials, but only " + str(len(self)) + " are held"
+        end = (self.num_seen - 1) % self.capacity + 1
+        start = end - n
+        if start >= 0:
+            return [self.data[start:end]]
+        return [self.data[start + self.capacity:], self.data[:end]]
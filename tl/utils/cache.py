@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : cache.py
+import hashlib
+import os
+
+import numpy as np
+
+from tl.utils.alg_utils import EA
+from tl.utils.dataloader import data_path, data_session
+from tl.utils.resample import target_rate, resample_trials
+
+# dataset files whose change invalidates the cached arrays
+_source_files = ['X.npy', 'labels.npy', 'manifest.json']
+
+
+def source_hash(args):
+    """
+    Parameters
+    ----------
+    args : argparse.Namespace
+        experiment arguments, using data
+
+    Returns
+    ----------
+    digest : str
+        hash of the size and modification time of the dataset files
+    """
+    h = hashlib.md5()
+    for name in _source_files:
+        path = data_path(args.data) + name
+        if os.path.exists(path):
+            st = os.stat(path)
+            h.update((name + str(st.st_size) + str(st.st_mtime_ns)).encode())
+    return h.hexdigest()[:12]
+
+
+def preprocess_hash(args, shape):
+    """
+    Parameters
+    ----------
+    args : argparse.Namespace
+        experiment arguments, using data, method through data_session, resample and sample_rate
+    shape : tuple
+        per-subject array shape (num_samples, num_channels, num_time_samples)
+
+    Returns
+    ----------
+    digest : str
+        hash of the shape, of the session read by the method and of the resampled rate, which with the dataset files
+        are all that the per-subject arrays depend on, followed by source_hash(args)
+    """
+    h = hashlib.md5()
+    h.update((str(shape) + data_session(args)).encode())
+    if getattr(args, 'resample', False):
+        # trials resampled to args.sample_rate, see resampled_trials
+        h.update(('resample' + str(args.sample_rate)).encode())
+    return h.hexdigest()[:12] + '_' + source_hash(args)
+
+
+def save_cached(cache_dir, key, X):
+    """Write X as cache_dir/key.npy, and remove the files of the same key written from older dataset files.
+
+    Parameters
+    ----------
+    cache_dir : str
+        cache directory, created if missing
+    key : str
+        file name without extension, ending with source_hash
+    X : numpy array
+        data to cache
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    # write then rename, so that parallel runs never read a partial file
+    tmp_path = cache_dir + key + '.' + str(os.getpid()) + '.tmp.npy'
+    np.save(tmp_path, X)
+    os.replace(tmp_path, cache_dir + key + '.npy')
+    prefix = key[:key.rindex('_') + 1]
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and name != key + '.npy' and not name.endswith('.tmp.npy') and \
+                len(name) == len(key + '.npy'):
+            try:
+                os.remove(cache_dir + name)
+            except FileNotFoundError:
+                # removed by a parallel run
+                pass
+
+
+def aligned_subjects(X, subject_ids, args, mode='EA'):
+    """Subject-wise EA of X, aligning every (dataset, subject, session) at most once per sweep.
+
+    Per-subject EA output does not depend on the fold or the seed, so each aligned subject is saved under
+    ./data/<dataset>/aligned/ and memory-mapped when read again, sharing its pages between the processes of a sweep.
+    Entries are keyed by dataset name, subject index, session and preprocess_hash, which includes the size and
+    modification time of X.npy (or of the shard manifest), so regenerating the data invalidates them, and the entry is
+    replaced when aligned again.
+
+    Parameters
+    ----------
+    X : numpy array
+        data of shape (num_subjects, num_samples, num_channels, num_time_samples)
+    subject_ids : list
+        dataset subject index of each entry along the first axis of X
+    args : argparse.Namespace
+        experiment arguments, using data, method through data_session, resample and sample_rate, see preprocess_hash
+    mode : str
+        alignment mode, only 'EA' for now
+
+    Returns
+    ----------
+    XEA : numpy array
+        float32 data of shape (num_subjects, num_samples, num_channels, num_time_samples)
+    """
+    assert len(subject_ids) == X.shape[0], "one subject index is needed per subject"
+    digest = preprocess_hash(args, X.shape[1:])
+    cache_dir = data_path(args.data) + 'aligned/'
+
+    XEA = np.empty(X.shape, dtype=np.float32)
+    keys = []
+    missing = []
+    for i, sid in enumerate(subject_ids):
+        key = str(args.data) + '_S' + str(sid) + '_' + data_session(args) + '_' + mode + '_' + digest
+        keys.append(key)
+        if os.path.exists(cache_dir + key + '.npy'):
+            XEA[i] = np.load(cache_dir + key + '.npy', mmap_mode='r')
+        else:
+            missing.append(i)
+
+    if len(missing) > 0:
+        print('aligning subjects', [subject_ids[i] for i in missing])
+        XEA[missing] = EA(X[missing])
+        for i in missing:
+            save_cached(cache_dir, keys[i], XEA[i])
+
+    return XEA
+
+
+def resampled_trials(X, args, sample_rate):
+    """Trials of a dataset resampled to the rate of target_rate, resampling every (dataset, session) at most once.
+
+    Resampled arrays are saved under ./data/<dataset>/resampled/ and memory-mapped when read again, keyed by dataset
+    name, session, rate and preprocess_hash, as in aligned_subjects.
+
+    Parameters
+    ----------
+    X : list
+        recorded data of every subject, numpy arrays of shape (num_samples, num_channels, num_time_samples)
+    args : argparse.Namespace
+        experiment arguments, using data, method through data_session, resample and sample_rate, see preprocess_hash
+    sample_rate : int
+        recorded sample rate, in Hz
+
+    Returns
+    ----------
+    X : list
+        float32 data of every subject, of shape (num_samples, num_channels, resampled_time_samples), read-only views of
+        the cached file, X itself if not resampled
+    """
+    rate = target_rate(args.data, sample_rate, getattr(args, 'resample', False))
+    if rate == sample_rate:
+        return X
+    sizes = [len(x) for x in X]
+    shape = (sum(sizes),) + X[0].shape[1:]
+    key = str(args.data) + '_' + data_session(args) + '_' + str(rate) + 'Hz_' + preprocess_hash(args, shape)
+    cache_dir = data_path(args.data) + 'resampled/'
+    if os.path.exists(cache_dir + key + '.npy'):
+        XR = np.load(cache_dir + key + '.npy', mmap_mode='r')
+    else:
+        print('resampling', args.data, 'from', sample_rate, 'Hz to', rate, 'Hz')
+        # subject by subject, by chunks of trials, bounding the float64 intermediates of the filter
+        XR = np.concatenate([resample_trials(x[i:i + 256], sample_rate, rate)
+                             for x in X for i in range(0, len(x), 256)])
+        save_cached(cache_dir, key, XR)
+
+    return np.split(XR, np.cumsum(sizes)[:-1])
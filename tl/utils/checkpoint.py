@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : checkpoint.py
+import collections
+import inspect
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from utils.resample import resample_suffix
+
+
+class CheckpointRegistry:
+    """Model checkpoints of every (dataset, backbone, subject, seed), as root/<dataset>/<backbone>_S<subject>_seed<seed>
+    [_noEA][suffix][_adapted].ckpt, with the state dicts loaded in this process kept in an LRU cache.
+
+    Cached state dicts are on CPU, at most max_bytes of tensors in total, and shared by every caller: they are meant for
+    load_state_dict, which copies them, and must not be modified in place. An entry is keyed by the modification time and
+    size of its file, so a checkpoint saved again, by this process or another one, is read again. prefetch() loads a
+    checkpoint on a background thread, so that the next subject is read from disk while the current one adapts.
+    """
+    def __init__(self, root='./runs/', max_bytes=256 * 2 ** 20, mmap=True):
+        """
+        Parameters
+        ----------
+        root : str
+            directory of the checkpoints of every dataset
+        max_bytes : int
+            size bound of the cached tensors, the latest state dict is kept even if larger
+        mmap : bool
+            whether memory-map the checkpoint files instead of reading them, if torch.load supports it
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.mmap = mmap and 'mmap' in inspect.signature(torch.load).parameters
+        # path -> ((modification time, size), state dict, size in bytes), least recently used first
+        self.cache = collections.OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.executor = None
+
+    def path(self, dataset, backbone, subject, seed, align=True, adapted=False, suffix=''):
+        """
+        Parameters
+        ----------
+        dataset : str
+            dataset name
+        backbone : str
+            backbone name, or method name for models trained by a transfer learning method
+        subject : int
+            index of the target subject
+        seed : int
+            random seed of the model
+        align : bool
+            whether the model was trained on Euclidean-aligned data, otherwise the name ends with _noEA
+        adapted : bool
+            whether the model was adapted to the target subject, otherwise it is the source model
+        suffix : str
+            appended to the name of models of other input shapes, such as resample_suffix(args)
+
+        Returns
+        ----------
+        path : str
+            checkpoint file
+        """
+        return (self.root + str(dataset) + '/' + str(backbone) + '_S' + str(subject) + '_seed' + str(seed) +
+                ('' if align else '_noEA') + suffix + ('_adapted' if adapted else '') + '.ckpt')
+
+    def load(self, dataset, backbone, subject, seed, align=True, adapted=False, suffix=''):
+        """
+        Returns
+        ----------
+        state_dict : dict
+            cached CPU state dict of the checkpoint, see path for the parameters
+        """
+        path = self.path(dataset, backbone, subject, seed, align, adapted, suffix)
+        with self.lock:
+            future = self.pending.pop(path, None)
+        if future is not None:
+            # propagates the errors of the background load
+            future.result()
+        key = self._key(path)
+        with self.lock:
+            entry = self.cache.get(path)
+            if entry is not None and entry[0] == key:
+                self.cache.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        return self._read(path, key)
+
+    def prefetch(self, dataset, backbone, subject, seed, align=True, adapted=False, suffix=''):
+        # load the checkpoint into the cache on a background thread, if it exists and is not cached yet
+        path = self.path(dataset, backbone, subject, seed, align, adapted, suffix)
+        if not os.path.exists(path):
+            return
+        key = self._key(path)
+        with self.lock:
+            entry = self.cache.get(path)
+            if path in self.pending or (entry is not None and entry[0] == key):
+                return
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1)
+            self.pending[path] = self.executor.submit(self._read, path, key)
+
+    def save(self, state_dict, dataset, backbone, subject, seed, align=True, adapted=False, suffix=''):
+        """
+        Parameters
+        ----------
+        state_dict : dict
+            state dict of the model, saved as the checkpoint, see path for the other parameters
+        """
+        path = self.path(dataset, backbone, subject, seed, align, adapted, suffix)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, so that readers, and memory maps of the previous file, never see a partial checkpoint
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        torch.save(state_dict, tmp_path)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self._evict(path)
+
+    def _key(self, path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read(self, path, key):
+        if self.mmap:
+            state_dict = torch.load(path, map_location='cpu', mmap=True)
+        else:
+            state_dict = torch.load(path, map_location='cpu')
+        num_bytes = sum(v.numel() * v.element_size() for v in state_dict.values() if torch.is_tensor(v))
+        with self.lock:
+            self._evict(path)
+            self.cache[path] = (key, state_dict, num_bytes)
+            self.num_bytes += num_bytes
+            while self.num_bytes > self.max_bytes and len(self.cache) > 1:
+                self._evict(next(iter(self.cache)))
+        return state_dict
+
+    def _evict(self, path):
+        entry = self.cache.pop(path, None)
+        if entry is not None:
+            self.num_bytes -= entry[2]
+
+
+# shared by all drivers and methods run in this process
+checkpoints = CheckpointRegistry()
+
+
+def load_source(model, args, seed=None):
+    """Load the source model of target subject args.idt into model, then prefetch that of the next subject.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        nn.Sequential(netF, netC) of backbone args.backbone, on any device
+    args : argparse.Namespace
+        experiment arguments, using data_name, backbone, idt, SEED, align, N, and data and resample
+    seed : int
+        random seed of the model, args.SEED if None
+    """
+    seed = args.SEED if seed is None else seed
+    suffix = resample_suffix(args)
+    model.load_state_dict(checkpoints.load(args.data_name, args.backbone, args.idt, seed, args.align, suffix=suffix))
+    if args.idt + 1 < getattr(args, 'N', 0):
+        checkpoints.prefetch(args.data_name, args.backbone, args.idt + 1, seed, args.align, suffix=suffix)
+
+
+def save_model(model, args, seed=None, adapted=False, name=None):
+    """Save model as the checkpoint of target subject args.idt.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        model to save
+    args : argparse.Namespace
+        experiment arguments, using data_name, backbone, idt, SEED, align, and data and resample
+    seed : int
+        random seed of the model, args.SEED if None
+    adapted : bool
+        whether the model was adapted to the target subject
+    name : str
+        name of the model in the file name, args.backbone if None
+    """
+    seed = args.SEED if seed is None else seed
+    name = args.backbone if name is None else name
+    checkpoints.save(model.state_dict(), args.data_name, name, args.idt, seed, args.align, adapted, resample_suffix(args))
@@ -26,10 +26,18 @@ def time_cut(data, cut_percentage):
     return data
 
 
+def subject_split(X, num_subjects):
+    # per-subject arrays, X is either the data of all subjects or already a list of them, see data_process
+    if isinstance(X, list):
+        return list(X)
+    return np.split(X, indices_or_sections=num_subjects, axis=0)
+
+
 def traintest_split_cross_subject(dataset, X, y, num_subjects, test_subject_id):
-    data_subjects = np.split(X, indices_or_sections=num_subjects, axis=0)
+    data_subjects = subject_split(X, num_subjects)
     labels_subjects = np.split(y, indices_or_sections=num_subjects, axis=0)
-    test_x = data_subjects.pop(test_subject_id)
+    # in memory, the subjects may be read-only memory-mapped views of the files
+    test_x = np.array(data_subjects.pop(test_subject_id))
     test_y = labels_subjects.pop(test_subject_id)
     train_x = np.concatenate(data_subjects, axis=0)
     train_y = np.concatenate(labels_subjects, axis=0)
@@ -39,7 +47,7 @@ def traintest_split_cross_subject(dataset, X, y, num_subjects, test_subject_id):
 
 
 def traintest_split_domain_classifier(dataset, X, y, num_subjects, test_subject_id):
-    data_subjects = np.split(X, indices_or_sections=num_subjects, axis=0)
+    data_subjects = subject_split(X, num_subjects)
     labels_subjects = np.split(y, indices_or_sections=num_subjects, axis=0)
     data_subjects.pop(test_subject_id)
     labels_subjects.pop(test_subject_id)
@@ -53,13 +61,14 @@ def traintest_split_domain_classifier(dataset, X, y, num_subjects, test_subject_
 
 
 def traintest_split_domain_classifier_pretest(dataset, X, y, num_subjects, ratio):
-    data_subjects = np.split(X, indices_or_sections=num_subjects, axis=0)
+    data_subjects = subject_split(X, num_subjects)
     train_x_all = []
     train_y_all = []
     test_x_all = []
     test_y_all = []
     for i in range(num_subjects):
-        data = data_subjects[i]
+        # in memory, shuffled in place
+        data = np.array(data_subjects[i])
         random.shuffle(data)
         train_x_all.append(data[:int(len(data) * ratio)])
         train_y_all.append(np.ones((int(len(data) * ratio)),) * i)
@@ -74,11 +83,12 @@ def traintest_split_domain_classifier_pretest(dataset, X, y, num_subjects, ratio
 
 
 def traintest_split_multisource(dataset, X, y, num_subjects, test_subject_id):
-    data_subjects = np.split(X, indices_or_sections=num_subjects, axis=0)
+    data_subjects = subject_split(X, num_subjects)
     labels_subjects = np.split(y, indices_or_sections=num_subjects, axis=0)
-    test_x = data_subjects.pop(test_subject_id)
+    # in memory, the subjects may be read-only memory-mapped views of the files
+    test_x = np.array(data_subjects.pop(test_subject_id))
     test_y = labels_subjects.pop(test_subject_id)
-    train_x = data_subjects
+    train_x = [np.array(x) for x in data_subjects]
     train_y = labels_subjects
     print('Test subject s' + str(test_subject_id))
     print('Training/Test split:', len(train_x), 'Source Subjects of', train_x[0].shape, test_x[0].shape)
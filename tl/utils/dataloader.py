@@ -4,22 +4,62 @@
 # @File    : dataloader.py
 import numpy as np
 from sklearn import preprocessing
+from utils.shards import load_trials
 from utils.data_utils import traintest_split_cross_subject, traintest_split_domain_classifier, traintest_split_multisource, traintest_split_domain_classifier_pretest, traintest_split_multisource
 
 
-def data_process(dataset):
+def data_path(dataset):
     '''
 
     :param dataset: str, dataset name
+    :return: str, directory holding the dataset files
+    '''
+    # BNCI2014001-4 is read from the same files as BNCI2014001
+    if dataset == 'BNCI2014001-4':
+        dataset = 'BNCI2014001'
+    return './data/' + dataset + '/'
+
+
+def data_session(args):
+    '''
+
+    :param args: argparse.Namespace, experiment arguments
+    :return: str, session of the target data that the method reads
+    '''
+    if 'ontinual' in args.method:  # TODO
+        # Continual TTA
+        return 'session2'
+    return 'session1'
+
+
+def select_trials(X, y, indices):
+    '''
+
+    :param X: ShardedTrials or numpy memmap, all trials of the dataset, see load_trials
+    :param y: numpy array, all labels
+    :param indices: list of numpy arrays, indices of the trials of each subject
+    :return: list of per-subject numpy arrays, zero-copy memory-mapped views for subjects whose trials are contiguous in
+        the files, and the labels of all selected trials
+    '''
+    X_subjects = []
+    for idx in indices:
+        if len(idx) > 0 and np.all(np.diff(idx) == 1):
+            X_subjects.append(X[idx[0]:idx[-1] + 1])
+        else:
+            # only reads the selected trials of the subject
+            X_subjects.append(X[idx])
+    return X_subjects, y[np.concatenate(indices, axis=0)]
+
+
+def data_process(dataset, per_subject=False):
+    '''
+
+    :param dataset: str, dataset name
+    :param per_subject: bool, whether return X as a list of per-subject arrays, see select_trials
     :return: X, y, num_subjects, paradigm, sample_rate
     '''
 
-    if dataset == 'BNCI2014001-4':
-        X = np.load('./data/' + 'BNCI2014001' + '/X.npy')
-        y = np.load('./data/' + 'BNCI2014001' + '/labels.npy')
-    else:
-        X = np.load('./data/' + dataset + '/X.npy')
-        y = np.load('./data/' + dataset + '/labels.npy')
+    X, y = load_trials(data_path(dataset))
     print(X.shape, y.shape)
 
     num_subjects, paradigm, sample_rate = None, None, None
@@ -34,17 +74,10 @@ def data_process(dataset):
         indices = []
         for i in range(num_subjects):
             indices.append(np.arange(288) + (576 * i))
-        indices = np.concatenate(indices, axis=0)
-        X = X[indices]
-        y = y[indices]
 
         # only use two classes [left_hand, right_hand]
-        indices = []
-        for i in range(len(y)):
-            if y[i] in ['left_hand', 'right_hand']:
-                indices.append(i)
-        X = X[indices]
-        y = y[indices]
+        indices = [idx[np.isin(y[idx], ['left_hand', 'right_hand'])] for idx in indices]
+        X, y = select_trials(X, y, indices)
     elif dataset == 'BNCI2014002':
         paradigm = 'MI'
         num_subjects = 14
@@ -55,9 +88,7 @@ def data_process(dataset):
         indices = []
         for i in range(num_subjects):
             indices.append(np.arange(100) + (160 * i))
-        indices = np.concatenate(indices, axis=0)
-        X = X[indices]
-        y = y[indices]
+        X, y = select_trials(X, y, indices)
 
     elif dataset == 'BNCI2015001':
         paradigm = 'MI'
@@ -75,9 +106,7 @@ def data_process(dataset):
             else:
                 indices.append(np.arange(200) + (400 * i))
 
-        indices = np.concatenate(indices, axis=0)
-        X = X[indices]
-        y = y[indices]
+        X, y = select_trials(X, y, indices)
     elif dataset == 'BNCI2014001-4':
         paradigm = 'MI'
         num_subjects = 9
@@ -88,29 +117,25 @@ def data_process(dataset):
         indices = []
         for i in range(num_subjects):
             indices.append(np.arange(288) + (576 * i))
-        indices = np.concatenate(indices, axis=0)
-        X = X[indices]
-        y = y[indices]
+        X, y = select_trials(X, y, indices)
 
     le = preprocessing.LabelEncoder()
     y = le.fit_transform(y)
-    print('data shape:', X.shape, ' labels shape:', y.shape)
+    print('data shape:', (len(y),) + X[0].shape[1:], ' labels shape:', y.shape)
+    if not per_subject:
+        X = np.concatenate(X, axis=0)
     return X, y, num_subjects, paradigm, sample_rate, ch_num
 
 
-def data_process_secondsession(dataset):
+def data_process_secondsession(dataset, per_subject=False):
     '''
 
     :param dataset: str, dataset name
+    :param per_subject: bool, whether return X as a list of per-subject arrays, see select_trials
     :return: X, y, num_subjects, paradigm, sample_rate
     '''
 
-    if dataset == 'BNCI2014001-4':
-        X = np.load('./data/' + 'BNCI2014001' + '/X.npy')
-        y = np.load('./data/' + 'BNCI2014001' + '/labels.npy')
-    else:
-        X = np.load('./data/' + dataset + '/X.npy')
-        y = np.load('./data/' + dataset + '/labels.npy')
+    X, y = load_trials(data_path(dataset))
     print(X.shape, y.shape)
 
     num_subjects, paradigm, sample_rate = None, None, None
@@ -125,17 +150,10 @@ def data_process_secondsession(dataset):
         indices = []
         for i in range(num_subjects):
             indices.append(np.arange(288) + (576 * i) + 288) # use second sessions
-        indices = np.concatenate(indices, axis=0)
-        X = X[indices]
-        y = y[indices]
 
         # only use two classes [left_hand, right_hand]
-        indices = []
-        for i in range(len(y)):
-            if y[i] in ['left_hand', 'right_hand']:
-                indices.append(i)
-        X = X[indices]
-        y = y[indices]
+        indices = [idx[np.isin(y[idx], ['left_hand', 'right_hand'])] for idx in indices]
+        X, y = select_trials(X, y, indices)
     elif dataset == 'BNCI2014002':
         paradigm = 'MI'
         num_subjects = 14
@@ -147,9 +165,7 @@ def data_process_secondsession(dataset):
         for i in range(num_subjects):
             #indices.append(np.arange(100) + (160 * i))
             indices.append(np.arange(60) + (160 * i) + 100) # use second sessions
-        indices = np.concatenate(indices, axis=0)
-        X = X[indices]
-        y = y[indices]
+        X, y = select_trials(X, y, indices)
 
     elif dataset == 'BNCI2015001':
         paradigm = 'MI'
@@ -168,9 +184,7 @@ def data_process_secondsession(dataset):
             else:
                 indices.append(np.arange(200) + (400 * i))
 
-        indices = np.concatenate(indices, axis=0)
-        X = X[indices]
-        y = y[indices]
+        X, y = select_trials(X, y, indices)
     elif dataset == 'BNCI2014001-4':
         paradigm = 'MI'
         num_subjects = 9
@@ -181,22 +195,37 @@ def data_process_secondsession(dataset):
         indices = []
         for i in range(num_subjects):
             indices.append(np.arange(288) + (576 * i))
-        indices = np.concatenate(indices, axis=0)
-        X = X[indices]
-        y = y[indices]
+        X, y = select_trials(X, y, indices)
 
     le = preprocessing.LabelEncoder()
     y = le.fit_transform(y)
-    print('data shape:', X.shape, ' labels shape:', y.shape)
+    print('data shape:', (len(y),) + X[0].shape[1:], ' labels shape:', y.shape)
+    if not per_subject:
+        X = np.concatenate(X, axis=0)
     return X, y, num_subjects, paradigm, sample_rate, ch_num
 
 
+def front_end(X, sample_rate, args):
+    '''
+
+    :param X: list of per-subject numpy arrays, recorded data of shape (num_samples, num_channels, num_time_samples)
+    :param sample_rate: int, recorded sample rate
+    :param args: argparse.Namespace, experiment arguments
+    :return: X resampled to the rate of get_dataset_params if args.resample, cached, see resampled_trials
+    '''
+    if not getattr(args, 'resample', False):
+        return X
+    # imported here, cache imports this module
+    from tl.utils.cache import resampled_trials
+    return resampled_trials(X, args, sample_rate)
+
+
 def read_mi_combine_tar(args):
-    if 'ontinual' in args.method:  # TODO
-        # Continual TTA
-        X, y, num_subjects, paradigm, sample_rate, ch_num = data_process_secondsession(args.data)
+    if data_session(args) == 'session2':
+        X, y, num_subjects, paradigm, sample_rate, ch_num = data_process_secondsession(args.data, per_subject=True)
     else:
-        X, y, num_subjects, paradigm, sample_rate, ch_num = data_process(args.data)
+        X, y, num_subjects, paradigm, sample_rate, ch_num = data_process(args.data, per_subject=True)
+    X = front_end(X, sample_rate, args)
 
     src_data, src_label, tar_data, tar_label = traintest_split_cross_subject(args.data, X, y, num_subjects, args.idt)
 
@@ -205,7 +234,8 @@ def read_mi_combine_tar(args):
 
 def read_mi_combine_domain(args):
 
-    X, y, num_subjects, paradigm, sample_rate, ch_num = data_process(args.data)
+    X, y, num_subjects, paradigm, sample_rate, ch_num = data_process(args.data, per_subject=True)
+    X = front_end(X, sample_rate, args)
 
     src_data, src_label, tar_data, tar_label = traintest_split_domain_classifier(args.data, X, y, num_subjects, args.idt)
 
@@ -214,7 +244,8 @@ def read_mi_combine_domain(args):
 
 def read_mi_combine_domain_split(args):
 
-    X, y, num_subjects, paradigm, sample_rate, ch_num = data_process(args.data)
+    X, y, num_subjects, paradigm, sample_rate, ch_num = data_process(args.data, per_subject=True)
+    X = front_end(X, sample_rate, args)
 
     src_data, src_label, tar_data, tar_label = traintest_split_domain_classifier_pretest(args.data, X, y, num_subjects, args.ratio)
 
@@ -222,7 +253,8 @@ def read_mi_combine_domain_split(args):
 
 
 def read_mi_multi_source(args):
-    X, y, num_subjects, paradigm, sample_rate, ch_num = data_process(args.data)
+    X, y, num_subjects, paradigm, sample_rate, ch_num = data_process(args.data, per_subject=True)
+    X = front_end(X, sample_rate, args)
 
     src_data, src_label, tar_data, tar_label = traintest_split_multisource(args.data, X, y, num_subjects, args.idt)
 
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : ensemble.py
+import numpy as np
+
+
+def sml_weights(Q, v, eps=1e-6):
+    """
+    Parameters
+    ----------
+    Q : numpy array
+        second-moment matrices of the model predictions, of shape (..., num_models, num_models)
+    v : numpy array
+        unit leading eigenvectors of Q, of shape (..., num_models), of any sign
+
+    Returns
+    ----------
+    weights : numpy array
+        SML weights of shape (..., num_models), v normalized to sum to 1, or uniform weights (averaging) where Q is still
+        zero, e.g. every hard label 0 so far, or where the entries of v sum to less than eps
+    """
+    total = np.sum(v, axis=-1, keepdims=True)
+    valid = (np.abs(total) >= eps) & np.any(Q != 0, axis=(-2, -1))[..., None]
+    return np.where(valid, v / np.where(valid, total, 1), 1 / v.shape[-1])
+
+
+def SML_online(preds):
+    """
+    Parameters
+    ----------
+    preds : numpy array
+        data of shape (..., num_test_samples, num_models), predictions of the positive class, or 0/1 labels
+
+    Returns
+    ----------
+    prediction : numpy array
+        data of shape (..., num_test_samples), SML weighted prediction of each test sample, using the second-moment
+        matrix of all test samples up to itself, see sml_weights
+    """
+    # second-moment matrices of every prefix of the stream, (..., num_test_samples, num_models, num_models)
+    Q = np.cumsum(preds[..., :, None] * preds[..., None, :], axis=-3)
+    w, v = np.linalg.eigh(Q)
+    weights = sml_weights(Q, v[..., -1])
+    prediction = np.sum(weights * preds, axis=-1)
+    return prediction
+
+
+class StreamingSML:
+    """Online SML ensemble, predicting each new test trial in O(M^2) for M models.
+
+    The M x M second-moment matrix of the model predictions is kept up to date with a rank-1 update per trial, and its
+    leading eigenvector is tracked by power iteration warm-started from the previous one. The predictions of the
+    trial are then weighted by sml_weights, as in SML_online on the whole prefix of the stream.
+    """
+    def __init__(self, num_models, num_classes=None, hard=False, warmup=None, max_iter=50, tol=1e-6):
+        """
+        Parameters
+        ----------
+        num_models : int
+            number of models M in the ensemble
+        num_classes : int
+            number of classes, None for binary predictions of the positive class probability only
+        hard : bool
+            whether use the 0/1 labels (SML) instead of the probabilities (SML_soft), binary only
+        warmup : int
+            number of first trials predicted by averaging, defaults to num_models
+        max_iter : int
+            maximum number of power iterations per trial
+        tol : float
+            power iteration stops when the eigenvector changes by less than tol
+        """
+        assert not (hard and num_classes is not None), "hard SML is only implemented for binary classification"
+        self.num_models = num_models
+        self.num_classes = num_classes
+        self.hard = hard
+        self.warmup = num_models if warmup is None else warmup
+        self.max_iter = max_iter
+        self.tol = tol
+        # one second-moment matrix and eigenvector per class, a single one for binary
+        num_mats = 1 if num_classes is None else num_classes
+        self.Q = np.zeros((num_mats, num_models, num_models))
+        self.v = np.ones((num_mats, num_models)) / np.sqrt(num_models)
+        self.num_samples = 0
+
+    def update(self, pred):
+        """
+        Parameters
+        ----------
+        pred : numpy array
+            predictions of the models for the new trial, of shape (num_models,) or (num_models, num_classes)
+
+        Returns
+        ----------
+        pred : int
+            ensemble prediction of the new trial, binary ties at 0.5 going to class 0
+        """
+        # (num_mats, num_models)
+        p = np.asarray(pred, dtype=np.float64).reshape(self.num_models, -1).T
+        h = (p > 0.5).astype(np.float64) if self.hard else p
+        self.Q += h[:, :, None] * h[:, None, :]
+        self.num_samples += 1
+
+        for _ in range(self.max_iter):
+            v = np.matmul(self.Q, self.v[:, :, None])[:, :, 0]
+            norm = np.linalg.norm(v, axis=1, keepdims=True)
+            # Q is still zero, keeping the previous eigenvector instead of dividing by 0
+            v = np.where(norm > 0, v / np.where(norm > 0, norm, 1), self.v)
+            converged = np.max(np.abs(v - self.v)) < self.tol
+            self.v = v
+            if converged:
+                break
+
+        if self.num_samples <= self.warmup:
+            # too few trials for a reliable estimate, averaging the probabilities
+            prediction = np.average(p, axis=1)
+        else:
+            prediction = np.sum(sml_weights(self.Q, self.v) * h, axis=1)
+
+        if self.num_classes is None:
+            return int(prediction[0] > 0.5)
+        return np.argmax(prediction)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : export.py
+import warnings
+
+import torch
+
+# eager: the model itself, trace: torch.jit.trace, script: torch.jit.script, compile: torch.compile
+EXPORT_MODES = ['eager', 'trace', 'script', 'compile']
+
+
+def export_predictor(model, chn, time_sample_num, mode='trace', device='cpu', tol=1e-4):
+    """Single-trial predictor of a model, for the prediction phase of the online loops.
+
+    The predictor is specialized to inputs of shape (1, 1, chn, time_sample_num) and to eval mode, in which the model
+    is exported. It reads the parameters and buffers of the model in place, so optimizer steps, running statistics
+    updates and EEGNet_fused.refresh() are seen without exporting again, but modules of the model must not be replaced.
+    If the export fails, or its outputs differ from those of the model by more than tol, the model itself is returned.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        model returning (features, outputs), such as nn.Sequential(EEGNet_feature, FC_xy) or its fused copy
+    chn : int
+        number of channels
+    time_sample_num : int
+        number of time samples per trial
+    mode : str
+        one of EXPORT_MODES
+    device : str or torch.device
+        device of the model
+    tol : float
+        maximum absolute difference allowed between the outputs of the predictor and of the model
+
+    Returns
+    ----------
+    predictor : callable
+        exported model, or the model itself
+    mode : str
+        mode actually used, eager after a fallback
+    """
+    if mode not in EXPORT_MODES:
+        raise ValueError('unknown export mode ' + str(mode))
+    model.eval()
+    if mode == 'eager':
+        return model, mode
+
+    # from a generator of its own, leaving the global random state, and so the training that follows, untouched
+    generator = torch.Generator(device=device).manual_seed(0)
+    example = torch.randn(1, 1, chn, time_sample_num, generator=generator, device=device)
+    try:
+        with torch.no_grad(), warnings.catch_warnings():
+            # torch.jit is deprecated in recent releases, but still the lowest-overhead option for tiny models
+            warnings.simplefilter('ignore', FutureWarning)
+            if mode == 'trace':
+                predictor = torch.jit.trace(model, example)
+            elif mode == 'script':
+                predictor = torch.jit.script(model)
+            else:
+                predictor = torch.compile(model, dynamic=False)
+            diff = check_predictor(model, predictor, example)
+        if diff > tol:
+            raise RuntimeError('outputs differ from eager mode by ' + str(diff))
+    except Exception as e:
+        message = [line for line in str(e).split('\n') if line.strip() != ''] + ['']
+        print('export in', mode, 'mode failed, predicting in eager mode:', type(e).__name__, message[0])
+        return model, 'eager'
+    return predictor, mode
+
+
+def check_predictor(model, predictor, x):
+    """
+    Parameters
+    ----------
+    model : torch.nn.Module
+        model returning (features, outputs)
+    predictor : callable
+        its exported copy
+    x : torch tensor
+        input of both
+
+    Returns
+    ----------
+    diff : float
+        maximum absolute difference between their features and between their outputs
+    """
+    with torch.no_grad():
+        return max((a - b).abs().max().item() for a, b in zip(model(x), predictor(x)))
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : feature_cache.py
+import torch
+import torch.nn as nn
+
+
+class PrefixCache:
+    """Temporal convolution outputs of the latest test trials, so that the sliding batch is not re-encoded every trial.
+
+    The zero padding and temporal convolution at the start of EEGNet_feature (forward_prefix) are linear and act on each
+    EEG channel alike, so they commute with the (num_channels, num_channels) Incremental EA matrix:
+    prefix(R^(-1/2) x) = R^(-1/2) prefix(x). Each trial is therefore encoded once, unaligned, when it first enters a
+    batch, and re-aligning the batch with the current R^(-1/2) is a matmul on the cached outputs instead of a convolution
+    of every trial.
+
+    Entries are keyed by trial index and by the version of the prefix parameters, so an in-place update of the temporal
+    convolution invalidates them. The outputs are cached without autograd history, strategies opting in must not train
+    the prefix.
+    """
+    def __init__(self, netF, stream):
+        """
+        Parameters
+        ----------
+        netF : EEGNet_feature
+            feature extractor providing forward_prefix
+        stream : OnlinePreprocessor
+            test stream holding the raw trials and the current R^(-1/2)
+        """
+        self.netF = netF
+        self.stream = stream
+        self.capacity = stream.buffer.capacity
+        self.data = None
+        # (trial index, prefix version) of every slot
+        self.keys = [None] * self.capacity
+
+    def version(self):
+        # bumped by every in-place update of the prefix parameters, such as optimizer steps or load_state_dict
+        return tuple(p._version for p in self.netF.block1[1].parameters())
+
+    def batch(self, n):
+        """
+        Parameters
+        ----------
+        n : int
+            number of most recent trials
+
+        Returns
+        ----------
+        batch : torch tensor
+            prefix outputs of the trials in stream order, aligned with the current R^(-1/2), of shape
+            (n, F1, num_channels, num_time_samples)
+        """
+        buffer = self.stream.buffer
+        assert 0 < n <= len(buffer), "requested " + str(n) + " trials, but only " + str(len(buffer)) + " are held"
+        version = self.version()
+        indices = range(buffer.num_seen - n, buffer.num_seen)
+        slots = [idx % self.capacity for idx in indices]
+        missing = [slot for idx, slot in zip(indices, slots) if self.keys[slot] != (idx, version)]
+
+        if len(missing) > 0:
+            with torch.no_grad():
+                h = self.netF.forward_prefix(buffer.data[missing])
+            if self.data is None:
+                self.data = torch.empty((self.capacity,) + h.shape[1:], dtype=h.dtype, device=h.device)
+            self.data[missing] = h
+            for idx, slot in zip(indices, slots):
+                self.keys[slot] = (idx, version)
+
+        h = self.data[slots]
+        if self.stream.align:
+            h = torch.matmul(self.stream.sqrtRefEA, h)
+        return h
+
+
+class SuffixModel(nn.Module):
+    """(features, outputs) of a nn.Sequential(netF, netC) model, from the outputs of netF.forward_prefix."""
+    def __init__(self, model):
+        super(SuffixModel, self).__init__()
+        self.model = model
+
+    def forward(self, h):
+        features = self.model[0].forward_suffix(h)
+        return self.model[1](features)
@@ -21,7 +21,8 @@ def backbone_net(args, return_type='y'):
                         D=2,
                         F2=8,
                         dropoutRate=0.25,
-                        norm_rate=0.5)
+                        norm_rate=0.5,
+                        temporal_impl=getattr(args, 'temporal_conv', 'conv2d'))
     if return_type == 'y':
         netC = FC(args.feature_deep_dim, args.class_num)
     elif return_type == 'xy':
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : onnx_export.py
+import copy
+import inspect
+import io
+import time
+import warnings
+
+import torch
+import torch.nn as nn
+
+from utils.utils import fuse_for_inference
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    # optional, only needed to predict with the exported models
+    ort = None
+
+
+class AlignedModel(nn.Module):
+    """(features, outputs) of a model on trials aligned by a (num_channels, num_channels) R^(-1/2), given as an input."""
+    def __init__(self, model):
+        super(AlignedModel, self).__init__()
+        self.model = model
+
+    def forward(self, x, sqrtRefEA):
+        return self.model(torch.matmul(sqrtRefEA, x))
+
+
+def export_onnx(model, f, chn, time_sample_num, dynamic_batch=True, align=False, opset=17):
+    """Write a model to ONNX, with inputs x of shape (batch, 1, chn, time_sample_num) and outputs features and outputs.
+
+    EEGNet models are exported from their fused copy, see EEGNet_fused, and with the conv2d temporal convolution, which
+    every ONNX runtime supports. The model itself is left untouched.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        model returning (features, outputs), such as nn.Sequential(EEGNet_feature, FC_xy)
+    f : str or file-like object
+        path or buffer the ONNX model is written to
+    chn : int
+        number of channels
+    time_sample_num : int
+        number of time samples per trial
+    dynamic_batch : bool
+        whether the batch dimension is dynamic, otherwise fixed to 1 for single-trial prediction
+    align : bool
+        whether the graph starts with the Incremental EA transform, a MatMul with a second input sqrtRefEA of shape
+        (chn, chn)
+    opset : int
+        ONNX opset version
+    """
+    model.eval()
+    net = fuse_for_inference(model)
+    if net is model:
+        net = copy.deepcopy(model)
+    for m in net.modules():
+        if hasattr(m, 'impl'):
+            m.impl = 'conv2d'
+        if hasattr(m, 'temporal_impl'):
+            m.temporal_impl = 'conv2d'
+    device = next(model.parameters()).device
+
+    # from a generator of its own, leaving the global random state, and so the training that follows, untouched
+    generator = torch.Generator(device=device).manual_seed(0)
+    inputs = (torch.randn(1, 1, chn, time_sample_num, generator=generator, device=device),)
+    input_names = ['x']
+    if align:
+        net = AlignedModel(net)
+        inputs += (torch.eye(chn, device=device),)
+        input_names.append('sqrtRefEA')
+    dynamic_axes = None
+    if dynamic_batch:
+        dynamic_axes = {name: {0: 'batch'} for name in ['x', 'features', 'outputs']}
+
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # the TorchScript-based exporter, the dynamo one needs onnxscript, which is not a dependency of this repo
+        kwargs['dynamo'] = False
+    with torch.no_grad(), torch.random.fork_rng(devices=[]), warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        warnings.simplefilter('ignore', FutureWarning)
+        # shape inference notes on the dynamic batch dimension
+        warnings.simplefilter('ignore', UserWarning)
+        torch.onnx.export(net, inputs, f, input_names=input_names, output_names=['features', 'outputs'],
+                          dynamic_axes=dynamic_axes, opset_version=opset, **kwargs)
+
+
+class OnnxPredictor:
+    """Predictor running an ONNX export of a model with onnxruntime, for inference that does not adapt the model.
+
+    It holds a snapshot of the model: with every > 0 the model is exported again after every `every` of its updates,
+    otherwise updates are not seen. Called like the model, on torch tensors, it returns (features, outputs) on the
+    device of the inputs.
+    """
+    def __init__(self, model, chn, time_sample_num, every=0, path=None, dynamic_batch=True, align=False,
+                 providers=None, num_threads=0):
+        """
+        Parameters
+        ----------
+        model : torch.nn.Module
+            model returning (features, outputs), see export_onnx
+        chn : int
+            number of channels
+        time_sample_num : int
+            number of time samples per trial
+        every : int
+            number of model updates between exports, 0 for never
+        path : str
+            file the ONNX model is written to, kept in memory if None
+        dynamic_batch : bool
+            whether predict batches, otherwise single trials only
+        align : bool
+            whether the Incremental EA transform is part of the graph, inputs are then (x, sqrtRefEA)
+        providers : list
+            onnxruntime execution providers, CUDA if available and the model is on GPU, otherwise CPU
+        num_threads : int
+            number of intra-op threads, 0 for the onnxruntime default
+        """
+        if ort is None:
+            raise ImportError('ONNX prediction requires onnxruntime, pip install onnx onnxruntime')
+        self.model = model
+        self.chn = chn
+        self.time_sample_num = time_sample_num
+        self.every = every
+        self.path = path
+        self.dynamic_batch = dynamic_batch
+        self.align = align
+        if providers is None:
+            providers = ['CPUExecutionProvider']
+            if next(model.parameters()).is_cuda and 'CUDAExecutionProvider' in ort.get_available_providers():
+                providers.insert(0, 'CUDAExecutionProvider')
+        self.providers = providers
+        self.options = ort.SessionOptions()
+        self.options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.options.intra_op_num_threads = num_threads
+        self.num_updates = 0
+        self.session = None
+        # wall time of every export, including the creation of its session, in s
+        self.export_time = []
+        self.export()
+
+    def export(self):
+        start_time = time.perf_counter()
+        f = self.path if self.path is not None else io.BytesIO()
+        export_onnx(self.model, f, self.chn, self.time_sample_num, self.dynamic_batch, self.align)
+        source = self.path if self.path is not None else f.getvalue()
+        self.session = ort.InferenceSession(source, self.options, providers=self.providers)
+        self.export_time.append(time.perf_counter() - start_time)
+
+    def step(self):
+        # after every update of the model
+        self.num_updates += 1
+        if self.every > 0 and self.num_updates % self.every == 0:
+            self.export()
+
+    def eval(self):
+        # inference only, for callers putting their model in eval mode
+        return self
+
+    def __call__(self, x, sqrtRefEA=None):
+        feed = {'x': x.detach().cpu().to(torch.float32).numpy()}
+        if self.align:
+            feed['sqrtRefEA'] = sqrtRefEA.detach().cpu().to(torch.float32).numpy()
+        features, outputs = self.session.run(None, feed)
+        return torch.from_numpy(features).to(x.device), torch.from_numpy(outputs).to(x.device)
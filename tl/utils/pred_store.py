@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : pred_store.py
+import os
+
+import numpy as np
+
+
+class PredictionStore:
+    """Test predictions of every (dataset, method, seed, subject), for the ensemble step.
+
+    Each entry is the full float32 softmax output of one subject, of shape (num_test_samples, num_classes), kept as a
+    single .npy file under root/<dataset>/<method>/. Saving an entry again replaces it atomically, so re-running an
+    experiment never leaves stale or duplicated predictions, and a subject is read without parsing the others.
+    """
+    def __init__(self, root='./logs/preds/'):
+        self.root = root
+
+    def path(self, dataset, method, seed, subject):
+        return self.root + str(dataset) + '/' + str(method) + '/seed' + str(seed) + '_S' + str(subject) + '.npy'
+
+    def save(self, dataset, method, seed, subject, pred):
+        """
+        Parameters
+        ----------
+        dataset : str
+            dataset name
+        method : str
+            method name
+        seed : int
+            random seed of the model
+        subject : int
+            index of the target subject
+        pred : numpy array
+            softmax outputs of shape (num_test_samples, num_classes)
+        """
+        path = self.path(dataset, method, seed, subject)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, so that readers only ever see a complete entry
+        tmp_path = path[:-len('.npy')] + '.' + str(os.getpid()) + '.tmp.npy'
+        np.save(tmp_path, np.asarray(pred, dtype=np.float32))
+        os.replace(tmp_path, path)
+
+    def load(self, dataset, method, seed, subject):
+        """
+        Returns
+        ----------
+        pred : numpy memmap
+            softmax outputs of shape (num_test_samples, num_classes)
+        """
+        return np.load(self.path(dataset, method, seed, subject), mmap_mode='r')
+
+    def load_all(self, dataset, method, seeds, subjects):
+        """
+        Parameters
+        ----------
+        dataset : str
+            dataset name
+        method : str
+            method name
+        seeds : list
+            random seeds of the models
+        subjects : list
+            indices of the target subjects
+
+        Returns
+        ----------
+        preds : numpy array
+            softmax outputs of shape (num_seeds, num_subjects, num_test_samples, num_classes)
+        """
+        preds = np.stack([np.stack([self.load(dataset, method, seed, subject) for subject in subjects])
+                          for seed in seeds])
+        return preds
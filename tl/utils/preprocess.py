@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : preprocess.py
+import time
+
+import numpy as np
+import torch
+
+from utils.alg_utils import IncrementalAligner
+from utils.buffer import TrialRingBuffer
+
+
+class OnlinePreprocessor:
+    """Torch-native preprocessing of an online test stream, from the loader tensor to the model input.
+
+    Trials stay in float32 on the model's device, in a ring buffer of the latest capacity trials. Only the
+    (num_channels, num_channels) covariance of each new trial and R^(-1/2) cross to the CPU, for the float64 Incremental
+    EA update. Alignment is a torch.matmul with a float32 copy of R^(-1/2), written into preallocated buffers, so that no
+    trial-sized array is allocated once the stream is running.
+
+    The returned tensors are these buffers, they are overwritten by the next call of the same method.
+    """
+    def __init__(self, capacity, chn, time_sample_num, align=True, device='cpu', refresh=1):
+        """
+        Parameters
+        ----------
+        capacity : int
+            maximum number of latest trials ever requested as a batch
+        chn : int
+            number of channels
+        time_sample_num : int
+            number of time samples per trial
+        align : bool
+            whether apply Incremental EA
+        device : str or torch.device
+            device of the model
+        refresh : int
+            number of trials between updates of R^(-1/2), see IncrementalAligner
+        """
+        self.chn = chn
+        self.time_sample_num = time_sample_num
+        self.align = align
+        self.device = torch.device(device)
+        self.buffer = TrialRingBuffer(capacity, chn, time_sample_num, device=self.device)
+        if align:
+            self.aligner = IncrementalAligner(refresh=refresh)
+            # float32 copy of R^(-1/2) on the model's device
+            self.sqrtRefEA = torch.eye(chn, dtype=torch.float32, device=self.device)
+            self.sample_out = torch.empty((1, 1, chn, time_sample_num), dtype=torch.float32, device=self.device)
+            self.batch_out = torch.empty((capacity, 1, chn, time_sample_num), dtype=torch.float32, device=self.device)
+        # preprocessing time of every trial, in seconds
+        self.latency = []
+
+    def push(self, x):
+        """
+        Parameters
+        ----------
+        x : torch tensor
+            new trial from the loader, of any shape that can be reshaped to (num_channels, num_time_samples)
+
+        Returns
+        ----------
+        sample : torch tensor
+            aligned trial of shape (1, 1, num_channels, num_time_samples), in float32 on the model's device
+        """
+        start_time = time.perf_counter()
+        self.buffer.append(x)
+        trial = self.buffer.last()
+        if not self.align:
+            self.latency.append(time.perf_counter() - start_time)
+            return trial
+
+        # covariance in float64, matching np.cov of the trial
+        xt = trial[0, 0].double()
+        xt = xt - xt.mean(dim=1, keepdim=True)
+        cov = torch.matmul(xt, xt.T) / (self.time_sample_num - 1)
+        self.aligner.update_cov(cov.cpu().numpy())
+        self.sqrtRefEA.copy_(torch.from_numpy(self.aligner.sqrtRefEA))
+
+        torch.matmul(self.sqrtRefEA, trial, out=self.sample_out)
+        self.latency.append(time.perf_counter() - start_time)
+        return self.sample_out
+
+    def batch(self, n):
+        """
+        Parameters
+        ----------
+        n : int
+            number of most recent trials
+
+        Returns
+        ----------
+        batch : torch tensor
+            trials in stream order aligned with the current R^(-1/2), of shape (n, 1, num_channels, num_time_samples)
+        """
+        if not self.align:
+            return self.buffer.latest(n)
+        out = self.batch_out[:n]
+        pos = 0
+        for segment in self.buffer.segments(n):
+            torch.matmul(self.sqrtRefEA, segment, out=out[pos:pos + len(segment)])
+            pos += len(segment)
+        return out
+
+    def mean_latency(self):
+        """
+        Returns
+        ----------
+        latency : float
+            mean preprocessing time per trial, in ms
+        """
+        return np.mean(self.latency) * 1000 if len(self.latency) > 0 else 0.0
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : quantize.py
+import warnings
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.ao.quantization as tq
+
+from utils.utils import fuse_for_inference
+
+
+class EEGNet_quant(nn.Module):
+    """Quantizable nn.Sequential(EEGNet_feature, FC_xy), built from the folded weights of EEGNet_fused.
+
+    Every operation is a module that eager-mode static quantization maps to an INT8 kernel, between a QuantStub and
+    DeQuantStubs: Conv2d with BatchNorm folded into them, ELU, AvgPool2d and Linear. The asymmetric zero paddings become
+    symmetric conv padding, with the extra leading outputs cropped.
+    """
+    def __init__(self, fused, fc):
+        """
+        Parameters
+        ----------
+        fused : EEGNet_fused
+            folded feature extractor
+        fc : nn.Linear
+            classifier of FC_xy
+        """
+        super(EEGNet_quant, self).__init__()
+        F1D = fused.spatial_weight.size(0)
+        F2 = fused.pointwise_weight.size(0)
+        left, right = fused.pad1
+        self.crop1 = right - left
+        self.quant = tq.QuantStub()
+        self.dequant_features = tq.DeQuantStub()
+        self.dequant_outputs = tq.DeQuantStub()
+        self.spatial = nn.Conv2d(1, F1D, (fused.Chans, 1), bias=False)
+        self.temporal = nn.Conv2d(F1D, F1D, (1, fused.kernLenght), padding=(0, right), groups=F1D)
+        self.elu1 = nn.ELU()
+        self.pool1 = nn.AvgPool2d((1, 4))
+        # padding (7, 8) as 8 on both sides, dropping the first output
+        self.depthwise = nn.Conv2d(F1D, F1D, (1, 16), padding=(0, 8), groups=F1D, bias=False)
+        self.pointwise = nn.Conv2d(F1D, F2, (1, 1))
+        self.elu2 = nn.ELU()
+        self.pool2 = nn.AvgPool2d((1, 8))
+        self.fc = nn.Linear(fc.in_features, fc.out_features)
+        with torch.no_grad():
+            self.spatial.weight.copy_(fused.spatial_weight[:, None, :, None])
+            self.temporal.weight.copy_(fused.temporal_weight)
+            self.temporal.bias.copy_(fused.temporal_bias)
+            self.depthwise.weight.copy_(fused.depthwise_weight)
+            self.pointwise.weight.copy_(fused.pointwise_weight)
+            self.pointwise.bias.copy_(fused.pointwise_bias)
+            self.fc.load_state_dict(fc.state_dict())
+
+    def forward(self, x: torch.Tensor):
+        output = self.spatial(self.quant(x))
+        output = self.temporal(output)[..., self.crop1:]
+        output = self.pool1(self.elu1(output))
+        output = self.depthwise(output)[..., 1:]
+        output = self.pool2(self.elu2(self.pointwise(output)))
+        features = output.reshape(output.size(0), -1)
+        outputs = self.fc(features)
+        return self.dequant_features(features), self.dequant_outputs(outputs)
+
+
+def calibration_trials(loader, num_trials, seed=0):
+    """
+    Parameters
+    ----------
+    loader : torch DataLoader
+        source loader, such as data_loader(...)["source"], over a TensorDataset of aligned trials and labels
+    num_trials : int
+        number of trials, drawn without replacement from a generator of their own, leaving the global random state
+        untouched
+    seed : int
+        seed of that generator
+
+    Returns
+    ----------
+    x : torch tensor
+        CPU trials of shape (num_trials, 1, num_channels, num_time_samples), where the INT8 kernels run
+    y : torch tensor
+        their CPU labels
+    """
+    dataset = loader.dataset
+    generator = torch.Generator().manual_seed(seed)
+    idx = torch.randperm(len(dataset), generator=generator)[:num_trials]
+    x, y = dataset[idx.to(dataset.tensors[0].device)][:2]
+    # the source tensors are on GPU if data_loader moved them there
+    return x.cpu(), y.cpu()
+
+
+class QuantizedPredictor:
+    """INT8 single-trial predictor of a float master model, re-quantized on a schedule while the master is adapted.
+
+    Quantization is post-training and static: the model is folded (EEGNet_fused), rebuilt as EEGNet_quant, observed on
+    half of the calibration trials, and converted. The other half measures the accuracy of the float and quantized models,
+    so that every re-quantization reports its accuracy delta.
+    """
+    def __init__(self, model, calib, every=8, backend='x86', batch_size=64):
+        """
+        Parameters
+        ----------
+        model : torch.nn.Module
+            float master nn.Sequential(EEGNet_feature, FC_xy), adapted elsewhere
+        calib : tuple
+            (x, y) source trials and labels, see calibration_trials
+        every : int
+            number of master updates between re-quantizations
+        backend : str
+            quantized engine, one of torch.backends.quantized.supported_engines
+        batch_size : int
+            batch size of the calibration forward passes
+        """
+        if backend not in torch.backends.quantized.supported_engines:
+            raise ValueError('unsupported quantized engine ' + str(backend))
+        self.model = model
+        # on CPU, as the quantized model, whatever the device of the master
+        x, y = calib[0].cpu(), calib[1].cpu()
+        half = len(x) // 2
+        self.calib_x, self.eval_x, self.eval_y = x[:half], x[half:], y[half:]
+        self.every = every
+        self.backend = backend
+        self.batch_size = batch_size
+        self.num_updates = 0
+        self.num_quantized = 0
+        self.qmodel = None
+        # accuracy on the evaluation half of the calibration trials of the latest quantization, in %
+        self.acc_float = None
+        self.acc_quant = None
+        self.quantize()
+
+    def quantize(self):
+        device = next(self.model.parameters()).device
+        torch.backends.quantized.engine = self.backend
+        # building the modules initializes their weights, from a forked random state so that training is untouched
+        with torch.no_grad(), torch.random.fork_rng(devices=[]), warnings.catch_warnings():
+            # eager-mode quantization is deprecated in favour of torchao, which is not a dependency of this repo
+            warnings.simplefilter('ignore', DeprecationWarning)
+            warnings.simplefilter('ignore', UserWarning)
+            fused = fuse_for_inference(self.model)
+            # INT8 kernels run on CPU only
+            qmodel = EEGNet_quant(fused[0], self.model[1].fc).cpu().eval()
+            qmodel.qconfig = tq.get_default_qconfig(self.backend)
+            tq.prepare(qmodel, inplace=True)
+            for i in range(0, len(self.calib_x), self.batch_size):
+                qmodel(self.calib_x[i:i + self.batch_size])
+            tq.convert(qmodel, inplace=True)
+            self.qmodel = qmodel
+            self.num_quantized += 1
+            if len(self.eval_x) > 0:
+                self.acc_float = self._accuracy(lambda x: fused(x.to(device))[1].cpu())
+                self.acc_quant = self._accuracy(lambda x: self.qmodel(x)[1])
+
+    def step(self):
+        # after every update of the master model
+        self.num_updates += 1
+        if self.num_updates % self.every == 0:
+            self.quantize()
+
+    def __call__(self, x):
+        device = x.device
+        features, outputs = self.qmodel(x.cpu())
+        return features.to(device), outputs.to(device)
+
+    def _accuracy(self, predict):
+        pred = torch.cat([predict(self.eval_x[i:i + self.batch_size]).argmax(dim=1)
+                          for i in range(0, len(self.eval_x), self.batch_size)])
+        return np.mean(pred.numpy() == self.eval_y.numpy()) * 100
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : resample.py
+from math import gcd
+
+import numpy as np
+from scipy.signal import resample_poly
+
+# sample rate EEGNet is fed at when resampling, for the datasets recorded above it. The MOABB paradigm already
+# band-limits MI trials to 8-32 Hz, well below the 64 Hz Nyquist frequency of 128 Hz
+RESAMPLE_RATES = {'BNCI2014002': 128, 'BNCI2015001': 128}
+
+
+def target_rate(data_name, sample_rate, resample=True):
+    # sample rate the trials of data_name, recorded at sample_rate, are fed at
+    if resample and data_name in RESAMPLE_RATES:
+        return RESAMPLE_RATES[data_name]
+    return sample_rate
+
+
+def resampled_length(time_sample_num, sample_rate, rate):
+    # number of time samples of resample_poly outputs
+    up, down = rate // gcd(rate, sample_rate), sample_rate // gcd(rate, sample_rate)
+    return -(-time_sample_num * up // down)
+
+
+def get_dataset_params(data_name, time_sample_num, sample_rate, resample=False):
+    """Input shape parameters of the backbone for the trials of a dataset, once resampled if resample.
+
+    Parameters
+    ----------
+    data_name : str
+        dataset name
+    time_sample_num : int
+        number of time samples per recorded trial
+    sample_rate : int
+        recorded sample rate, in Hz
+    resample : bool
+        whether the trials are resampled to RESAMPLE_RATES
+
+    Returns
+    ----------
+    time_sample_num : int
+        number of time samples per trial fed to the backbone
+    sample_rate : int
+        their sample rate, setting the temporal kernel length of EEGNet
+    feature_deep_dim : int
+        number of EEGNet features, F2 times the outputs of its two pooling layers, see backbone_net
+    """
+    rate = target_rate(data_name, sample_rate, resample)
+    if rate != sample_rate:
+        time_sample_num = resampled_length(time_sample_num, sample_rate, rate)
+    feature_deep_dim = 8 * (time_sample_num // 4 // 8)
+    return time_sample_num, rate, feature_deep_dim
+
+
+def resample_trials(X, sample_rate, rate):
+    """Anti-alias filter and resample trials, with the polyphase Kaiser-window FIR filter of scipy's resample_poly.
+
+    Parameters
+    ----------
+    X : numpy array
+        data of shape (..., num_time_samples)
+    sample_rate : int
+        sample rate of X, in Hz
+    rate : int
+        sample rate of the output, in Hz
+
+    Returns
+    ----------
+    X : numpy array
+        float32 data of shape (..., resampled_length(num_time_samples, sample_rate, rate))
+    """
+    up, down = rate // gcd(rate, sample_rate), sample_rate // gcd(rate, sample_rate)
+    return resample_poly(X, up, down, axis=-1).astype(np.float32)
+
+
+def resample_suffix(args):
+    # suffix of the checkpoints and results of models fed resampled trials, whose input shape differs from the recorded one
+    if getattr(args, 'resample', False) and args.data in RESAMPLE_RATES:
+        return '_' + str(RESAMPLE_RATES[args.data]) + 'Hz'
+    return ''
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : runner.py
+import argparse
+import io
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+
+from utils.LogRecord import LogRecord
+from utils.utils import fix_random_seed
+
+
+class BufferedLog(io.StringIO):
+    """Stand-in for LogRecord and args.out_file inside worker processes.
+
+    Workers never share the seed's log file, the parent writes the buffered text after the task's info line, so every
+    log reads the same as a serial run.
+    """
+    def record(self, log_str):
+        self.write(log_str + '\n')
+
+
+def _init_worker(num_threads):
+    # each worker gets its share of the cores, instead of every process spawning one thread per core
+    torch.set_num_threads(num_threads)
+
+
+def _task_str(idt, subject_offset):
+    return 'Except_S' + str(idt + subject_offset) + '_2_' + 'S' + str(idt + subject_offset)
+
+
+def _task_args(args, seed, idt, subject_offset):
+    # picklable copy of the experiment arguments, without the open log of the parent
+    task_args = argparse.Namespace(**{k: v for k, v in vars(args).items() if k not in ['log', 'out_file']})
+    task_args.SEED = seed
+    task_args.idt = idt
+    task_args.task_str = _task_str(idt, subject_offset)
+    return task_args
+
+
+def _run_task(train_target, args):
+    """
+    Parameters
+    ----------
+    train_target : function
+        train_target of the driver, taking args and returning the score of target subject args.idt
+    args : argparse.Namespace
+        experiment arguments of a single (seed, subject) task
+
+    Returns
+    ----------
+    score : float
+        score of the target subject
+    log_text : str
+        everything the task recorded to its log
+    """
+    # seeded per task, so that a result does not depend on which tasks ran before it in the same worker
+    fix_random_seed(args.SEED)
+    torch.backends.cudnn.deterministic = True
+    log = BufferedLog()
+    args.log = log
+    args.out_file = log
+    score = train_target(args)
+    return score, log.getvalue()
+
+
+def run_seeds(train_target, args, seeds, file_name, subject_offset=0):
+    """Run the leave-one-subject-out experiment of every seed, serially or over a pool of processes.
+
+    Serially, the random generators are seeded once per seed, as in the drivers before, so the subjects of a seed share
+    one random stream. With args.n_jobs > 1, the (seed, subject) tasks are submitted at once to a ProcessPoolExecutor of
+    args.n_jobs spawned workers, each limited to cpu_count // n_jobs torch threads, and every task is seeded on its own:
+    the scores of a parallel run do not depend on the scheduling, but only the first subject of each seed matches the
+    serial run. Logs are still written by this process, one file per seed, in (seed, subject) order.
+
+    Parameters
+    ----------
+    train_target : function
+        train_target of the driver, taking args and returning the score of target subject args.idt
+    args : argparse.Namespace
+        experiment arguments, using N, data, method, local_dir, result_dir and n_jobs
+    seeds : list
+        random seeds, one model per seed and subject
+    file_name : str
+        name of the driver, recorded at the head of each log
+    subject_offset : int
+        added to the subject index in the task names
+
+    Returns
+    ----------
+    total_acc : list
+        scores of shape (num_seeds, num_subjects), args.log is left on the log of the last seed
+    """
+    n_jobs = getattr(args, 'n_jobs', 1)
+    futures = {}
+    if n_jobs > 1:
+        num_threads = max(1, (os.cpu_count() or 1) // n_jobs)
+        # spawn rather than fork, so that workers never inherit CUDA or OpenMP state of the parent
+        pool = ProcessPoolExecutor(max_workers=n_jobs, mp_context=mp.get_context('spawn'),
+                                   initializer=_init_worker, initargs=(num_threads,))
+        for s in seeds:
+            for idt in range(args.N):
+                futures[(s, idt)] = pool.submit(_run_task, train_target, _task_args(args, s, idt, subject_offset))
+
+    total_acc = []
+    for s in seeds:
+        args.SEED = s
+        if n_jobs == 1:
+            fix_random_seed(args.SEED)
+            torch.backends.cudnn.deterministic = True
+        print(args.data)
+        print(args.method)
+        print(args.SEED)
+        print(args)
+
+        if n_jobs > 1:
+            # seeds of a parallel sweep are logged within the same second, keep their log files apart
+            args.log_suffix = '_seed' + str(s)
+        my_log = LogRecord(args)
+        my_log.log_init()
+        my_log.record('=' * 50 + '\n' + file_name + '\n' + '=' * 50)
+        args.log = my_log
+
+        sub_acc_all = np.zeros(args.N)
+        for idt in range(args.N):
+            args.idt = idt
+            args.task_str = _task_str(idt, subject_offset)
+            info_str = '\n========================== Transfer to ' + 'S' + str(idt + subject_offset) + ' =========================='
+            print(info_str)
+            my_log.record(info_str)
+
+            if n_jobs > 1:
+                sub_acc_all[idt], log_text = futures[(s, idt)].result()
+                args.out_file.write(log_text)
+                args.out_file.flush()
+            else:
+                sub_acc_all[idt] = train_target(args)
+        print('Sub acc: ', np.round(sub_acc_all, 3))
+        print('Avg acc: ', np.round(np.mean(sub_acc_all), 3))
+        total_acc.append(sub_acc_all)
+
+        acc_sub_str = str(np.round(sub_acc_all, 3).tolist())
+        acc_mean_str = str(np.round(np.mean(sub_acc_all), 3).tolist())
+        args.log.record("\n==========================================")
+        args.log.record(acc_sub_str)
+        args.log.record(acc_mean_str)
+
+    if n_jobs > 1:
+        pool.shutdown()
+    return total_acc
+
+
+def run_stacked(train_target, args, seeds, file_name, subject_offset=0):
+    """Run the leave-one-subject-out experiment of all seeds at once, one call per target subject.
+
+    Parameters
+    ----------
+    train_target : function
+        taking args and the list of seeds, returning the score of target subject args.idt for every seed
+    args : argparse.Namespace
+        experiment arguments, using N, data, method, local_dir and result_dir
+    seeds : list
+        random seeds, one model per seed and subject
+    file_name : str
+        name of the driver, recorded at the head of the log
+    subject_offset : int
+        added to the subject index in the task names
+
+    Returns
+    ----------
+    total_acc : list
+        scores of shape (num_seeds, num_subjects), all seeds share the single log in args.log
+    """
+    args.SEED = seeds[0]
+    print(args.data)
+    print(args.method)
+    print(seeds)
+    print(args)
+
+    my_log = LogRecord(args)
+    my_log.log_init()
+    my_log.record('=' * 50 + '\n' + file_name + '\n' + '=' * 50)
+    args.log = my_log
+
+    total_acc = np.zeros((len(seeds), args.N))
+    for idt in range(args.N):
+        args.idt = idt
+        args.task_str = _task_str(idt, subject_offset)
+        info_str = '\n========================== Transfer to ' + 'S' + str(idt + subject_offset) + ' =========================='
+        print(info_str)
+        my_log.record(info_str)
+
+        fix_random_seed(args.SEED)
+        torch.backends.cudnn.deterministic = True
+        total_acc[:, idt] = train_target(args, seeds)
+
+    for s, sub_acc_all in zip(seeds, total_acc):
+        print('Seed: ', s)
+        print('Sub acc: ', np.round(sub_acc_all, 3))
+        print('Avg acc: ', np.round(np.mean(sub_acc_all), 3))
+
+        acc_sub_str = str(np.round(sub_acc_all, 3).tolist())
+        acc_mean_str = str(np.round(np.mean(sub_acc_all), 3).tolist())
+        args.log.record("\n==========================================")
+        args.log.record(acc_sub_str)
+        args.log.record(acc_mean_str)
+
+    return list(total_acc)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : scheduler.py
+import numpy as np
+
+
+class AdaptScheduler:
+    """Gate deciding, whenever a test-time adaptation method asks for an update, whether the update is worth running.
+
+    Only signals already available in the online loop are used, so the gate costs no forward pass:
+    the mean normalized entropy of the predictions on the sliding batch, the L1 shift of their marginal class
+    distribution since the last update, and the relative change of the Incremental EA reference matrix R since the last
+    update. An update runs if any enabled signal exceeds its threshold, and at least every max_skip + 1 requests
+    otherwise. The first request always runs. The decision only depends on the stream, never on timing or randomness.
+    """
+    def __init__(self, entropy_thresh=None, shift_thresh=None, drift_thresh=None, max_skip=3):
+        """
+        Parameters
+        ----------
+        entropy_thresh : float
+            update if the mean entropy of the batch predictions, divided by log(num_classes), exceeds it, None disables
+        shift_thresh : float
+            update if the L1 distance between the mean batch prediction and that of the last update exceeds it,
+            None disables
+        drift_thresh : float
+            update if ||R - R_last||_F / ||R_last||_F exceeds it, with R_last the reference matrix of the last update,
+            None disables
+        max_skip : int
+            maximum number of consecutive skipped updates
+        """
+        assert max_skip >= 0, "max_skip must be >= 0"
+        self.entropy_thresh = entropy_thresh
+        self.shift_thresh = shift_thresh
+        self.drift_thresh = drift_thresh
+        self.max_skip = max_skip
+        self.last_marginal = None
+        self.last_R = None
+        self.num_skipped = 0
+        # number of update requests, and of updates actually run
+        self.num_requests = 0
+        self.num_updates = 0
+
+    def should_update(self, probs, R=None):
+        """
+        Parameters
+        ----------
+        probs : numpy array
+            softmax predictions on the sliding batch, of shape (num_samples, num_classes)
+        R : numpy array
+            current reference matrix of Incremental EA, of shape (num_channels, num_channels), None without alignment
+
+        Returns
+        ----------
+        update : bool
+            whether run the requested update
+        """
+        self.num_requests += 1
+        marginal = np.mean(probs, axis=0)
+
+        update = self.last_marginal is None or self.num_skipped >= self.max_skip
+        if not update and self.entropy_thresh is not None:
+            entropy = -np.sum(probs * np.log(probs + 1e-5), axis=1) / np.log(probs.shape[1])
+            update = np.mean(entropy) > self.entropy_thresh
+        if not update and self.shift_thresh is not None:
+            update = np.sum(np.abs(marginal - self.last_marginal)) > self.shift_thresh
+        if not update and self.drift_thresh is not None and R is not None and self.last_R is not None:
+            update = np.linalg.norm(R - self.last_R) / np.linalg.norm(self.last_R) > self.drift_thresh
+
+        if update:
+            self.last_marginal = marginal
+            self.last_R = None if R is None else np.array(R)
+            self.num_skipped = 0
+            self.num_updates += 1
+        else:
+            self.num_skipped += 1
+        return update
+
+    def compute_saved(self):
+        """
+        Returns
+        ----------
+        saved : float
+            fraction of requested updates that were skipped
+        """
+        return 1 - self.num_updates / self.num_requests if self.num_requests > 0 else 0.0
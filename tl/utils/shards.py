@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : shards.py
+import json
+import os
+
+import numpy as np
+
+
+def write_shards(X, labels, subjects, sessions, path):
+    """Write trials as one contiguous file per (subject, session), plus a small JSON manifest.
+
+    Shards keep the dtype of X, so that the loaders read the same values as from X.npy.
+
+    Parameters
+    ----------
+    X : numpy array
+        data of shape (num_samples, num_channels, num_time_samples)
+    labels : numpy array
+        labels of shape (num_samples,)
+    subjects : numpy array
+        subject of each trial, of shape (num_samples,)
+    sessions : numpy array
+        session of each trial, of shape (num_samples,)
+    path : str
+        directory of the dataset, the manifest is written to path + 'manifest.json'
+    """
+    if not os.path.exists(path + 'shards/'):
+        os.makedirs(path + 'shards/')
+
+    # contiguous runs of trials sharing (subject, session), so that the shards concatenate back to the original order
+    bounds = [0]
+    for i in range(1, len(X)):
+        if subjects[i] != subjects[i - 1] or sessions[i] != sessions[i - 1]:
+            bounds.append(i)
+    bounds.append(len(X))
+
+    shards = []
+    for k in range(len(bounds) - 1):
+        start, end = bounds[k], bounds[k + 1]
+        file_name = 'shards/S' + str(subjects[start]) + '_' + str(sessions[start]) + '_' + str(k) + '.npy'
+        np.save(path + file_name, np.ascontiguousarray(X[start:end]))
+        shards.append({'subject': str(subjects[start]), 'session': str(sessions[start]), 'file': file_name,
+                       'offset': int(start), 'num_trials': int(end - start)})
+
+    manifest = {'num_trials': int(len(X)), 'num_channels': int(X.shape[1]), 'num_time_samples': int(X.shape[2]),
+                'dtype': str(X.dtype), 'labels': [str(l) for l in labels], 'shards': shards}
+    # write then rename, the manifest marks the sharded layout as complete
+    with open(path + 'manifest.json.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + 'manifest.json.tmp', path + 'manifest.json')
+
+
+class ShardedTrials:
+    """Read-only, row-indexable view over the memory-mapped shards of a dataset.
+
+    Indexing with an int, a slice or an index array gathers only the requested trials, shard by shard. A slice of step 1
+    within a single shard, such as the trials of a subject/session, is a zero-copy view, as is subject().
+    """
+    def __init__(self, path):
+        with open(path + 'manifest.json') as f:
+            self.manifest = json.load(f)
+        self.shards = [np.load(path + s['file'], mmap_mode='r') for s in self.manifest['shards']]
+        self.offsets = np.array([s['offset'] for s in self.manifest['shards']] + [self.manifest['num_trials']])
+        self.shape = (self.manifest['num_trials'], self.manifest['num_channels'], self.manifest['num_time_samples'])
+        self.dtype = np.dtype(self.manifest['dtype'])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            k = np.searchsorted(self.offsets, idx % len(self), side='right') - 1
+            return np.array(self.shards[k][idx % len(self) - self.offsets[k]])
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            k = np.searchsorted(self.offsets, start, side='right') - 1
+            if step == 1 and start < stop <= self.offsets[k + 1]:
+                # memory-mapped view of a single shard
+                return self.shards[k][start - self.offsets[k]:stop - self.offsets[k]]
+        idx = np.arange(len(self))[idx]
+        out = np.empty((len(idx),) + self.shape[1:], dtype=self.dtype)
+        shard_ids = np.searchsorted(self.offsets, idx, side='right') - 1
+        for k in np.unique(shard_ids):
+            mask = shard_ids == k
+            out[mask] = self.shards[k][idx[mask] - self.offsets[k]]
+        return out
+
+    def subject(self, subject, session=None):
+        """
+        Parameters
+        ----------
+        subject : int or str
+            subject as recorded by MOABB
+        session : str
+            session as recorded by MOABB, defaults to all sessions of the subject
+
+        Returns
+        ----------
+        X : numpy array
+            memory-mapped data of shape (num_samples, num_channels, num_time_samples), a list of arrays if the
+            selection spans more than one shard
+        """
+        out = [self.shards[k] for k, s in enumerate(self.manifest['shards'])
+               if s['subject'] == str(subject) and (session is None or s['session'] == str(session))]
+        return out[0] if len(out) == 1 else out
+
+
+def load_trials(path):
+    """
+    Parameters
+    ----------
+    path : str
+        directory of the dataset
+
+    Returns
+    ----------
+    X : ShardedTrials or numpy memmap
+        data of shape (num_samples, num_channels, num_time_samples), read lazily from disk
+    y : numpy array
+        labels of shape (num_samples,)
+    """
+    if os.path.exists(path + 'manifest.json'):
+        X = ShardedTrials(path)
+        y = np.array(X.manifest['labels'])
+    else:
+        # memory-map the monolithic file, so that only the indexed trials are ever read
+        X = np.load(path + 'X.npy', mmap_mode='r')
+        y = np.load(path + 'labels.npy')
+    return X, y
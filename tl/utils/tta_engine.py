@@ -0,0 +1,591 @@
+# -*- coding: utf-8 -*-
+# @Time    : 2026/10/17
+# @File    : tta_engine.py
+import contextlib
+import copy
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from sklearn.metrics import roc_auc_score, accuracy_score
+
+from models.EEGNet import TemporalConv, describe_auto_impl
+from utils.export import export_predictor
+from utils.feature_cache import PrefixCache, SuffixModel
+from utils.onnx_export import OnnxPredictor
+from utils.preprocess import OnlinePreprocessor
+from utils.quantize import QuantizedPredictor, calibration_trials
+from utils.scheduler import AdaptScheduler
+from utils.utils import fuse_for_inference
+
+
+def configure_adapt_params(model, subset='all'):
+    """Select the parameters adapted at test time, and freeze all others.
+
+    Frozen parameters get requires_grad=False, so that autograd skips their weight gradients, and the optimizer only
+    holds state for the selected ones.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        nn.Sequential(EEGNet_feature, classifier)
+    subset : str
+        'all', 'bn' for the BatchNorm2d affine parameters, 'classifier' for the classifier, or 'last-block' for
+        block2 of EEGNet_feature and the classifier
+
+    Returns
+    ----------
+    params : list
+        parameters to adapt
+    """
+    if subset == 'all':
+        modules = [model]
+    elif subset == 'bn':
+        modules = [m for m in model.modules() if isinstance(m, nn.BatchNorm2d)]
+    elif subset == 'classifier':
+        modules = [model[1]]
+    elif subset == 'last-block':
+        modules = [model[0].block2, model[1]]
+    else:
+        raise ValueError('unknown parameter subset ' + str(subset) + ', expected all, bn, classifier or last-block')
+    model.requires_grad_(False)
+    for m in modules:
+        m.requires_grad_(True)
+    return [p for p in model.parameters() if p.requires_grad]
+
+
+class AdaptStrategy:
+    """Online test-time adaptation method, plugged into OnlineTTAEngine.
+
+    The engine owns the test stream, and for every trial calls predict(), then adapt() on the latest sliding batch
+    whenever should_update() is true, or skip() instead if the update is gated out, see AdaptScheduler. The defaults
+    predict with the source model and update every args.stride trials once args.test_batch trials have been seen, so a
+    method only overrides what it changes.
+
+    Methods that never train the temporal convolution of EEGNet can set cache_prefix, the batches they get are then the
+    cached temporal convolution outputs of a PrefixCache, to be passed through self.batch_model instead of self.model.
+    Left to None, it is decided once from args.adapt_params: every subset but 'all' freezes the temporal convolution.
+
+    With the default predict, the engine can fuse() the strategy, predictions then come from an inference-only copy of
+    the model with BatchNorm folded into the convolutions, folded again after every update, while adapt() keeps training
+    the un-fused model. It can also export() the model, or its fused copy, into a traced, scripted or compiled
+    single-trial predictor, quantize() it into an INT8 predictor, re-quantized from the float model on a schedule, or
+    run an ONNX export of it with onnxruntime, see onnx(), exported again on a schedule.
+    """
+    # number of models predicted at once, see TTIME_stacked
+    num_models = 1
+    # whether batches are given as cached temporal convolution outputs, see PrefixCache, None follows args.adapt_params
+    cache_prefix = None
+
+    def __init__(self, model, args, balanced=True):
+        """
+        Parameters
+        ----------
+        model : torch.nn.Module
+            model returning (features, outputs), put in eval mode before predict() and in train mode before adapt()
+        args : argparse.Namespace
+            experiment arguments
+        balanced : bool
+            whether the test stream is class-balanced
+        """
+        self.model = model
+        self.args = args
+        self.balanced = balanced
+        cache_prefix = self.cache_prefix
+        if cache_prefix is None:
+            # subsets of trainable_params other than 'all' leave the temporal convolution frozen
+            cache_prefix = getattr(args, 'adapt_params', 'all') != 'all'
+        self.cache_prefix = cache_prefix and getattr(args, 'cache_prefix', True)
+        # model applied to the batches given by the engine
+        self.batch_model = SuffixModel(model) if self.cache_prefix else model
+        # inference-only copy of the model, see fuse(), and single-trial predictor used by predict, see export()
+        self.fused = None
+        self.predictor = None
+
+    def trainable_params(self):
+        """Parameters to adapt, following args.adapt_params, see configure_adapt_params.
+
+        Returns
+        ----------
+        params : list
+            parameters to adapt, also kept as self.params
+        """
+        self.params = configure_adapt_params(self.model, getattr(self.args, 'adapt_params', 'all'))
+        return self.params
+
+    def predict(self, sample, stream, i):
+        """
+        Parameters
+        ----------
+        sample : torch tensor
+            aligned current trial of shape (1, 1, num_channels, num_time_samples)
+        stream : OnlinePreprocessor or PrefixCache
+            source of the sliding batch, for methods predicting from it
+        i : int
+            index of the current trial in the stream
+
+        Returns
+        ----------
+        outputs : torch tensor
+            logits of shape (1, num_classes), or (num_models, 1, num_classes)
+        """
+        with torch.no_grad():
+            if self.predictor is not None:
+                # the sliding batch, if cached, is encoded at the next update
+                _, outputs = self.predictor(sample)
+            elif self.cache_prefix:
+                # encodes the current trial into the cache on the way
+                _, outputs = self.batch_model(stream.batch(1))
+            else:
+                _, outputs = self.model(sample)
+        return outputs
+
+    def should_update(self, i):
+        return (i + 1) >= self.args.test_batch and (i + 1) % self.args.stride == 0
+
+    def fuse(self):
+        # predict with BatchNorm folded into the convolutions, see EEGNet_fused, if the model is an EEGNet
+        fused = fuse_for_inference(self.model)
+        if fused is not self.model:
+            self.fused = self.predictor = fused
+
+    def export(self, mode, device='cpu'):
+        """Predict with an exported copy of the model, or of its fused copy, see export_predictor.
+
+        Parameters
+        ----------
+        mode : str
+            trace, script or compile
+        device : torch.device
+            device of the model
+
+        Returns
+        ----------
+        mode : str
+            mode actually used, eager if the export fell back to the model
+        """
+        model = self.predictor if self.predictor is not None else self.model
+        predictor, mode = export_predictor(model, self.args.chn, self.args.time_sample_num, mode, device)
+        self.predictor = None if predictor is self.model else predictor
+        return mode
+
+    def quantize(self, calib, every=8, backend='x86'):
+        # predict with an INT8 copy of the model, see QuantizedPredictor
+        self.predictor = QuantizedPredictor(self.model, calib, every, backend)
+
+    def onnx(self, every=1):
+        # predict with a single-trial ONNX export of the model run by onnxruntime, exported again on schedule, see
+        # OnnxPredictor
+        self.predictor = OnnxPredictor(self.model, self.args.chn, self.args.time_sample_num, every, dynamic_batch=False)
+
+    def refresh_predictor(self):
+        # after an update of the model, fold its weights and running statistics again, or re-quantize or re-export them
+        # on schedule
+        if self.fused is not None:
+            self.fused[0].refresh(self.model[0])
+        if isinstance(self.predictor, (QuantizedPredictor, OnnxPredictor)):
+            self.predictor.step()
+
+    def unfuse(self):
+        # predict with the model itself again
+        self.fused = None
+        self.predictor = None
+
+    def adapt(self, batch, i):
+        """
+        Parameters
+        ----------
+        batch : torch tensor
+            latest args.test_batch aligned trials, of shape (test_batch, 1, num_channels, num_time_samples), or their
+            temporal convolution outputs if cache_prefix
+        i : int
+            index of the current trial in the stream
+        """
+        pass
+
+    def skip(self, batch, i):
+        # instead of adapt(), when the engine skips the requested update, for the bookkeeping that must see every trial
+        pass
+
+
+class AsyncAdapter:
+    """Adapts the model of a strategy on a background thread, while predictions are served from published weights.
+
+    The strategy's own model is the shadow copy, only ever touched by the worker thread. After every update its weights
+    are copied into the back one of two serving copies, which is then swapped with the front one under a lock, so that a
+    prediction always sees a complete set of weights. Prediction costs one forward pass of the front copy, and only
+    waits for the worker when more than max_staleness submitted updates are not yet published. With fuse, the serving
+    copies have BatchNorm folded into the convolutions, and publishing folds the updated weights. With export, they are
+    served through single-trial predictors, see export_predictor.
+    """
+    def __init__(self, strategy, max_staleness=1, device='cpu', fuse=False, export='eager'):
+        """
+        Parameters
+        ----------
+        strategy : AdaptStrategy
+            the test-time adaptation method, predicting with the default AdaptStrategy.predict
+        max_staleness : int
+            maximum number of submitted updates a prediction may miss, 0 waits for every update as in synchronous mode
+        device : torch.device
+            device of the model
+        fuse : bool
+            whether serve predictions from EEGNet_fused copies
+        export : str
+            export mode of the serving copies, one of EXPORT_MODES
+        """
+        assert max_staleness >= 0, "max_staleness must be >= 0"
+        self.strategy = strategy
+        self.max_staleness = max_staleness
+        self.device = device
+        self.fuse = fuse
+        self.export = export
+        # double-buffered (copy, predictor) pairs of the published weights, predictions always read the front one
+        self.front = self._serving_copy()
+        self.back = self._serving_copy()
+        self.lock = threading.Lock()
+        self.cond = threading.Condition()
+        self.num_submitted = 0
+        self.num_published = 0
+        self.error = None
+        # time of every model update, in seconds
+        self.update_time = []
+        # on GPU, updates run on their own CUDA stream, so that they do not queue behind predictions
+        self.side_stream = torch.cuda.Stream(device=device) if torch.device(device).type == 'cuda' else None
+        self.tasks = queue.Queue()
+        self.worker = threading.Thread(target=self._work, daemon=True)
+        self.worker.start()
+
+    def predict(self, sample):
+        """
+        Parameters
+        ----------
+        sample : torch tensor
+            aligned current trial of shape (1, 1, num_channels, num_time_samples)
+
+        Returns
+        ----------
+        outputs : torch tensor
+            logits of shape (1, num_classes), from the latest published weights
+        """
+        with self.cond:
+            while self.num_submitted - self.num_published > self.max_staleness and self.error is None:
+                self.cond.wait()
+        self._check()
+        with self.lock, torch.no_grad():
+            _, outputs = self.front[1](sample)
+        return outputs
+
+    def submit(self, batch, i, update=True):
+        """
+        Parameters
+        ----------
+        batch : torch tensor
+            latest aligned trials, copied since the stream overwrites them with the next trial
+        i : int
+            index of the current trial in the stream
+        update : bool
+            whether adapt the model, otherwise the update was gated out and only the strategy's skip() is run
+        """
+        batch = batch.clone()
+        event = None
+        if self.side_stream is not None:
+            event = torch.cuda.Event()
+            event.record()
+        with self.cond:
+            self.num_submitted += 1
+        self.tasks.put((batch, i, event, update))
+
+    def _serving_copy(self):
+        model = copy.deepcopy(self.strategy.model).eval()
+        if self.fuse:
+            model = fuse_for_inference(model)
+        args = self.strategy.args
+        predictor, _ = export_predictor(model, args.chn, args.time_sample_num, self.export, self.device)
+        return model, predictor
+
+    def close(self):
+        # wait for the submitted updates, the strategy's model then holds the fully adapted weights
+        self.tasks.put(None)
+        self.worker.join()
+        self._check()
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError('asynchronous adaptation failed') from self.error
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            try:
+                batch, i, event, update = task
+                if update:
+                    start_time = time.time()
+                    self._adapt(batch, i, event)
+                    self.update_time.append(time.time() - start_time)
+                else:
+                    # on this thread, which alone touches the shadow model, nothing to publish
+                    if event is not None:
+                        event.synchronize()
+                    self.strategy.skip(batch, i)
+            except Exception as e:
+                self.error = e
+            with self.cond:
+                self.num_published += 1
+                self.cond.notify_all()
+            if self.error is not None:
+                return
+
+    def _adapt(self, batch, i, event):
+        model = self.strategy.model
+        ctx = torch.cuda.stream(self.side_stream) if self.side_stream is not None else contextlib.nullcontext()
+        with ctx:
+            if event is not None:
+                self.side_stream.wait_event(event)
+            model.train()
+            self.strategy.adapt(batch, i)
+            model.eval()
+            back = self.back[0]
+            with torch.no_grad():
+                if self.fuse:
+                    back[0].refresh(model[0])
+                    back[1].load_state_dict(model[1].state_dict())
+                else:
+                    for dst, src in zip(back.state_dict().values(), model.state_dict().values()):
+                        dst.copy_(src)
+            if self.side_stream is not None:
+                self.side_stream.synchronize()
+        # publish
+        with self.lock:
+            self.front, self.back = self.back, self.front
+
+
+class OnlineTTAEngine:
+    """Single pass of an online test-time adaptation method over a test stream.
+
+    Trials arrive one by one, are aligned by Incremental EA on the model's device, predicted, and then used to adapt the
+    model. Alignment, buffering, timing and scoring are shared by every method, the method itself is an AdaptStrategy.
+    With args.async_adapt, updates run in the background through an AsyncAdapter, for strategies predicting with the
+    default AdaptStrategy.predict, which with args.fuse_inference predicts with BatchNorm folded into the convolutions,
+    with args.export through a traced, scripted or compiled predictor, with args.quantize through an INT8 one, and with
+    args.onnx through onnxruntime.
+    With args.gate, every update requested by the strategy first goes through an AdaptScheduler, which skips the updates
+    not worth their backward passes, the strategy's skip() then runs instead of adapt(). Strategies adapting inside
+    predict(), such as CoTTA, are never gated.
+    """
+    def __init__(self, strategy, args, balanced=True):
+        """
+        Parameters
+        ----------
+        strategy : AdaptStrategy
+            the test-time adaptation method
+        args : argparse.Namespace
+            experiment arguments, using chn, time_sample_num, align, data_env, test_batch, class_num and calc_time,
+            and optionally adapt_params, cache_prefix, fuse_inference, export, quantize (with calib_loader, quant_calib,
+            quant_every and quant_backend), onnx (with onnx_every), async_adapt, max_staleness, gate, gate_entropy,
+            gate_shift, gate_drift and gate_max_skip
+        balanced : bool
+            whether the test stream is class-balanced, scored by accuracy if so, otherwise by AUC
+        """
+        self.strategy = strategy
+        self.args = args
+        self.balanced = balanced
+        self.device = torch.device('cuda' if args.data_env != 'local' else 'cpu')
+        self.stream = None
+        self.cache = None
+        self.scheduler = None
+        self.y_true = []
+        # time of every prediction and of every model update, in seconds
+        self.predict_time = []
+        self.update_time = []
+
+    def run(self, loader):
+        """
+        Parameters
+        ----------
+        loader : torch DataLoader
+            test stream with a batch size of 1
+
+        Returns
+        ----------
+        score : float or list
+            accuracy or AUC in %, one per model if the strategy predicts with several models
+        y_pred : numpy array or list
+            softmax outputs of shape (num_test_samples, num_classes), one per model if the strategy predicts with
+            several models
+        """
+        args = self.args
+        if self.balanced == False and args.data_name == 'BNCI2014001-4':
+            print('ERROR, imbalanced multi-class not implemented')
+            sys.exit(0)
+
+        strategy = self.strategy
+        # latest test trials in float32 on the model's device, aligned by Incremental EA
+        self.stream = OnlinePreprocessor(args.test_batch, args.chn, args.time_sample_num, align=args.align,
+                                         device=self.device)
+        # sliding batches, and the predictions of strategies using them, come from the cache if the strategy opted in
+        self.cache = PrefixCache(strategy.model[0], self.stream) if strategy.cache_prefix else None
+        source = self.stream if self.cache is None else self.cache
+        self.y_true = []
+        y_pred = []
+
+        fuse = getattr(args, 'fuse_inference', False)
+        export = getattr(args, 'export', 'eager')
+        quantize = getattr(args, 'quantize', False)
+        onnx = getattr(args, 'onnx', False)
+        if (fuse or export != 'eager' or quantize or onnx) and type(strategy).predict is not AdaptStrategy.predict:
+            print(type(strategy).__name__, 'predicts with its own forward pass, predicting without fusion, export, '
+                                           'quantization or ONNX')
+            fuse, export, quantize, onnx = False, 'eager', False, False
+        if quantize and getattr(args, 'async_adapt', False):
+            print('quantized prediction is re-quantized after synchronous updates only, predicting in float')
+            quantize = False
+        if onnx and getattr(args, 'async_adapt', False):
+            print('ONNX prediction is re-exported after synchronous updates only, predicting with torch')
+            onnx = False
+
+        adapter = None
+        if getattr(args, 'async_adapt', False):
+            if type(strategy).predict is AdaptStrategy.predict:
+                adapter = AsyncAdapter(strategy, getattr(args, 'max_staleness', 1), self.device, fuse=fuse,
+                                       export=export)
+            else:
+                print(type(strategy).__name__, 'predicts with the model being adapted, adapting synchronously')
+        elif quantize:
+            # the INT8 model is rebuilt from the float one, folding and export do not apply to it
+            calib = calibration_trials(args.calib_loader, getattr(args, 'quant_calib', 256))
+            strategy.quantize(calib, getattr(args, 'quant_every', 8), getattr(args, 'quant_backend', 'x86'))
+        elif onnx:
+            # onnxruntime runs its own graph optimizations on an export of the fused model
+            strategy.onnx(getattr(args, 'onnx_every', 1))
+        else:
+            if fuse:
+                strategy.fuse()
+            if export != 'eager':
+                strategy.export(export, self.device)
+
+        if getattr(args, 'gate', False):
+            self.scheduler = AdaptScheduler(entropy_thresh=getattr(args, 'gate_entropy', None),
+                                            shift_thresh=getattr(args, 'gate_shift', None),
+                                            drift_thresh=getattr(args, 'gate_drift', None),
+                                            max_skip=getattr(args, 'gate_max_skip', 3))
+
+        try:
+            # loop through test data stream one by one
+            for i, (inputs, labels) in enumerate(loader):
+                #################### Phase 1: target label prediction ####################
+                if adapter is None:
+                    strategy.model.eval()
+                # accumulate test data, with Incremental EA of the current test sample
+                sample_test = self.stream.push(inputs)
+                if args.align and args.calc_time:
+                    print('sample ', str(i), ', pre-inference IEA finished time in ms:', np.round(self.stream.latency[-1] * 1000, 3))
+
+                start_time = time.time()
+                if adapter is None:
+                    outputs = strategy.predict(sample_test, source, i)
+                else:
+                    outputs = adapter.predict(sample_test)
+                softmax_out = torch.softmax(outputs.detach().float(), dim=-1).reshape(-1, args.class_num)
+
+                y_pred.append(softmax_out.cpu().numpy())
+                self.predict_time.append(time.time() - start_time)
+                self.y_true.append(labels.item())
+                if args.calc_time:
+                    print('sample ', str(i), ', inference finished in ms:', np.round(self.predict_time[-1] * 1000, 3))
+
+                #################### Phase 2: target model update ####################
+                if strategy.should_update(i) and not self._gate(y_pred):
+                    if type(strategy).skip is not AdaptStrategy.skip:
+                        batch_test = source.batch(args.test_batch)
+                        if adapter is not None:
+                            adapter.submit(batch_test, i, update=False)
+                        else:
+                            strategy.skip(batch_test, i)
+                elif strategy.should_update(i):
+                    # sliding batch
+                    batch_test = source.batch(args.test_batch)
+
+                    if adapter is not None:
+                        adapter.submit(batch_test, i)
+                    else:
+                        strategy.model.train()
+                        start_time = time.time()
+                        strategy.adapt(batch_test, i)
+                        strategy.refresh_predictor()
+                        self.update_time.append(time.time() - start_time)
+                        if args.calc_time:
+                            print('sample ', str(i), ', post-inference model update finished in ms:', np.round(self.update_time[-1] * 1000, 3))
+                        strategy.model.eval()
+        finally:
+            if adapter is not None:
+                adapter.close()
+                self.update_time = adapter.update_time
+            predictor = strategy.predictor
+            strategy.unfuse()
+
+        if isinstance(predictor, QuantizedPredictor) and predictor.acc_float is not None:
+            self._record('Quantized predictor ({}): {} quantizations, source accuracy float {:.2f}%, int8 {:.2f}% '
+                         '(delta {:+.2f}%)'.format(predictor.backend, predictor.num_quantized, predictor.acc_float,
+                                                  predictor.acc_quant, predictor.acc_quant - predictor.acc_float))
+        if isinstance(predictor, OnnxPredictor):
+            self._record('ONNX predictor ({}): {} exports, mean export time {:.3f} ms'.format(
+                ', '.join(predictor.providers), len(predictor.export_time), np.mean(predictor.export_time) * 1000))
+
+        if getattr(strategy, 'params', None) is not None:
+            num_params = sum(p.numel() for p in strategy.params)
+            num_total = sum(p.numel() for p in strategy.model.parameters())
+            log_str = 'Adapted parameters: {}/{} ({}), prefix cache {}'.format(
+                num_params, num_total, getattr(args, 'adapt_params', 'all'), 'on' if strategy.cache_prefix else 'off')
+            if len(self.update_time) > 0:
+                log_str += ', mean update time {:.3f} ms'.format(np.mean(self.update_time) * 1000)
+            self._record(log_str)
+        if any(isinstance(m, TemporalConv) and m.impl == 'auto' for m in strategy.model.modules()):
+            self._record('Temporal convolution: ' + describe_auto_impl())
+        if self.scheduler is not None:
+            self._record('Gated updates: {}/{} run, {:.2f}% of update compute saved'.format(
+                self.scheduler.num_updates, self.scheduler.num_requests, self.scheduler.compute_saved() * 100))
+
+        # (num_test_samples, num_models, num_classes)
+        y_pred = np.array(y_pred)
+        scores = [self.score(y_pred[:, m]) for m in range(strategy.num_models)]
+        if strategy.num_models == 1:
+            return scores[0], y_pred[:, 0]
+        return scores, [y_pred[:, m] for m in range(strategy.num_models)]
+
+    def _record(self, log_str):
+        print(log_str)
+        if getattr(self.args, 'log', None) is not None:
+            self.args.log.record(log_str)
+
+    def _gate(self, y_pred):
+        # whether run the update requested by the strategy, from the predictions on the sliding batch and R
+        if self.scheduler is None:
+            return True
+        R = self.stream.aligner.R if self.args.align else None
+        return self.scheduler.should_update(np.concatenate(y_pred[-self.args.test_batch:]), R)
+
+    def score(self, y_pred):
+        """
+        Parameters
+        ----------
+        y_pred : numpy array
+            softmax outputs of shape (num_test_samples, num_classes)
+
+        Returns
+        ----------
+        score : float
+            accuracy if the stream is balanced, otherwise AUC of the positive class, in %
+        """
+        if self.balanced:
+            _, predict = torch.max(torch.from_numpy(y_pred).to(torch.float32), 1)
+            pred = torch.squeeze(predict).float()
+            score = accuracy_score(self.y_true, pred)
+        else:
+            score = roc_auc_score(self.y_true, y_pred[:, 1])  # binary
+        return score * 100
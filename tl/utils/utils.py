@@ -16,10 +16,11 @@ import moabb
 import mne
 import learn2learn as l2l
 from sklearn.metrics import balanced_accuracy_score, accuracy_score, roc_auc_score
-from scipy.linalg import fractional_matrix_power
 from learn2learn.data.transforms import NWays, KShots, LoadData
 
-from tl.utils.alg_utils import EA, EA_online
+from tl.utils.alg_utils import EA, EA_online_batch
+from tl.utils.cache import aligned_subjects
+from tl.utils.batch_loader import TensorBatchLoader
 
 from moabb.datasets import BNCI2014001, BNCI2014002, BNCI2014008, BNCI2014009, BNCI2015003, BNCI2015004, EPFLP300, \
     BNCI2014004, BNCI2015001
@@ -222,9 +223,29 @@ def cal_auc(loader, netF, netC):
     return auc * 100, all_output
 
 
+def fuse_for_inference(model):
+    # inference-only copy of an EEGNet model, or of nn.Sequential(netF, netC), with BatchNorm folded into the
+    # convolutions, see EEGNet_fused. Other models are returned as is
+    if hasattr(model, 'fuse_for_inference'):
+        return model.fuse_for_inference()
+    if isinstance(model, nn.Sequential) and hasattr(model[0], 'fuse_for_inference'):
+        return nn.Sequential(model[0].fuse_for_inference(), *model[1:]).eval()
+    return model
+
+
+def onnx_predictor(model, args):
+    # ONNX export of the model run by onnxruntime, see OnnxPredictor, imported here as onnxruntime is optional
+    from utils.onnx_export import OnnxPredictor
+    return OnnxPredictor(model, args.chn, args.time_sample_num)
+
+
 def cal_acc_comb(loader, model, flag=True, fc=None, args=None):
     start_test = True
     model.eval()
+    if getattr(args, 'fuse_inference', False):
+        model = fuse_for_inference(model)
+    if flag and getattr(args, 'onnx', False):
+        model = onnx_predictor(model, args)
     with tr.no_grad():
         iter_test = iter(loader)
         for i in range(len(loader)):
@@ -265,56 +286,41 @@ def convert_label(labels, axis, threshold):
 
 
 def cal_score_online(loader, model, args):
-    y_true = []
-    y_pred = []
+    # Without model updates, the prediction of a test trial only depends on the trials up to itself, through the
+    # Incremental EA reference matrix. The whole stream is therefore aligned at once and scored with large batches,
+    # giving the same result as predicting trial by trial.
     model.eval()
-    # initialize test reference matrix for Incremental EA
-    if args.align:
-        R = 0
-    with tr.no_grad():
-        iter_test = iter(loader)
-        for i in range(len(loader)):
-            data = next(iter_test)
-            inputs = data[0].cpu()
-            labels = data[1]
-            if i == 0:
-                data_cum = inputs.float().cpu()
-            else:
-                data_cum = tr.cat((data_cum, inputs.float().cpu()), 0)
+    if getattr(args, 'onnx', False):
+        model = onnx_predictor(model, args)
+    inputs = []
+    labels = []
+    for data in loader:
+        inputs.append(data[0].cpu())
+        labels.append(data[1].cpu())
+    inputs = tr.cat(inputs).reshape(-1, args.chn, args.time_sample_num)
+    all_label = tr.cat(labels).float()
 
-            if args.align:
-                # update reference matrix
-                R = EA_online(inputs.reshape(args.chn, args.time_sample_num), R, i)
-                sqrtRefEA = fractional_matrix_power(R, -0.5)
-                # transform current test sample
-                inputs = np.dot(sqrtRefEA, inputs)
-                inputs = inputs.reshape(1, 1, args.chn, args.time_sample_num)
+    if args.align:
+        inputs = tr.from_numpy(EA_online_batch(inputs.numpy()))
+    inputs = inputs.reshape(-1, 1, args.chn, args.time_sample_num).to(tr.float32)
 
-            inputs = torch.from_numpy(inputs).to(torch.float32)
+    all_output = []
+    with tr.no_grad():
+        for start in range(0, len(inputs), 256):
+            batch = inputs[start:start + 256]
             if args.data_env != 'local':
-                inputs = inputs.cuda()
-            _, outputs = model(inputs)
-            outputs = outputs.float().cpu()
-            labels = labels.float().cpu()
-            _, predict = tr.max(outputs, 1)
-            pred = tr.squeeze(predict).float()
-            y_pred.append(pred.item())
-            y_true.append(labels.item())
-
-            if i == 0:
-                all_output = outputs.float().cpu()
-                all_label = labels.float()
-            else:
-                all_output = tr.cat((all_output, outputs.float().cpu()), 0)
-                all_label = tr.cat((all_label, labels.float()), 0)
+                batch = batch.cuda()
+            _, outputs = model(batch)
+            all_output.append(outputs.float().cpu())
+    all_output = tr.cat(all_output)
 
     if hasattr(args, 'balanced') and args.balanced:
-        score = accuracy_score(y_true, y_pred)
+        _, predict = tr.max(all_output, 1)
+        score = accuracy_score(all_label, predict.float())
     else:
         all_output = nn.Softmax(dim=1)(all_output)
-        true = all_label.cpu()
         pred = all_output[:, 1].detach().numpy()
-        score = roc_auc_score(true, pred)
+        score = roc_auc_score(all_label, pred)
 
     return score * 100
 
@@ -322,6 +328,10 @@ def cal_score_online(loader, model, args):
 def cal_auc_comb(loader, model, flag=True, fc=None, args=None):
     start_test = True
     model.eval()
+    if getattr(args, 'fuse_inference', False):
+        model = fuse_for_inference(model)
+    if flag and getattr(args, 'onnx', False):
+        model = onnx_predictor(model, args)
     with tr.no_grad():
         iter_test = iter(loader)
         for i in range(len(loader)):
@@ -391,10 +401,11 @@ def cal_metrics_multisource(loader, nets, args, metrics):
     return score * 100
 
 
-def data_alignment(X, num_subjects, args):
+def data_alignment(X, num_subjects, args, subject_ids=None):
     '''
     :param X: np array, EEG data
     :param num_subjects: int, number of total subjects in X
+    :param subject_ids: list, dataset subject index of each subject in X, enables the aligned-data cache
     :return: np array, aligned EEG data
     '''
     # subject-wise EA
@@ -423,11 +434,14 @@ def data_alignment(X, num_subjects, args):
         print('after EA:', X.shape)
     else:
         print('before EA:', X.shape)
-        out = []
-        for i in range(num_subjects):
-            tmp_x = EA(X[X.shape[0] // num_subjects * i:X.shape[0] // num_subjects * (i + 1), :, :])
-            out.append(tmp_x)
-        X = np.concatenate(out, axis=0)
+        # subjects hold equal numbers of trials, align all of them in one batched pass
+        trial_num = X.shape[0] // num_subjects
+        X = X[:trial_num * num_subjects].reshape(num_subjects, trial_num, X.shape[1], X.shape[2])
+        if subject_ids is not None and getattr(args, 'align_cache', True):
+            X = aligned_subjects(X, subject_ids, args)
+        else:
+            X = EA(X)
+        X = X.reshape(num_subjects * trial_num, X.shape[2], X.shape[3])
         print('after EA:', X.shape)
     return X
 
@@ -440,8 +454,9 @@ def data_loader(Xs=None, Ys=None, Xt=None, Yt=None, args=None):
     Xt_copy = Xt
     if args.align:
         # offline EA
-        Xs = data_alignment(Xs, args.N - 1, args)
-        Xt = data_alignment(Xt, 1, args)
+        src_ids = [s for s in range(args.N) if s != args.idt]
+        Xs = data_alignment(Xs, args.N - 1, args, subject_ids=src_ids)
+        Xt = data_alignment(Xt, 1, args, subject_ids=[args.idt])
 
     Xs, Ys = tr.from_numpy(Xs).to(
         tr.float32), tr.from_numpy(Ys.reshape(-1, )).to(tr.long)
@@ -458,16 +473,18 @@ def data_loader(Xs=None, Ys=None, Xt=None, Yt=None, args=None):
     if args.data_env != 'local':
         Xs, Ys, Xt, Yt = Xs.cuda(), Ys.cuda(), Xt.cuda(), Yt.cuda()
 
-    data_src = Data.TensorDataset(Xs, Ys)
-    data_tar = Data.TensorDataset(Xt, Yt)
+    # batches gathered by index from contiguous storage, in the same order as DataLoader, see TensorBatchLoader. The
+    # permuted trials are made contiguous once here, shared by the train and test loaders
+    Xs, Xt = Xs.contiguous(), Xt.contiguous()
+    prefetch = getattr(args, 'prefetch', False)
 
     # for TL train
-    dset_loaders["source"] = Data.DataLoader(data_src, batch_size=train_bs, shuffle=True, drop_last=True)
-    dset_loaders["target"] = Data.DataLoader(data_tar, batch_size=train_bs, shuffle=True, drop_last=True)
+    dset_loaders["source"] = TensorBatchLoader(Xs, Ys, batch_size=train_bs, shuffle=True, drop_last=True, prefetch=prefetch)
+    dset_loaders["target"] = TensorBatchLoader(Xt, Yt, batch_size=train_bs, shuffle=True, drop_last=True, prefetch=prefetch)
 
     # for TL test
-    dset_loaders["Source"] = Data.DataLoader(data_src, batch_size=train_bs * 3, shuffle=False, drop_last=False)
-    dset_loaders["Target"] = Data.DataLoader(data_tar, batch_size=train_bs * 3, shuffle=False, drop_last=False)
+    dset_loaders["Source"] = TensorBatchLoader(Xs, Ys, batch_size=train_bs * 3, shuffle=False, drop_last=False)
+    dset_loaders["Target"] = TensorBatchLoader(Xt, Yt, batch_size=train_bs * 3, shuffle=False, drop_last=False)
 
     if args.method == 'EEGNet':
         # IEA baseline EEGNet results.
@@ -476,21 +493,9 @@ def data_loader(Xs=None, Ys=None, Xt=None, Yt=None, args=None):
         # Online(Incremental) EA
         # Much proper way to do EA for target subject considering online BCIs
         # For offline EA, refer to tl/utils/alg_utils.py line12
-        Xt_aligned = []
-        R = 0
-        num_samples = 0
-        for ind in range(len(Xt_copy)):
-            curr = Xt_copy[ind]
-            cov = np.cov(curr)
-            # Note that the following line is an update of the mean covariance matrix (R), instead of a full recalculation. It is much faster computation in this way.
-            # Note also that the covariance matrix calculation should take in all visible samples(trials) for this domain(subject)
-            R = (R * num_samples + cov) / (num_samples + 1)
-            num_samples += 1
-            sqrtRefEA = fractional_matrix_power(R, -0.5)
-            # transform the original trial, and use all latter algorithms only use the transformed data
-            curr_aligned = np.dot(sqrtRefEA, curr)
-            Xt_aligned.append(curr_aligned)
-        Xt_aligned = np.array(Xt_aligned)
+        # Note that each trial is aligned with the mean covariance matrix of all visible samples(trials) for this domain(subject), i.e., itself and the former ones.
+        # All reference matrices are computed at once from prefix sums of the covariances, see EA_online_batch.
+        Xt_aligned = EA_online_batch(Xt_copy)
         # EA done
 
         Xt_aligned = tr.from_numpy(Xt_aligned).to(tr.float32)